@@ -0,0 +1,207 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any
+
+import c_header
+
+INDEX_FILE_NAME = "index.json"
+INDEX_VERSION = 1
+VECTORS_DIR_NAME = "data"
+VECTORS_SCHEMA_FILE_NAME = "schema.json"
+
+
+def hash_file(fp: Path) -> str:
+    return hashlib.sha256(fp.read_bytes()).hexdigest()
+
+
+def build_benchmark_record(benchmark_dir: Path) -> dict[str, Any]:
+    name = benchmark_dir.name
+    h_fp = benchmark_dir / f"{name}.h"
+    top_fp = benchmark_dir / "top.txt"
+
+    header = c_header.scan(h_fp.read_text())
+    top_fn_name = top_fp.read_text().strip()
+    top_fn = header.get_function(top_fn_name)
+    if top_fn is None:
+        raise ValueError(f"Top function {top_fn_name} not declared in {h_fp}")
+
+    args = []
+    for arg in top_fn.args:
+        shape = []
+        for dim in arg.dims:
+            extent = c_header.evaluate_expression(dim, header)
+            if not isinstance(extent, int):
+                raise ValueError(f"Non integer array extent {dim} for {arg.name}")
+            shape.append(extent)
+        args.append(
+            {
+                "name": arg.name,
+                "type": arg.type,
+                "c_type": c_header.resolve_type(arg.type, header),
+                "dims": arg.dims,
+                "shape": shape,
+            }
+        )
+
+    structs = {}
+    for struct in header.structs:
+        struct_name = struct.name or struct.tag
+        if struct_name is None or struct_name == "bench_args_t":
+            continue
+        structs[struct_name] = [
+            {
+                "name": f.name,
+                "c_type": c_header.resolve_type(f.type, header),
+                "shape": [c_header.evaluate_expression(d, header) for d in f.dims],
+            }
+            for f in struct.fields
+        ]
+
+    directive_files = sorted(fp.name for fp in benchmark_dir.glob("*_dir.tcl"))
+
+    return {
+        "top": top_fn.name,
+        "return_type": c_header.resolve_type(top_fn.return_type, header),
+        "signature": top_fn.signature,
+        "args": args,
+        "structs": structs,
+        "defines": c_header.evaluate_defines(header),
+        "directive_file": directive_files[0] if directive_files else None,
+        "test_vectors": (
+            benchmark_dir / VECTORS_DIR_NAME / VECTORS_SCHEMA_FILE_NAME
+        ).exists(),
+        "files": {
+            fp.name: hash_file(fp)
+            for fp in sorted(benchmark_dir.glob("*"))
+            if fp.is_file()
+        },
+    }
+
+
+def write_benchmark_index(
+    benchmarks_dir: Path, records: dict[str, dict[str, Any]]
+) -> bool:
+    index_fp = benchmarks_dir / INDEX_FILE_NAME
+    index_txt = json.dumps(
+        {"version": INDEX_VERSION, "benchmarks": dict(sorted(records.items()))},
+        separators=(",", ":"),
+    )
+    # only touch the file when something changed so mtimes stay meaningful
+    if index_fp.exists() and index_fp.read_text() == index_txt:
+        return False
+    index_fp.write_text(index_txt)
+    return True
+
+
+class Benchmark:
+    # Metadata comes from index.json, the kernel sources are only read from disk
+    # the first time they are asked for.
+
+    __slots__ = (
+        "name",
+        "directory",
+        "record",
+        "_source",
+        "_header",
+        "_directives",
+        "_description",
+    )
+
+    def __init__(self, name: str, directory: Path, record: dict[str, Any]):
+        self.name = name
+        self.directory = directory
+        self.record = record
+        self._source: str | None = None
+        self._header: str | None = None
+        self._directives: str | None = None
+        self._description: str | None = None
+
+    def __repr__(self) -> str:
+        return f"Benchmark({self.name!r}, top={self.top!r})"
+
+    @property
+    def top(self) -> str:
+        return self.record["top"]
+
+    @property
+    def args(self) -> list[dict[str, Any]]:
+        return self.record["args"]
+
+    @property
+    def defines(self) -> dict[str, int | float | str]:
+        return self.record["defines"]
+
+    @property
+    def files(self) -> dict[str, str]:
+        return self.record["files"]
+
+    @property
+    def source_fp(self) -> Path:
+        return self.directory / f"{self.name}.cpp"
+
+    @property
+    def header_fp(self) -> Path:
+        return self.directory / f"{self.name}.h"
+
+    @property
+    def directive_fp(self) -> Path | None:
+        if self.record["directive_file"] is None:
+            return None
+        return self.directory / self.record["directive_file"]
+
+    @property
+    def source(self) -> str:
+        if self._source is None:
+            self._source = self.source_fp.read_text()
+        return self._source
+
+    @property
+    def header(self) -> str:
+        if self._header is None:
+            self._header = self.header_fp.read_text()
+        return self._header
+
+    @property
+    def directives(self) -> str:
+        if self._directives is None:
+            directive_fp = self.directive_fp
+            self._directives = "" if directive_fp is None else directive_fp.read_text()
+        return self._directives
+
+    @property
+    def description(self) -> str:
+        if self._description is None:
+            self._description = (self.directory / "kernel_description.md").read_text()
+        return self._description
+
+    def test_vectors(self, kind: str = "input") -> dict[str, Any]:
+        # numpy is only needed by callers that actually use the vectors
+        from vectors import load_test_vectors
+
+        return load_test_vectors(self.directory, kind)
+
+    def is_stale(self) -> bool:
+        return any(
+            not (self.directory / file_name).exists()
+            or hash_file(self.directory / file_name) != file_hash
+            for file_name, file_hash in self.files.items()
+        )
+
+
+def load_benchmarks(benchmarks_dir: Path) -> dict[str, Benchmark]:
+    index_fp = benchmarks_dir / INDEX_FILE_NAME
+    if index_fp.exists():
+        index = json.loads(index_fp.read_text())
+        records = index["benchmarks"]
+    else:
+        # trees produced before index.json existed
+        records = {
+            benchmark_dir.name: build_benchmark_record(benchmark_dir)
+            for benchmark_dir in sorted(benchmarks_dir.glob("*"))
+            if (benchmark_dir / "top.txt").exists()
+        }
+    return {
+        name: Benchmark(name, benchmarks_dir / name, record)
+        for name, record in sorted(records.items())
+    }
@@ -0,0 +1,553 @@
+import ast
+import operator
+import re
+from dataclasses import dataclass, field
+
+# One pass, single compiled tokenizer. Every alternative either matches a
+# fixed prefix or a run of characters from a disjoint class, so scanning is
+# linear in the size of the input no matter how it is laid out.
+TOKEN_RE = re.compile(
+    r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<directive>^[ \t]*\#(?:[^\n\\]|\\.)*)
+    |(?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    |(?P<ident>[A-Za-z_]\w*)
+    |(?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+    |(?P<punct>->|<<|>>|\+\+|--|&&|\|\||[<>!=+\-*/%&|^]=|\.\.\.|[{}()\[\];,.<>+\-*/%&|^!~?:=\#])
+    |(?P<newline>\n)
+    |(?P<space>[ \t\r\f\v]+)
+    |(?P<other>.)
+    """,
+    re.MULTILINE | re.DOTALL | re.VERBOSE,
+)
+
+RE_DEFINE = re.compile(r"#\s*define\s+(\w+)(\([^)]*\))?(.*)", re.DOTALL)
+RE_TRAILING_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+OPEN_BRACKETS = {"(": ")", "[": "]", "{": "}"}
+CLOSE_BRACKETS = {")", "]", "}"}
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    start: int
+    end: int
+
+
+@dataclass
+class CDefine:
+    name: str
+    body: str
+    params: list[str] | None = None
+
+
+@dataclass
+class CDeclarator:
+    name: str
+    type: str
+    dims: list[str] = field(default_factory=list)
+
+    @property
+    def is_pointer(self) -> bool:
+        return "*" in self.type
+
+
+@dataclass
+class CStruct:
+    tag: str | None
+    name: str | None
+    fields: list[CDeclarator]
+    start: int
+    end: int
+
+
+@dataclass
+class CFunction:
+    name: str
+    return_type: str
+    args: list[CDeclarator]
+    start: int
+    end: int
+    body_start: int | None = None
+    body_end: int | None = None
+
+    @property
+    def is_definition(self) -> bool:
+        return self.body_start is not None
+
+    @property
+    def signature(self) -> str:
+        args = ", ".join(
+            f"{arg.type} {arg.name}" + "".join(f"[{d}]" for d in arg.dims)
+            for arg in self.args
+        )
+        return f"{self.return_type} {self.name}({args})"
+
+
+@dataclass
+class CHeader:
+    text: str
+    defines: dict[str, CDefine] = field(default_factory=dict)
+    typedefs: dict[str, str] = field(default_factory=dict)
+    structs: list[CStruct] = field(default_factory=list)
+    functions: list[CFunction] = field(default_factory=list)
+
+    @property
+    def prototypes(self) -> list[CFunction]:
+        return [f for f in self.functions if not f.is_definition]
+
+    @property
+    def definitions(self) -> list[CFunction]:
+        return [f for f in self.functions if f.is_definition]
+
+    def get_struct(self, name: str) -> CStruct | None:
+        for struct in self.structs:
+            if name in (struct.tag, struct.name):
+                return struct
+        return None
+
+    def get_function(self, name: str) -> CFunction | None:
+        for function in self.functions:
+            if function.name == name:
+                return function
+        return None
+
+
+def tokenize(text: str) -> list[Token]:
+    return [
+        Token(m.lastgroup, m.group(), m.start(), m.end())  # type: ignore[arg-type]
+        for m in TOKEN_RE.finditer(text)
+    ]
+
+
+def parse_define(directive: str) -> CDefine | None:
+    directive = directive.strip().replace("\\\n", " ")
+    m = RE_DEFINE.match(directive)
+    if m is None:
+        return None
+    name, params, body = m.groups()
+    body = " ".join(RE_TRAILING_COMMENT.sub(" ", body).split())
+    if params is None:
+        return CDefine(name, body)
+    return CDefine(
+        name, body, [p.strip() for p in params[1:-1].split(",") if p.strip()]
+    )
+
+
+def split_top_level(tokens: list[Token], separator: str) -> list[list[Token]]:
+    parts: list[list[Token]] = [[]]
+    depth = 0
+    for token in tokens:
+        if token.text in OPEN_BRACKETS:
+            depth += 1
+        elif token.text in CLOSE_BRACKETS:
+            depth -= 1
+        if depth == 0 and token.text == separator:
+            parts.append([])
+        else:
+            parts[-1].append(token)
+    return [part for part in parts if part]
+
+
+def matching_bracket(tokens: list[Token], open_idx: int) -> int:
+    depth = 0
+    for i in range(open_idx, len(tokens)):
+        if tokens[i].text in OPEN_BRACKETS:
+            depth += 1
+        elif tokens[i].text in CLOSE_BRACKETS:
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError(
+        f"Unbalanced '{tokens[open_idx].text}' at {tokens[open_idx].start}"
+    )
+
+
+def span_text(text: str, tokens: list[Token]) -> str:
+    if not tokens:
+        return ""
+    return " ".join(text[tokens[0].start : tokens[-1].end].split())
+
+
+def parse_declarator(text: str, tokens: list[Token]) -> CDeclarator | None:
+    # <type tokens> <name> [dim]... ; the name is the last identifier before the
+    # first array bracket
+    first_bracket = next(
+        (i for i, t in enumerate(tokens) if t.text == "["), len(tokens)
+    )
+    name_idx = None
+    for i in range(first_bracket - 1, -1, -1):
+        if tokens[i].kind == "ident":
+            name_idx = i
+            break
+    if name_idx is None or name_idx == 0:
+        return None
+    decl_type = span_text(text, tokens[:name_idx])
+    dims = []
+    i = first_bracket
+    while i < len(tokens) and tokens[i].text == "[":
+        close_idx = matching_bracket(tokens, i)
+        dims.append(span_text(text, tokens[i + 1 : close_idx]))
+        i = close_idx + 1
+    return CDeclarator(tokens[name_idx].text, decl_type, dims)
+
+
+def parse_fields(text: str, tokens: list[Token]) -> list[CDeclarator]:
+    fields = []
+    for statement in split_top_level(tokens, ";"):
+        # "TYPE x, y, z;" declares several fields of one type
+        parts = split_top_level(statement, ",")
+        first = parse_declarator(text, parts[0])
+        if first is None:
+            continue
+        fields.append(first)
+        for part in parts[1:]:
+            extra = parse_declarator(text, statement[:1] + part)
+            if extra is not None:
+                extra.type = first.type
+                fields.append(extra)
+    return fields
+
+
+def parse_function(
+    text: str, tokens: list[Token], paren_idx: int, end: int
+) -> CFunction | None:
+    if paren_idx == 0 or tokens[paren_idx - 1].kind != "ident":
+        return None
+    # "int x = sizeof(...);" is an initialized variable, not a prototype
+    if any(t.text == "=" for t in tokens[:paren_idx]):
+        return None
+    close_idx = matching_bracket(tokens, paren_idx)
+    name = tokens[paren_idx - 1].text
+    return_type = span_text(text, tokens[: paren_idx - 1])
+    if not return_type:
+        return None
+    args = []
+    arg_tokens = tokens[paren_idx + 1 : close_idx]
+    if not (len(arg_tokens) == 1 and arg_tokens[0].text == "void"):
+        for part in split_top_level(arg_tokens, ","):
+            arg = parse_declarator(text, part)
+            if arg is not None:
+                args.append(arg)
+    return CFunction(name, return_type, args, tokens[0].start, end)
+
+
+def parse_statement(text: str, tokens: list[Token], end: int, header: CHeader):
+    if not tokens:
+        return
+    if tokens[0].text == "typedef":
+        body = tokens[1:]
+        brace_idx = next((i for i, t in enumerate(body) if t.text == "{"), None)
+        if brace_idx is not None and body[0].text in ("struct", "union"):
+            close_idx = matching_bracket(body, brace_idx)
+            tag = body[1].text if brace_idx == 2 else None
+            names = [t.text for t in body[close_idx + 1 :] if t.kind == "ident"]
+            header.structs.append(
+                CStruct(
+                    tag,
+                    names[-1] if names else None,
+                    parse_fields(text, body[brace_idx + 1 : close_idx]),
+                    tokens[0].start,
+                    end,
+                )
+            )
+            return
+        declarator = parse_declarator(text, body)
+        if declarator is not None:
+            header.typedefs[declarator.name] = declarator.type
+        return
+
+    if (
+        tokens[0].text in ("struct", "union")
+        and len(tokens) > 2
+        and tokens[1].kind == "ident"
+        and tokens[2].text == "{"
+    ):
+        close_idx = matching_bracket(tokens, 2)
+        header.structs.append(
+            CStruct(
+                tokens[1].text,
+                None,
+                parse_fields(text, tokens[3:close_idx]),
+                tokens[0].start,
+                end,
+            )
+        )
+        return
+
+    paren_idx = next((i for i, t in enumerate(tokens) if t.text == "("), None)
+    if paren_idx is not None and tokens[-1].text == ")":
+        function = parse_function(text, tokens, paren_idx, end)
+        if function is not None:
+            header.functions.append(function)
+
+
+def scan(text: str) -> CHeader:
+    header = CHeader(text)
+    tokens = []
+    for token in tokenize(text):
+        if token.kind == "directive":
+            define = parse_define(token.text)
+            if define is not None:
+                header.defines[define.name] = define
+        elif token.kind not in ("comment", "newline", "space"):
+            tokens.append(token)
+
+    # walk top level declarations; a statement ends at ";" or, for function
+    # definitions, at the closing brace of the body
+    i = 0
+    statement_start = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.text == ";":
+            parse_statement(text, tokens[statement_start:i], token.end, header)
+            statement_start = i + 1
+        elif token.text in OPEN_BRACKETS:
+            close_idx = matching_bracket(tokens, i)
+            statement = tokens[statement_start:i]
+            if token.text == "{" and statement and statement[-1].text == ")":
+                paren_idx = next(j for j, t in enumerate(statement) if t.text == "(")
+                function = parse_function(
+                    text, statement, paren_idx, tokens[close_idx].end
+                )
+                if function is not None:
+                    function.body_start = token.start
+                    function.body_end = tokens[close_idx].end
+                    header.functions.append(function)
+                statement_start = close_idx + 1
+            i = close_idx
+        i += 1
+    return header
+
+
+def find_top_function(header: CHeader, source_text: str | None = None) -> CFunction:
+    prototypes = header.prototypes
+    if len(prototypes) == 0:
+        raise ValueError("No function prototypes found in header")
+    if len(prototypes) == 1 or source_text is None:
+        return prototypes[-1]
+
+    # the top function is the declared function that no other function in the
+    # kernel source calls
+    source = scan(source_text)
+    called: set[str] = set()
+    for definition in source.definitions:
+        assert definition.body_start is not None and definition.body_end is not None
+        body = source_text[definition.body_start : definition.body_end]
+        called.update(
+            t.text
+            for t in tokenize(body)
+            if t.kind == "ident" and t.text != definition.name
+        )
+    candidates = [p for p in prototypes if p.name not in called]
+    if candidates:
+        return candidates[-1]
+    return prototypes[-1]
+
+
+C_BUILTIN_CONSTANTS: dict[str, int] = {
+    "INT8_MAX": 2**7 - 1,
+    "INT16_MAX": 2**15 - 1,
+    "INT32_MAX": 2**31 - 1,
+    "INT64_MAX": 2**63 - 1,
+    "INT8_MIN": -(2**7),
+    "INT16_MIN": -(2**15),
+    "INT32_MIN": -(2**31),
+    "INT64_MIN": -(2**63),
+    "UINT8_MAX": 2**8 - 1,
+    "UINT16_MAX": 2**16 - 1,
+    "UINT32_MAX": 2**32 - 1,
+    "UINT64_MAX": 2**64 - 1,
+}
+
+C_BASE_TYPES = {
+    "char",
+    "short",
+    "int",
+    "long",
+    "float",
+    "double",
+    "signed",
+    "unsigned",
+    "int8_t",
+    "int16_t",
+    "int32_t",
+    "int64_t",
+    "uint8_t",
+    "uint16_t",
+    "uint32_t",
+    "uint64_t",
+}
+
+RE_NUMBER_SUFFIX = re.compile(r"(?i)(?<=[0-9.])(?:ull|llu|ll|ul|lu|u|l|f)$")
+
+
+class CEvalError(Exception): ...
+
+
+def expand_macros(
+    expr: str, defines: dict[str, CDefine], _active: frozenset[str] = frozenset()
+) -> list[str]:
+    out: list[str] = []
+    for token in tokenize(expr):
+        if token.kind in ("space", "newline", "comment"):
+            continue
+        define = defines.get(token.text) if token.kind == "ident" else None
+        if define is None or define.params is not None or token.text in _active:
+            out.append(token.text)
+        else:
+            out.extend(expand_macros(define.body, defines, _active | {token.text}))
+    return out
+
+
+def resolve_type(type_str: str, header: CHeader) -> str:
+    # expand macros (TYPE -> double) and typedefs (prob_t -> TYPE -> double)
+    # until only base types, pointers and qualifiers are left
+    seen: set[str] = set()
+    parts = expand_macros(type_str, header.defines)
+    while True:
+        resolved: list[str] = []
+        changed = False
+        for part in parts:
+            if part in header.typedefs and part not in seen:
+                seen.add(part)
+                resolved.extend(expand_macros(header.typedefs[part], header.defines))
+                changed = True
+            else:
+                resolved.append(part)
+        parts = resolved
+        if not changed:
+            break
+    return " ".join(parts).replace(" *", "*")
+
+
+def evaluate_tokens(tokens: list[str], header: CHeader | None = None) -> int | float:
+    # casts like "((double)blockSide)" are dropped, the cast type decides
+    # whether "/" is integer or float division afterwards
+    typedefs = header.typedefs if header is not None else {}
+    py_tokens: list[str] = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token == "(":
+            close = i + 1
+            while close < len(tokens) and tokens[close] in C_BASE_TYPES | set(typedefs):
+                close += 1
+            if close > i + 1 and close < len(tokens) and tokens[close] == ")":
+                cast_type = " ".join(tokens[i + 1 : close])
+                if header is not None:
+                    cast_type = resolve_type(cast_type, header)
+                if cast_type in ("float", "double"):
+                    py_tokens.append("float")
+                    py_tokens.append("(")
+                    # wrap the next operand, which is a single token or a
+                    # parenthesized group
+                    j = close + 1
+                    depth = 0
+                    while j < len(tokens):
+                        depth += tokens[j] == "("
+                        depth -= tokens[j] == ")"
+                        j += 1
+                        if depth == 0:
+                            break
+                    py_tokens.extend(tokens[close + 1 : j])
+                    py_tokens.append(")")
+                    i = j
+                else:
+                    i = close + 1
+                continue
+        if token in C_BUILTIN_CONSTANTS:
+            py_tokens.append(str(C_BUILTIN_CONSTANTS[token]))
+        elif token[0].isdigit() or (token[0] == "." and len(token) > 1):
+            py_tokens.append(RE_NUMBER_SUFFIX.sub("", token))
+        elif token in (
+            "+",
+            "-",
+            "*",
+            "/",
+            "%",
+            "<<",
+            ">>",
+            "&",
+            "|",
+            "^",
+            "~",
+            "(",
+            ")",
+        ):
+            py_tokens.append(token)
+        else:
+            raise CEvalError(f"Cannot evaluate token '{token}'")
+        i += 1
+    return _evaluate_python_expr(" ".join(py_tokens))
+
+
+def _evaluate_python_expr(expr: str) -> int | float:
+    binary_ops = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Mod: operator.mod,
+        ast.LShift: operator.lshift,
+        ast.RShift: operator.rshift,
+        ast.BitAnd: operator.and_,
+        ast.BitOr: operator.or_,
+        ast.BitXor: operator.xor,
+    }
+    unary_ops = {
+        ast.USub: operator.neg,
+        ast.UAdd: operator.pos,
+        ast.Invert: operator.invert,
+    }
+
+    def visit(node: ast.AST) -> int | float:
+        if isinstance(node, ast.Expression):
+            return visit(node.body)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.BinOp):
+            left, right = visit(node.left), visit(node.right)
+            if isinstance(node.op, ast.Div):
+                if isinstance(left, int) and isinstance(right, int):
+                    # C integer division truncates towards zero
+                    q = abs(left) // abs(right)
+                    return q if (left >= 0) == (right >= 0) else -q
+                return left / right
+            if type(node.op) in binary_ops:
+                return binary_ops[type(node.op)](left, right)
+        if isinstance(node, ast.UnaryOp) and type(node.op) in unary_ops:
+            return unary_ops[type(node.op)](visit(node.operand))
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == "float"
+            and len(node.args) == 1
+        ):
+            return float(visit(node.args[0]))
+        raise CEvalError(f"Unsupported expression: {ast.dump(node)}")
+
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError as e:
+        raise CEvalError(f"Cannot parse '{expr}'") from e
+    return visit(tree)
+
+
+def evaluate_expression(expr: str, header: CHeader) -> int | float:
+    return evaluate_tokens(expand_macros(expr, header.defines), header)
+
+
+def evaluate_defines(header: CHeader) -> dict[str, int | float | str]:
+    # numeric defines are evaluated, anything else (types, function like
+    # macros) is kept as its normalized body text
+    values: dict[str, int | float | str] = {}
+    for name, define in header.defines.items():
+        if define.params is not None:
+            continue
+        try:
+            values[name] = evaluate_expression(define.body, header)
+        except (CEvalError, ZeroDivisionError):
+            values[name] = define.body
+    return values
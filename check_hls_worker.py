@@ -0,0 +1,133 @@
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+from hls_worker import VitisHLSWorkerPool
+
+FAKE_VITIS_HLS = Path(__file__).resolve().parent / "fake_vitis_hls.sh"
+FAKE_ENV_VARS = [
+    "FAKE_VITIS_HLS_PROMPT",
+    "FAKE_VITIS_HLS_CRASH",
+    "FAKE_VITIS_HLS_HANG",
+    "FAKE_VITIS_HLS_SLEEP",
+]
+
+SYNTH_COMMANDS = [
+    "open_project fake_proj",
+    "set_top fake_top",
+    "open_solution solution1",
+    "csynth_design",
+    "close_project",
+    "exit",
+]
+
+
+def run_scenario(
+    vitis_hls_bin: str,
+    env: dict[str, str],
+    commands: list[str],
+    batch_timeout: float | None,
+    n_batches: int = 1,
+):
+    # the workers inherit the environment when they start, so it only has to
+    # be set around the pool
+    for var in FAKE_ENV_VARS:
+        os.environ.pop(var, None)
+    os.environ.update(env)
+    try:
+        with tempfile.TemporaryDirectory() as cwd:
+            with VitisHLSWorkerPool(
+                1, vitis_hls_bin=vitis_hls_bin, batch_timeout=batch_timeout
+            ) as pool:
+                return [pool.run_batch(commands, Path(cwd)) for _ in range(n_batches)]
+    finally:
+        for var in env:
+            os.environ.pop(var, None)
+
+
+def main(args):
+    vitis_hls_bin = str(args.vitis_hls)
+    failures = []
+
+    def check(name: str, ok: bool, detail: str) -> None:
+        print(f"{'ok' if ok else 'FAIL':4}  {name}")
+        if not ok:
+            print(f"      {detail}")
+            failures.append(name)
+
+    results = run_scenario(vitis_hls_bin, {}, SYNTH_COMMANDS, 10, n_batches=2)
+    check(
+        "batches on one session",
+        all(
+            r.returncode == 0 and "Finished Command csynth_design" in r.output
+            for r in results
+        ),
+        repr(results),
+    )
+
+    (result,) = run_scenario(
+        vitis_hls_bin, {}, ["open_project p", "no_such_command"], 10
+    )
+    check("failing batch", result.returncode == 1, repr(result))
+
+    # a batch that prints nothing puts the marker right after the prompt
+    results = run_scenario(
+        vitis_hls_bin,
+        {"FAKE_VITIS_HLS_PROMPT": "1"},
+        ["open_project p", "close_project"],
+        10,
+        n_batches=2,
+    )
+    check(
+        "prompt before the marker",
+        all(r.returncode == 0 and not r.error for r in results),
+        repr(results),
+    )
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        crash_fp = f.name
+    (result,) = run_scenario(
+        vitis_hls_bin, {"FAKE_VITIS_HLS_CRASH": crash_fp}, SYNTH_COMMANDS, 10
+    )
+    check(
+        "crash and restart",
+        result.returncode == 0 and result.restarts == 1,
+        repr(result),
+    )
+
+    (result,) = run_scenario(
+        vitis_hls_bin, {"FAKE_VITIS_HLS_HANG": "1"}, SYNTH_COMMANDS, 1
+    )
+    check(
+        "batch timeout",
+        result.returncode == -1 and "did not finish" in result.error,
+        repr(result),
+    )
+
+    # output keeps coming, but the batch as a whole takes longer than the
+    # timeout
+    (result,) = run_scenario(
+        vitis_hls_bin,
+        {"FAKE_VITIS_HLS_SLEEP": "600"},
+        ["open_project p"] + ["csynth_design"] * 4,
+        1,
+    )
+    check(
+        "batch timeout with steady output",
+        result.returncode == -1 and "did not finish" in result.error,
+        repr(result),
+    )
+
+    if failures:
+        raise SystemExit(f"{len(failures)} scenarios failed")
+    print("all scenarios passed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the vitis_hls worker pool against a fake vitis_hls"
+    )
+    parser.add_argument("--vitis-hls", type=Path, default=FAKE_VITIS_HLS)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,129 @@
+import argparse
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+
+from llm_kernel_descriptions import generate_descriptions
+from mock_together_server import MockChatCompletions
+from models import MODELS
+
+MOCK_KERNELS = ["mock_add", "mock_scale", "mock_broken"]
+
+
+def write_mock_kernels(design_dir: Path) -> list[Path]:
+    dirs = []
+    for name in MOCK_KERNELS:
+        kernel_dir = design_dir / name
+        kernel_dir.mkdir(parents=True)
+        (kernel_dir / f"{name}.h").write_text(f"void {name}(int a[16], int b[16]);\n")
+        (kernel_dir / f"{name}.cpp").write_text(
+            f'#include "{name}.h"\n'
+            f"void {name}(int a[16], int b[16]) {{\n"
+            "  for (int i = 0; i < 16; i++) b[i] = a[i] + 1;\n"
+            "}\n"
+        )
+        (kernel_dir / "top.txt").write_text(name + "\n")
+        dirs.append(kernel_dir)
+    return dirs
+
+
+def run_scenario(
+    server: MockChatCompletions,
+    design_dirs: list[Path],
+    description_dir: Path,
+    cache_dir: Path | None,
+    max_retries: int = 6,
+):
+    model_with_settings = MODELS["llama-3-70b-chat-hf"]("mock")
+    model_with_settings.model.api_url = server.api_url
+    model_with_settings.model.cache_dir = cache_dir
+    description_dir.mkdir(parents=True, exist_ok=True)
+    return asyncio.run(
+        generate_descriptions(
+            design_dirs,
+            model_with_settings,
+            description_dir,
+            max_in_flight=2,
+            max_retries=max_retries,
+        )
+    )
+
+
+def main(args):
+    failures = []
+
+    def check(name: str, ok: bool, detail: str) -> None:
+        print(f"{'ok' if ok else 'FAIL':4}  {name}")
+        if not ok:
+            print(f"      {detail}")
+            failures.append(name)
+
+    # every other request is rate limited, mock_broken never finishes a stream
+    server = MockChatCompletions(
+        args.port, rate_limit_every=2, break_stream=("mock_broken",)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp_dir = Path(tmp)
+            mock_add, mock_scale, mock_broken = write_mock_kernels(tmp_dir / "designs")
+            cache_dir = tmp_dir / "llm_cache"
+
+            out_dir = tmp_dir / "descriptions"
+            usage, errors = run_scenario(
+                server, [mock_add, mock_scale], out_dir, cache_dir
+            )
+            check(
+                "descriptions after 429 retries",
+                not errors
+                and server.n_rate_limited > 0
+                and all(
+                    (out_dir / f"{d.name}.md").exists() for d in [mock_add, mock_scale]
+                )
+                and not any(u.cached for u in usage.values()),
+                f"errors={errors} usage={usage} rate_limited={server.n_rate_limited}",
+            )
+
+            n_requests = server.n_requests
+            out_dir = tmp_dir / "descriptions_cached"
+            usage, errors = run_scenario(
+                server, [mock_add, mock_scale], out_dir, cache_dir
+            )
+            check(
+                "cache hits",
+                not errors
+                and server.n_requests == n_requests
+                and all(u.cached for u in usage.values())
+                and all(
+                    (out_dir / f"{d.name}.md").exists() for d in [mock_add, mock_scale]
+                ),
+                f"errors={errors} usage={usage} "
+                f"requests={server.n_requests - n_requests}",
+            )
+
+            out_dir = tmp_dir / "descriptions_broken"
+            usage, errors = run_scenario(
+                server, [mock_broken], out_dir, None, max_retries=1
+            )
+            check(
+                "failed kernel leaves no partial output",
+                "mock_broken" in errors and not any(out_dir.iterdir()),
+                f"errors={errors} files={sorted(p.name for p in out_dir.iterdir())}",
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    if failures:
+        raise SystemExit(f"{len(failures)} scenarios failed")
+    print("all scenarios passed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run generate_descriptions against a mock chat completions server"
+    )
+    parser.add_argument("--port", type=int, default=0, help="0 picks a free port")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,251 @@
+import argparse
+import ctypes
+import hashlib
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from benchmarks import Benchmark, load_benchmarks
+
+CSIM_BUILD_DIR = Path("./csim_build")
+
+C_TYPE_TO_DTYPE: dict[str, str] = {
+    "char": "i1",
+    "signed char": "i1",
+    "unsigned char": "u1",
+    "short": "i2",
+    "unsigned short": "u2",
+    "int": "i4",
+    "unsigned": "u4",
+    "unsigned int": "u4",
+    "long": "i8",
+    "unsigned long": "u8",
+    "long long": "i8",
+    "unsigned long long": "u8",
+    "float": "f4",
+    "double": "f8",
+    "int8_t": "i1",
+    "int16_t": "i2",
+    "int32_t": "i4",
+    "int64_t": "i8",
+    "uint8_t": "u1",
+    "uint16_t": "u2",
+    "uint32_t": "u4",
+    "uint64_t": "u8",
+}
+
+
+def c_type_to_dtype(c_type: str, structs: dict[str, list[dict[str, Any]]]) -> np.dtype:
+    c_type = c_type.replace("const ", "").rstrip("*").strip()
+    if c_type in C_TYPE_TO_DTYPE:
+        return np.dtype(C_TYPE_TO_DTYPE[c_type])
+    if c_type in structs:
+        # aligned=True lays the fields out like the C compiler does
+        return np.dtype(
+            [
+                (
+                    f["name"],
+                    c_type_to_dtype(f["c_type"], structs),
+                    tuple(f["shape"]),
+                )
+                for f in structs[c_type]
+            ],
+            align=True,
+        )
+    raise TypeError(f"No NumPy dtype for C type '{c_type}'")
+
+
+def make_shim_source(benchmark: Benchmark) -> str:
+    # C++ mangles the kernel's symbol, so export it through an extern "C"
+    # wrapper built from the header's own declaration
+    record = benchmark.record
+    params = ", ".join(
+        f"{arg['type']} {arg['name']}" + "".join(f"[{d}]" for d in arg["dims"])
+        for arg in record["args"]
+    )
+    call_args = ", ".join(arg["name"] for arg in record["args"])
+    call = f"{benchmark.top}({call_args})"
+    body = call + ";" if record["return_type"] == "void" else f"return {call};"
+    return (
+        f'#include "{benchmark.source_fp.resolve()}"\n\n'
+        f'extern "C" {record["return_type"]} csim_{benchmark.top}({params}) {{\n'
+        f"  {body}\n"
+        "}\n"
+    )
+
+
+def build_shared_library(
+    benchmark: Benchmark,
+    build_dir: Path = CSIM_BUILD_DIR,
+    compiler: str | Path = "c++",
+    cflags: list[str] | None = None,
+) -> Path:
+    if cflags is None:
+        cflags = ["-O2"]
+    # libraries are keyed on the kernel's files and on everything else that
+    # goes into the build, so unchanged kernels are never rebuilt and a new
+    # compiler, flag or shim never picks up a stale library
+    shim_source = make_shim_source(benchmark)
+    h = hashlib.sha256()
+    for part in [
+        benchmark.files[benchmark.source_fp.name],
+        benchmark.files[benchmark.header_fp.name],
+        str(compiler),
+        *cflags,
+        shim_source,
+    ]:
+        h.update(part.encode() + b"\0")
+    lib_fp = build_dir / f"{benchmark.name}-{h.hexdigest()[:16]}.so"
+    if lib_fp.exists():
+        return lib_fp
+
+    build_dir.mkdir(parents=True, exist_ok=True)
+    # unique names, two builds of the same kernel can run at once
+    shim_fd, shim_name = tempfile.mkstemp(
+        dir=build_dir, prefix=f"{benchmark.name}_csim_", suffix=".cpp"
+    )
+    lib_fd, tmp_lib_name = tempfile.mkstemp(
+        dir=build_dir, prefix=f"{benchmark.name}_", suffix=".so.tmp"
+    )
+    os.close(lib_fd)
+    try:
+        with os.fdopen(shim_fd, "w") as f:
+            f.write(shim_source)
+        p = subprocess.run(
+            [
+                str(compiler),
+                *cflags,
+                "-shared",
+                "-fPIC",
+                f"-I{benchmark.directory.resolve()}",
+                "-o",
+                tmp_lib_name,
+                shim_name,
+            ],
+            text=True,
+            capture_output=True,
+        )
+        if p.returncode != 0:
+            raise RuntimeError(f"Failed to build {lib_fp}:\n{p.stderr}")
+        os.replace(tmp_lib_name, lib_fp)
+    finally:
+        Path(shim_name).unlink(missing_ok=True)
+        Path(tmp_lib_name).unlink(missing_ok=True)
+    return lib_fp
+
+
+class CSimKernel:
+    def __init__(self, benchmark: Benchmark, lib_fp: Path):
+        self.benchmark = benchmark
+        self.lib = ctypes.CDLL(str(lib_fp.resolve()))
+        self.fn = getattr(self.lib, f"csim_{benchmark.top}")
+
+        structs = benchmark.record["structs"]
+        self.arg_names: list[str] = []
+        self.arg_dtypes: list[np.dtype] = []
+        self.arg_shapes: list[tuple[int, ...]] = []
+        self.arg_is_buffer: list[bool] = []
+        argtypes = []
+        for arg in benchmark.args:
+            dtype = c_type_to_dtype(arg["c_type"], structs)
+            # pointers to a single struct (aes256_context *ctx) are passed as a
+            # zero dimensional array
+            shape = tuple(arg["shape"])
+            is_buffer = len(shape) > 0 or arg["c_type"].endswith("*")
+            self.arg_names.append(arg["name"])
+            self.arg_dtypes.append(dtype)
+            self.arg_shapes.append(shape)
+            self.arg_is_buffer.append(is_buffer)
+            if is_buffer:
+                argtypes.append(
+                    np.ctypeslib.ndpointer(dtype=dtype, flags="C_CONTIGUOUS")
+                )
+            else:
+                argtypes.append(np.ctypeslib.as_ctypes_type(dtype))
+        self.fn.argtypes = argtypes
+
+        return_type = benchmark.record["return_type"]
+        self.fn.restype = (
+            None
+            if return_type == "void"
+            else np.ctypeslib.as_ctypes_type(c_type_to_dtype(return_type, structs))
+        )
+
+    def allocate_args(self, batch_size: int | None = None) -> dict[str, np.ndarray]:
+        prefix = () if batch_size is None else (batch_size,)
+        return {
+            name: np.zeros(prefix + shape, dtype=dtype)
+            for name, dtype, shape in zip(
+                self.arg_names, self.arg_dtypes, self.arg_shapes
+            )
+        }
+
+    def _check(self, name: str, value: Any, dtype: np.dtype, shape: tuple) -> None:
+        # arrays are handed to C as is, a silent conversion would both copy and
+        # hide the kernel's writes from the caller
+        if not isinstance(value, np.ndarray):
+            return
+        if value.dtype != dtype:
+            raise TypeError(f"{name}: expected dtype {dtype}, got {value.dtype}")
+        if value.shape != shape:
+            raise ValueError(f"{name}: expected shape {shape}, got {value.shape}")
+        if not value.flags.c_contiguous:
+            raise ValueError(f"{name}: array must be C contiguous")
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        values = list(args) + [kwargs[name] for name in self.arg_names[len(args) :]]
+        if len(values) != len(self.arg_names):
+            raise TypeError(
+                f"{self.benchmark.top} takes {len(self.arg_names)} arguments"
+            )
+        for i, (name, dtype, shape) in enumerate(
+            zip(self.arg_names, self.arg_dtypes, self.arg_shapes)
+        ):
+            if not self.arg_is_buffer[i] and isinstance(values[i], np.ndarray):
+                values[i] = values[i].item()
+            self._check(name, values[i], dtype, shape)
+        return self.fn(*values)
+
+    def run_batch(self, batch: dict[str, np.ndarray]) -> list[Any]:
+        # every argument carries a leading batch dimension, each call gets a
+        # zero copy view of one row
+        batch_size = len(next(iter(batch.values())))
+        return [
+            self(**{name: batch[name][i, ...] for name in self.arg_names})
+            for i in range(batch_size)
+        ]
+
+
+def load_csim_kernel(
+    benchmark: Benchmark,
+    build_dir: Path = CSIM_BUILD_DIR,
+    compiler: str | Path = "c++",
+    cflags: list[str] | None = None,
+) -> CSimKernel:
+    lib_fp = build_shared_library(benchmark, build_dir, compiler, cflags)
+    return CSimKernel(benchmark, lib_fp)
+
+
+def main(args):
+    benchmarks = load_benchmarks(args.benchmarks_directory)
+    for benchmark in benchmarks.values():
+        kernel = load_csim_kernel(benchmark, args.build_dir, args.compiler)
+        batch = kernel.allocate_args(args.batch_size)
+        kernel.run_batch(batch)
+        print(f"csim - {benchmark.name} - ran {args.batch_size} zero input vectors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "benchmarks_directory", type=Path, nargs="?", default=Path("./hls-machsuite/")
+    )
+    parser.add_argument("-b", "--build-dir", type=Path, default=CSIM_BUILD_DIR)
+    parser.add_argument("-c", "--compiler", type=str, default="c++")
+    parser.add_argument("-n", "--batch-size", type=int, default=1)
+    args = parser.parse_args()
+    main(args)
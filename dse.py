@@ -0,0 +1,634 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import math
+import random
+import shlex
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from benchmarks import Benchmark, load_benchmarks
+from hls_worker import VitisHLSWorkerPool
+from qor import (
+    QOR_DB_FP,
+    RESOURCE_NAMES,
+    CSynthReport,
+    QoRStore,
+    parse_csynth_report,
+    parse_report_dir,
+)
+from scheduler import JOB_HISTORY_FP, GiB, Job, JobHistory, ResourceScheduler
+from test import (
+    HLS_CACHE_DIR,
+    VitisHLSToolchain,
+    find_vitis_hls_toolchain,
+    hls_synth_benchmark,
+)
+
+DSE_OUTPUT_DIR = Path("./dse_results")
+DSE_OBJECTIVES = ["latency", "LUT", "DSP", "BRAM"]
+DEFAULT_FACTORS = [2, 4, 8, 16, 32, 64]
+PARTITION_TYPES = ["cyclic", "block"]
+# complete partitioning of anything bigger explodes into registers
+COMPLETE_PARTITION_MAX_EXTENT = 64
+
+# options that take a value, everything else starting with "-" is a flag
+DIRECTIVE_VALUE_OPTIONS = {
+    "-factor",
+    "-type",
+    "-dim",
+    "-II",
+    "-core",
+    "-style",
+    "-latency",
+    "-limit",
+    "-impl",
+    "-storage_type",
+    "-storage_impl",
+}
+# MachSuite files use the pre Vitis spelling for some directives
+DIRECTIVE_ALIASES = {"set_directive_partition": "set_directive_array_partition"}
+EXPLORED_DIRECTIVES = {
+    "set_directive_pipeline",
+    "set_directive_unroll",
+    "set_directive_array_partition",
+}
+
+
+@dataclass
+class Directive:
+    command: str
+    options: dict[str, str | bool]
+    positional: list[str]
+    active: bool
+    line: str
+
+    @property
+    def location(self) -> str:
+        return self.positional[0]
+
+    @property
+    def variable(self) -> str | None:
+        return self.positional[1] if len(self.positional) > 1 else None
+
+
+def parse_directive_file(text: str) -> list[Directive]:
+    # commented out set_directive_* lines are the alternatives the MachSuite
+    # authors suggest sweeping, active lines are the shipped configuration
+    directives = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        active = not stripped.startswith("#")
+        stripped = stripped.lstrip("#").strip()
+        if not stripped.startswith("set_directive_"):
+            continue
+        tokens = shlex.split(stripped)
+        command = DIRECTIVE_ALIASES.get(tokens[0], tokens[0])
+        options: dict[str, str | bool] = {}
+        positional = []
+        i = 1
+        while i < len(tokens):
+            token = tokens[i]
+            if token.startswith("-") and token in DIRECTIVE_VALUE_OPTIONS:
+                options[token] = tokens[i + 1]
+                i += 2
+                continue
+            if token.startswith("-"):
+                options[token] = True
+            else:
+                positional.append(token)
+            i += 1
+        if not positional:
+            raise ValueError(f"Directive without a location: {line!r}")
+        directives.append(Directive(command, options, positional, active, stripped))
+    return directives
+
+
+def render_directive(directive: Directive) -> str:
+    parts = [directive.command]
+    for option, value in directive.options.items():
+        parts.append(option if value is True else f"{option} {value}")
+    parts.append(f'"{directive.location}"')
+    parts.extend(directive.positional[1:])
+    return " ".join(parts)
+
+
+@dataclass
+class DirectiveParam:
+    name: str
+    kind: str
+    location: str
+    variable: str | None
+    # ordered from least to most aggressive, choices[0] means "no directive";
+    # an unroll factor of "full" unrolls the loop completely
+    choices: list[Any]
+    default: Any
+    dim: str | None = None
+
+    def render(self, value: Any) -> str | None:
+        if value == self.choices[0]:
+            return None
+        if self.kind == "pipeline":
+            return f"set_directive_pipeline {self.location}"
+        if self.kind == "unroll":
+            if value == "full":
+                return f"set_directive_unroll {self.location}"
+            return f"set_directive_unroll -factor {value} {self.location}"
+        dim = f" -dim {self.dim}" if self.dim is not None else ""
+        if value == "complete":
+            return (
+                f'set_directive_array_partition -type complete{dim} "{self.location}"'
+                f" {self.variable}"
+            )
+        partition_type, factor = value.split(":")
+        return (
+            f"set_directive_array_partition -type {partition_type} -factor {factor}"
+            f'{dim} "{self.location}" {self.variable}'
+        )
+
+
+@dataclass
+class DesignSpace:
+    benchmark_name: str
+    params: list[DirectiveParam]
+    # shipped directives that are not explored (resource, inline, ...)
+    fixed: list[str] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return math.prod(len(p.choices) for p in self.params)
+
+    def default_config(self) -> dict[str, Any]:
+        return {p.name: p.default for p in self.params}
+
+    def random_config(self, rng: random.Random) -> dict[str, Any]:
+        return {p.name: rng.choice(p.choices) for p in self.params}
+
+    def neighbours(self, config: dict[str, Any]) -> list[tuple[str, int, int]]:
+        # single parameter moves one step up or down the aggressiveness order
+        moves = []
+        for p in self.params:
+            idx = p.choices.index(config[p.name])
+            for new_idx in (idx - 1, idx + 1):
+                if 0 <= new_idx < len(p.choices):
+                    moves.append((p.name, idx, new_idx))
+        return moves
+
+    def render(self, config: dict[str, Any]) -> str:
+        lines = list(self.fixed)
+        for p in self.params:
+            line = p.render(config[p.name])
+            if line is not None:
+                lines.append(line)
+        return "\n".join(lines) + "\n"
+
+
+def config_key(config: dict[str, Any]) -> str:
+    return json.dumps(config, sort_keys=True)
+
+
+def config_name(benchmark_name: str, config: dict[str, Any]) -> str:
+    digest = hashlib.sha256(config_key(config).encode()).hexdigest()
+    return f"{benchmark_name}_{digest[:12]}"
+
+
+def factor_choices(extent: int | None, seen: set[int], max_factor: int) -> list[int]:
+    factors = set(f for f in DEFAULT_FACTORS if f <= max_factor) | seen
+    if extent is not None:
+        factors = {f for f in factors if f < extent and extent % f == 0}
+    return sorted(factors)
+
+
+def build_design_space(benchmark: Benchmark, max_factor: int = 64) -> DesignSpace:
+    directives = parse_directive_file(benchmark.directives)
+    arg_extents = {
+        arg["name"]: arg["shape"][0] if arg["shape"] else None for arg in benchmark.args
+    }
+
+    # group every mention of the same loop / array, the last active line wins
+    # for the default configuration
+    grouped: dict[tuple[str, str, str | None], list[Directive]] = {}
+    fixed = []
+    for directive in directives:
+        if directive.command not in EXPLORED_DIRECTIVES:
+            if directive.active:
+                fixed.append(render_directive(directive))
+            continue
+        kind = directive.command.removeprefix("set_directive_")
+        key = (kind, directive.location, directive.variable)
+        grouped.setdefault(key, []).append(directive)
+
+    params = []
+    for (kind, location, variable), mentions in grouped.items():
+        active = [d for d in mentions if d.active]
+        if kind == "pipeline":
+            params.append(
+                DirectiveParam(
+                    f"pipeline {location}",
+                    kind,
+                    location,
+                    None,
+                    [False, True],
+                    bool(active),
+                )
+            )
+        elif kind == "unroll":
+            seen = {
+                int(d.options["-factor"]) for d in mentions if "-factor" in d.options
+            }
+            choices: list[Any] = [1] + factor_choices(None, seen, max_factor)
+            default: Any = 1
+            if active:
+                # without -factor the loop is unrolled completely
+                default = int(active[-1].options.get("-factor", 0)) or "full"
+            if default != "full" and default not in choices:
+                choices = sorted(set(choices) | {default})
+            # a complete unroll is the most aggressive setting, only offered
+            # where the directive file suggests one
+            if any("-factor" not in d.options for d in mentions):
+                choices.append("full")
+            params.append(
+                DirectiveParam(
+                    f"unroll {location}", kind, location, None, choices, default
+                )
+            )
+        else:
+            assert variable is not None
+            # the extent is only known for arguments of the top function
+            extent = arg_extents.get(variable) if location == benchmark.top else None
+            seen = {
+                int(d.options["-factor"]) for d in mentions if "-factor" in d.options
+            }
+            choices = ["none"]
+            for factor in factor_choices(extent, seen, max_factor):
+                choices += [f"{t}:{factor}" for t in PARTITION_TYPES]
+            if extent is not None and extent <= COMPLETE_PARTITION_MAX_EXTENT:
+                choices.append("complete")
+            default = "none"
+            if active:
+                last = active[-1]
+                if last.options.get("-type") == "complete":
+                    default = "complete"
+                else:
+                    default = (
+                        f"{last.options.get('-type', 'cyclic')}"
+                        f":{last.options.get('-factor', 2)}"
+                    )
+                if default not in choices:
+                    choices.append(default)
+            dims = {d.options["-dim"] for d in mentions if "-dim" in d.options}
+            params.append(
+                DirectiveParam(
+                    f"partition {location} {variable}",
+                    "array_partition",
+                    location,
+                    variable,
+                    choices,
+                    default,
+                    dim=dims.pop() if len(dims) == 1 else None,
+                )
+            )
+
+    return DesignSpace(benchmark.name, params, fixed)
+
+
+def report_qor(report: CSynthReport) -> dict[str, Any] | None:
+    if report.latency_max is None:
+        # a loop bound could not be determined
+        return None
+    return {
+        "latency": report.latency_max,
+        "interval": report.interval_max,
+        "clock_period": report.estimated_clock,
+        **{
+            resource.removesuffix("_18K"): report.resources.get(resource) or 0
+            for resource in RESOURCE_NAMES
+        },
+    }
+
+
+@dataclass
+class DSEPoint:
+    name: str
+    config: dict[str, Any]
+    qor: dict[str, Any] | None
+    returncode: int
+    parent: str | None = None
+    move: str | None = None
+
+
+def dominates(a: dict[str, Any], b: dict[str, Any]) -> bool:
+    return all(a[o] <= b[o] for o in DSE_OBJECTIVES) and any(
+        a[o] < b[o] for o in DSE_OBJECTIVES
+    )
+
+
+def pareto_front(points: list[DSEPoint]) -> list[DSEPoint]:
+    valid = [p for p in points if p.qor is not None]
+    return [
+        p
+        for p in valid
+        if not any(dominates(q.qor, p.qor) for q in valid if q is not p)  # type: ignore[arg-type]
+    ]
+
+
+def explore(
+    space: DesignSpace,
+    evaluate: Callable[
+        [list[tuple[dict[str, Any], str | None, str | None]]], list[DSEPoint]
+    ],
+    budget: int,
+    batch_size: int,
+    seed: int = 0,
+) -> list[DSEPoint]:
+    rng = random.Random(seed)
+    points: dict[str, DSEPoint] = {}
+    points_by_name: dict[str, DSEPoint] = {}
+    queued: set[str] = set()
+    params = {p.name: p for p in space.params}
+    # lowest choice index at which turning a parameter up gave a design that
+    # its parent dominates; anything at least that aggressive for the same
+    # parameter is skipped from then on
+    pruned: dict[str, int] = {}
+
+    def random_batch(n: int) -> list[tuple[dict[str, Any], str | None, str | None]]:
+        batch = []
+        for _ in range(n * 20):
+            if len(batch) == n:
+                break
+            config = space.random_config(rng)
+            key = config_key(config)
+            if key in points or key in queued:
+                continue
+            queued.add(key)
+            batch.append((config, None, None))
+        return batch
+
+    default = space.default_config()
+    queued.add(config_key(default))
+    batch = [(default, None, None)] + random_batch(min(batch_size, budget) - 1)
+
+    while batch:
+        for point in evaluate(batch):
+            points[config_key(point.config)] = point
+            points_by_name[point.name] = point
+            if point.parent is None or point.move is None:
+                continue
+            parent = points_by_name[point.parent]
+            param_name, _, up = point.move.rpartition(" ")
+            if up != "up" or parent.qor is None:
+                continue
+            if point.qor is None or dominates(parent.qor, point.qor):
+                idx = params[param_name].choices.index(point.config[param_name])
+                pruned[param_name] = min(pruned.get(param_name, idx), idx)
+
+        remaining = budget - len(points)
+        if remaining <= 0:
+            break
+
+        front = pareto_front(list(points.values()))
+        rng.shuffle(front)
+        candidates = {}
+        for parent in front:
+            for param_name, idx, new_idx in space.neighbours(parent.config):
+                if new_idx > idx and new_idx >= pruned.get(param_name, new_idx + 1):
+                    continue
+                child = dict(parent.config)
+                child[param_name] = params[param_name].choices[new_idx]
+                key = config_key(child)
+                if key in points or key in queued or key in candidates:
+                    continue
+                move = f"{param_name} {'up' if new_idx > idx else 'down'}"
+                candidates[key] = (child, parent.name, move)
+
+        # neighbours not picked this round are proposed again by the next front
+        keys = list(candidates)
+        rng.shuffle(keys)
+        keys = keys[: min(batch_size, remaining)]
+        queued.update(keys)
+        batch = [candidates[key] for key in keys]
+        if len(batch) < min(batch_size, remaining):
+            # the front has no unexplored neighbours left, keep sampling
+            batch += random_batch(min(batch_size, remaining) - len(batch))
+        print(
+            f"{space.benchmark_name}: {len(points)}/{budget} evaluated, "
+            f"front {len(front)}, pruned {len(pruned)}"
+        )
+
+    return list(points.values())
+
+
+def run_dse_benchmark(
+    benchmark: Benchmark,
+    out_dir: Path,
+    budget: int,
+    n_jobs: int,
+    seed: int,
+    max_factor: int,
+    cache_dir: Path | None,
+    worker_pool: VitisHLSWorkerPool | None,
+    qor_store: QoRStore | None = None,
+    toolchain: VitisHLSToolchain | None = None,
+    scheduler: ResourceScheduler | None = None,
+) -> list[DSEPoint]:
+    space = build_design_space(benchmark, max_factor)
+    print(
+        f"{benchmark.name}: {len(space.params)} parameters, {space.size} configurations"
+    )
+
+    benchmark_out_dir = out_dir / benchmark.name
+    runs_dir = benchmark_out_dir / "runs"
+    reports_dir = benchmark_out_dir / "reports"
+    reports_dir.mkdir(parents=True, exist_ok=True)
+    points_fp = benchmark_out_dir / "points.jsonl"
+    points_fp.write_text("")
+
+    def synthesize(config: dict[str, Any], name: str) -> int:
+        return hls_synth_benchmark(
+            benchmark.directory,
+            temp_dir_overide=runs_dir,
+            cache_dir=cache_dir,
+            worker_pool=worker_pool,
+            directives=space.render(config),
+            run_name=name,
+            toolchain=toolchain,
+        )
+
+    def collect(
+        candidate: tuple[dict[str, Any], str | None, str | None], returncode: int
+    ) -> DSEPoint:
+        config, parent, move = candidate
+        name = config_name(benchmark.name, config)
+        run_dir = runs_dir / name
+        qor = None
+        # keep the reports, the project directories are large
+        if returncode == 0:
+            report_dir = run_dir / f"test_proj_{benchmark.name}" / "solution1" / "syn"
+            (reports_dir / name).mkdir(exist_ok=True)
+            for report_fp in [
+                *(report_dir / "report").glob("*.rpt"),
+                *(report_dir / "report").glob("*.xml"),
+            ]:
+                shutil.copy(report_fp, reports_dir / name)
+            qor = report_qor(
+                parse_csynth_report((reports_dir / name / "csynth.rpt").read_text())
+            )
+        shutil.rmtree(run_dir, ignore_errors=True)
+        return DSEPoint(name, config, qor, returncode, parent, move)
+
+    def evaluate(
+        batch: list[tuple[dict[str, Any], str | None, str | None]],
+    ) -> list[DSEPoint]:
+        configs = [config for config, _, _ in batch]
+        names = [config_name(benchmark.name, config) for config in configs]
+        if worker_pool is not None or scheduler is None:
+            # the vitis_hls sessions live in this process, so their batches are
+            # sent from threads instead of scheduled jobs
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                returncodes = list(executor.map(synthesize, configs, names))
+        else:
+            jobs = [
+                Job(
+                    f"dse:{name}",
+                    synthesize,
+                    (config, name),
+                    uses_license=True,
+                    default_memory=4 * GiB,
+                    stage="synth",
+                )
+                for config, name in zip(configs, names)
+            ]
+            # a job that raised has no return code
+            returncodes = [
+                -1 if returncode is None else returncode
+                for returncode in scheduler.run(jobs, raise_on_error=False)
+            ]
+        results = [
+            collect(candidate, returncode)
+            for candidate, returncode in zip(batch, returncodes)
+        ]
+        if qor_store is not None:
+            for point in results:
+                if point.returncode == 0:
+                    qor_store.record(
+                        benchmark.name,
+                        parse_report_dir(reports_dir / point.name),
+                        directives=space.render(point.config),
+                    )
+        with points_fp.open("a") as f:
+            for point in results:
+                f.write(
+                    json.dumps(
+                        {**asdict(point), "directives": space.render(point.config)}
+                    )
+                    + "\n"
+                )
+        return results
+
+    points = explore(space, evaluate, budget, batch_size=max(n_jobs, 1) * 2, seed=seed)
+    front = sorted(pareto_front(points), key=lambda p: p.qor["latency"])  # type: ignore[index]
+    (benchmark_out_dir / "pareto.json").write_text(
+        json.dumps(
+            {
+                "benchmark": benchmark.name,
+                "objectives": DSE_OBJECTIVES,
+                "evaluated": len(points),
+                "failed": sum(p.qor is None for p in points),
+                "space_size": space.size,
+                "front": [
+                    {**asdict(p), "directives": space.render(p.config)} for p in front
+                ],
+            },
+            indent=2,
+        )
+    )
+    print(
+        f"{benchmark.name}: {len(points)} evaluated, {len(front)} on the Pareto front"
+    )
+    return points
+
+
+def main(args):
+    benchmarks_dir: Path = args.benchmarks_dir
+    out_dir: Path = args.output_dir
+    benchmarks = load_benchmarks(benchmarks_dir)
+    if args.kernels:
+        unknown = set(args.kernels) - set(benchmarks)
+        if unknown:
+            raise ValueError(f"Unknown kernels: {sorted(unknown)}")
+        benchmarks = {k: v for k, v in benchmarks.items() if k in args.kernels}
+    benchmarks = {k: v for k, v in benchmarks.items() if v.directive_fp is not None}
+
+    cache_dir = None if args.no_hls_cache else args.hls_cache_dir
+    toolchain = find_vitis_hls_toolchain()
+    scheduler = ResourceScheduler(
+        args.jobs,
+        memory_budget=args.max_memory,
+        max_licenses=args.max_licenses,
+        history=JobHistory(args.job_history),
+    )
+    with contextlib.ExitStack() as stack:
+        qor_store = stack.enter_context(QoRStore(args.qor_db))
+        worker_pool = None
+        if args.hls_workers > 0:
+            worker_pool = stack.enter_context(VitisHLSWorkerPool(args.hls_workers))
+        for benchmark in benchmarks.values():
+            run_dse_benchmark(
+                benchmark,
+                out_dir,
+                args.budget,
+                args.jobs,
+                args.seed,
+                args.max_factor,
+                cache_dir,
+                worker_pool,
+                qor_store,
+                toolchain,
+                scheduler,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Explore HLS directive configurations for each benchmark"
+    )
+    parser.add_argument(
+        "benchmarks_dir", type=Path, nargs="?", default=Path("./hls-machsuite")
+    )
+    parser.add_argument("-k", "--kernels", nargs="+", default=None)
+    parser.add_argument(
+        "-b", "--budget", type=int, default=100, help="Configurations per kernel"
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=4)
+    parser.add_argument(
+        "--hls-workers",
+        type=int,
+        default=0,
+        help="Run synthesis through N persistent vitis_hls sessions; these bypass "
+        "the scheduler, so --max-licenses and --max-memory do not limit them",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        help="Memory budget in bytes for concurrent jobs (default: MemAvailable)",
+    )
+    parser.add_argument(
+        "--max-licenses",
+        type=int,
+        default=None,
+        help="At most this many concurrent vitis_hls processes",
+    )
+    parser.add_argument("--job-history", type=Path, default=JOB_HISTORY_FP)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-factor", type=int, default=64)
+    parser.add_argument("-o", "--output-dir", type=Path, default=DSE_OUTPUT_DIR)
+    parser.add_argument("--hls-cache-dir", type=Path, default=HLS_CACHE_DIR)
+    parser.add_argument("--no-hls-cache", action="store_true")
+    parser.add_argument("--qor-db", type=Path, default=QOR_DB_FP)
+    args = parser.parse_args()
+    main(args)
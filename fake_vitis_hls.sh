@@ -0,0 +1,60 @@
+#!/bin/bash
+# Stand-in for vitis_hls to exercise hls_worker without a Vitis install. It
+# answers -version and runs "-f script" or an interactive "-i" session in
+# tclsh with the project commands stubbed out. Behaviour is picked with
+# environment variables:
+#   FAKE_VITIS_HLS_PROMPT  print a "vitis_hls> " prompt without a newline
+#                          before every command, like the real shell
+#   FAKE_VITIS_HLS_CRASH   path of a file; csynth_design deletes it and exits
+#                          the session, so only the first run crashes
+#   FAKE_VITIS_HLS_HANG    csynth_design never returns
+#   FAKE_VITIS_HLS_SLEEP   csynth_design takes this many milliseconds
+read -r -d '' STUBS <<'EOF'
+proc open_project {args} { set ::top [lindex $args end] }
+proc set_top {args} { set ::top [lindex $args end] }
+proc add_files {args} {}
+proc open_solution {args} {}
+proc set_part {args} {}
+proc create_clock {args} {}
+proc close_project {args} {}
+proc csynth_design {args} {
+  if {[info exists ::env(FAKE_VITIS_HLS_CRASH)] && [file exists $::env(FAKE_VITIS_HLS_CRASH)]} {
+    file delete $::env(FAKE_VITIS_HLS_CRASH)
+    exit 3
+  }
+  puts "INFO: \[HLS 200-10\] Analyzing design file '$::top.cpp' ..."
+  flush stdout
+  if {[info exists ::env(FAKE_VITIS_HLS_HANG)]} { vwait forever }
+  if {[info exists ::env(FAKE_VITIS_HLS_SLEEP)]} { after $::env(FAKE_VITIS_HLS_SLEEP) }
+  puts "INFO: \[HLS 200-10\] Starting hardware synthesis ..."
+  puts "INFO: \[HLS 200-111\] Finished Command csynth_design"
+  flush stdout
+}
+EOF
+
+if [ "$1" = "-version" ]; then
+  echo "****** Vitis HLS - High-Level Synthesis from C, C++ and OpenCL v0.0 (fake)"
+  exit 0
+fi
+
+if [ "$1" = "-f" ]; then
+  exec tclsh <(printf '%s\n' "$STUBS"; cat "$2")
+fi
+
+exec tclsh <(printf '%s\n' "$STUBS"; cat <<'EOF'
+set buf ""
+while 1 {
+  if {$buf eq "" && [info exists ::env(FAKE_VITIS_HLS_PROMPT)]} {
+    puts -nonewline "vitis_hls> "
+    flush stdout
+  }
+  if {[gets stdin line] < 0} { break }
+  append buf $line\n
+  if {![info complete $buf]} { continue }
+  if {[string trim $buf] eq "exit"} { break }
+  if {[catch {uplevel #0 $buf} err]} { puts $err }
+  flush stdout
+  set buf ""
+}
+EOF
+)
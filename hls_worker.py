@@ -0,0 +1,197 @@
+import queue
+import re
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+WORKER_DONE_MARKER = "@@HLS_WORKER_DONE@@"
+# the interactive prompt can end up in front of the marker on the same line,
+# and the return code is the only form of the marker that is not the batch
+# itself echoed back
+RE_WORKER_DONE = re.compile(re.escape(WORKER_DONE_MARKER) + r" (-?\d+)")
+
+
+class HLSWorkerCrashed(Exception): ...
+
+
+class HLSWorkerTimeout(Exception): ...
+
+
+@dataclass
+class HLSBatchResult:
+    returncode: int
+    output: str
+    error: str = ""
+    restarts: int = 0
+
+
+def tcl_quote(s: str) -> str:
+    return "{" + s + "}"
+
+
+def make_tcl_batch(commands: list[str], cwd: Path) -> str:
+    # The whole batch goes on one line so the interactive shell evaluates it as a
+    # single command, and is wrapped in catch so a failing csynth_design does not
+    # leave the session in a half open state. The marker line carries the return
+    # code back to the parent.
+    body = "; ".join(
+        [f"cd {tcl_quote(str(cwd.resolve()))}"]
+        + [c.strip() for c in commands if c.strip() and c.strip() != "exit"]
+    )
+    return (
+        f"set __rc [catch {{{body}}} __err]; "
+        "catch {close_project}; "
+        "if {$__rc} {puts $__err}; "
+        f'puts "{WORKER_DONE_MARKER} $__rc"; '
+        "flush stdout\n"
+    )
+
+
+class VitisHLSWorker:
+    def __init__(self, vitis_hls_bin: str = "vitis_hls"):
+        self.vitis_hls_bin = vitis_hls_bin
+        self.process: subprocess.Popen | None = None
+        self.lines: queue.Queue[str | None] = queue.Queue()
+        self.n_batches = 0
+        self.n_starts = 0
+
+    def start(self) -> None:
+        self.lines = queue.Queue()
+        self.process = subprocess.Popen(
+            [self.vitis_hls_bin, "-i"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        self.n_starts += 1
+        reader = threading.Thread(
+            target=self._read_output, args=(self.process, self.lines), daemon=True
+        )
+        reader.start()
+
+    @staticmethod
+    def _read_output(process: subprocess.Popen, lines: queue.Queue) -> None:
+        assert process.stdout is not None
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                assert self.process.stdin is not None
+                self.process.stdin.write("exit\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def kill(self) -> None:
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def run_batch(
+        self, commands: list[str], cwd: Path, timeout: float | None = None
+    ) -> HLSBatchResult:
+        if not self.is_alive():
+            self.start()
+        assert self.process is not None and self.process.stdin is not None
+
+        try:
+            self.process.stdin.write(make_tcl_batch(commands, cwd))
+            self.process.stdin.flush()
+        except OSError as e:
+            self.kill()
+            raise HLSWorkerCrashed(f"vitis_hls worker stdin closed: {e}") from e
+
+        # timeout bounds the whole batch, not the gap between output lines
+        deadline = None if timeout is None else time.monotonic() + timeout
+        output_lines = []
+        while True:
+            try:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(0.0, deadline - time.monotonic())
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                self.kill()
+                raise HLSWorkerTimeout(
+                    f"vitis_hls worker did not finish the batch within {timeout} s"
+                )
+            if line is None:
+                self.kill()
+                raise HLSWorkerCrashed(
+                    "vitis_hls worker exited before finishing batch:\n"
+                    + "".join(output_lines[-50:])
+                )
+            m = RE_WORKER_DONE.search(line)
+            if m is not None:
+                returncode = int(m.group(1))
+                break
+            output_lines.append(line)
+
+        self.n_batches += 1
+        return HLSBatchResult(returncode=returncode, output="".join(output_lines))
+
+
+@dataclass
+class VitisHLSWorkerPool:
+    n_workers: int
+    vitis_hls_bin: str = "vitis_hls"
+    max_restarts: int = 1
+    batch_timeout: float | None = None
+    workers: queue.Queue = field(init=False)
+
+    def __post_init__(self):
+        self.workers = queue.Queue()
+        for _ in range(self.n_workers):
+            self.workers.put(VitisHLSWorker(self.vitis_hls_bin))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def run_batch(self, commands: list[str], cwd: Path) -> HLSBatchResult:
+        worker: VitisHLSWorker = self.workers.get()
+        try:
+            restarts = 0
+            while True:
+                try:
+                    result = worker.run_batch(commands, cwd, timeout=self.batch_timeout)
+                    result.restarts = restarts
+                    return result
+                except HLSWorkerCrashed as e:
+                    # the session died mid batch, retry on a fresh process
+                    if restarts >= self.max_restarts:
+                        return HLSBatchResult(
+                            returncode=-1, output="", error=str(e), restarts=restarts
+                        )
+                    restarts += 1
+                except HLSWorkerTimeout as e:
+                    return HLSBatchResult(
+                        returncode=-1, output="", error=str(e), restarts=restarts
+                    )
+        finally:
+            self.workers.put(worker)
+
+    def close(self) -> None:
+        while not self.workers.empty():
+            worker: VitisHLSWorker = self.workers.get()
+            worker.stop()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import replace
+from pathlib import Path
+from typing import Any, Callable
+
+from profiling import traced
+from scheduler import Job, ResourceScheduler
+
+JOURNAL_FP = Path("./run_journal.jsonl")
+
+
+def hash_job_inputs(*inputs: str | Path) -> str:
+    # strings are hashed as is, a path by the names and bytes of its files
+    h = hashlib.sha256()
+    for item in inputs:
+        if not isinstance(item, Path):
+            h.update(f"\0{item}".encode())
+            continue
+        files = sorted(item.rglob("*")) if item.is_dir() else [item]
+        for fp in files:
+            if not fp.is_file():
+                continue
+            h.update(f"\0{fp.relative_to(item.parent).as_posix()}\0".encode())
+            h.update(fp.read_bytes())
+    return h.hexdigest()
+
+
+class RunJournal:
+    # Append only JSON lines, one "started" and one "done" / "failed" line per
+    # (job, config). The last line for a key wins; a job with a "started" line
+    # and nothing after it was interrupted. Every line is flushed and fsynced so
+    # a crash loses at most the line being written, which is skipped on load.
+
+    def __init__(self, fp: Path = JOURNAL_FP, resume: bool = False):
+        self.fp = fp
+        self.entries: dict[tuple[str, str], dict[str, Any]] = {}
+        if not resume and fp.exists():
+            fp.unlink()
+        if fp.exists():
+            for line in fp.read_text().splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[(entry["job"], entry["config"])] = entry
+        self.f = fp.open("a")
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.f.close()
+
+    def append(self, entry: dict[str, Any]) -> None:
+        entry = {**entry, "time": time.time()}
+        self.entries[(entry["job"], entry["config"])] = entry
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def record_start(self, job: Job, config: str) -> None:
+        stage, _, kernel = job.name.partition(":")
+        self.append(
+            {
+                "job": job.name,
+                "kernel": kernel,
+                "stage": stage,
+                "config": config,
+                "status": "started",
+            }
+        )
+
+    def record_finish(
+        self, job: Job, config: str, ok: bool, result: Any, error: str | None = None
+    ) -> None:
+        stage, _, kernel = job.name.partition(":")
+        self.append(
+            {
+                "job": job.name,
+                "kernel": kernel,
+                "stage": stage,
+                "config": config,
+                "status": "done" if ok else "failed",
+                "result": result,
+                "error": error,
+                "artifacts": [str(fp) for fp in job.artifacts],
+                "input_hash": job.input_hash,
+            }
+        )
+
+    def completed(self, job: Job, config: str) -> dict[str, Any] | None:
+        entry = self.entries.get((job.name, config))
+        if entry is None or entry["status"] != "done":
+            return None
+        # sources or tools changed since the result was journaled
+        if entry.get("input_hash") != job.input_hash:
+            return None
+        if not all(Path(fp).exists() for fp in entry["artifacts"]):
+            return None
+        return entry
+
+
+def resume_jobs(
+    jobs: list[Job],
+    journal: RunJournal,
+    config: str,
+    succeeded: Callable[[Any], bool] | None = None,
+) -> tuple[list[Job], dict[str, Any]]:
+    # drop jobs the journal already has a good result for; their results are
+    # handed back so callers can report on them, and dependants no longer wait
+    # on them. A journaled result that succeeded rejects (e.g. one of another
+    # shape written by a different tool) is not trusted and the job is redone
+    skipped = {}
+    for job in jobs:
+        entry = journal.completed(job, config)
+        if entry is None:
+            continue
+        if succeeded is not None and not succeeded(entry["result"]):
+            continue
+        skipped[job.name] = entry["result"]
+    remaining = [
+        replace(job, deps=tuple(dep for dep in job.deps if dep not in skipped))
+        for job in jobs
+        if job.name not in skipped
+    ]
+    if skipped:
+        print(f"Resuming: {len(skipped)} of {len(jobs)} jobs already done")
+    return remaining, skipped
+
+
+def journal_hooks(
+    journal: RunJournal, config: str, succeeded: Callable[[Any], bool] | None = None
+) -> tuple[Callable[[Job], None], Callable[[Job, bool, Any], None]]:
+    # scheduler callbacks; succeeded lets callers whose jobs report failure via
+    # a return code instead of an exception mark those as failed
+    def on_start(job: Job) -> None:
+        journal.record_start(job, config)
+
+    def on_finish(job: Job, ok: bool, value: Any) -> None:
+        if not ok:
+            journal.record_finish(job, config, False, None, value)
+        elif succeeded is not None and not succeeded(value):
+            journal.record_finish(job, config, False, value)
+        else:
+            journal.record_finish(job, config, True, value)
+
+    return on_start, on_finish
+
+
+@traced("run_with_journal", "schedule", "config")
+def run_with_journal(
+    scheduler: ResourceScheduler,
+    jobs: list[Job],
+    journal: RunJournal,
+    config: str,
+    succeeded: Callable[[Any], bool] | None = None,
+    raise_on_error: bool = True,
+) -> list[Any]:
+    remaining, skipped = resume_jobs(jobs, journal, config, succeeded)
+    on_start, on_finish = journal_hooks(journal, config, succeeded)
+    results = scheduler.run(
+        remaining, raise_on_error, on_start=on_start, on_finish=on_finish
+    )
+    by_name = dict(skipped)
+    by_name.update((job.name, result) for job, result in zip(remaining, results))
+    return [by_name.get(job.name) for job in jobs]
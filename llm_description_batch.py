@@ -0,0 +1,528 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from string import Template
+from textwrap import dedent
+from typing import Any
+
+from dotenv import dotenv_values
+from pydantic import BaseModel, ValidationError
+
+from benchmarks import load_benchmarks
+from llm_kernel_descriptions import (
+    TokenBudget,
+    TokenUsage,
+    build_prompt,
+    call_with_retries,
+    completion_reserve,
+    default_max_prompt_tokens,
+    response_usage,
+)
+from models import (
+    LLM_CACHE_DIR,
+    MODELS,
+    TAI_MAX_CONNECTIONS,
+    ModelWithSettings,
+)
+from prompt_compaction import PromptTooLong, count_tokens
+
+BATCH_RESULTS_FP = Path("./description_batch.json")
+
+BATCH_STATS_COLUMNS = [
+    ("config", "config"),
+    ("calls", "calls"),
+    ("cached", "cached"),
+    ("ok", "ok"),
+    ("malformed", "malformed"),
+    ("failed", "failed"),
+    ("latency_mean", "latency s"),
+    ("latency_p50", "p50 s"),
+    ("latency_p95", "p95 s"),
+    ("ttft_p50", "ttft p50 s"),
+    ("tokens_per_second", "tok/s"),
+    ("prompt_tokens", "prompt"),
+    ("completion_tokens", "completion"),
+]
+
+structured_prompt_template = Template(
+    dedent("""
+    Help me write a natural description of this high-level synthesis hardware design.
+
+    The description should cover the algorithm and functionality as well as the high level dataflow and architecture of the design.
+    We already know the code is for HLS and written in C++, so that doesn't need to be mentioned.
+    All arguments in the top-level function should be described in the inputs and outputs with details about the data type and layout.
+    Data structure descriptions should include the data type, size, layout, fields and use in the design.
+
+    The top level kernel function is: `${top_name}`
+
+    Only output a single JSON object with these fields:
+    - "description": a detailed and thorough high level natural language description of the design
+    - "top_level_function": the name of the top level function
+    - "inputs": a list of {"name": ..., "description": ...}, one per input argument
+    - "outputs": a list of {"name": ..., "description": ...}, one per output argument
+    - "data_structures": a list of {"name": ..., "description": ...} for the important data structures and data types
+    - "sub_components": a list of {"name": ..., "description": ...}, one per sub-component
+
+    Input Kernel Code:
+
+    ${kernel_code}
+
+    Description as a JSON object:
+    """).strip()
+)
+
+RE_CODE_FENCE = re.compile(r"^```[a-z]*\s*\n(.*)\n```$", re.DOTALL)
+
+
+class NamedDescription(BaseModel):
+    name: str
+    description: str
+
+
+class KernelDescription(BaseModel):
+    description: str
+    top_level_function: str
+    inputs: list[NamedDescription]
+    outputs: list[NamedDescription]
+    data_structures: list[NamedDescription]
+    sub_components: list[NamedDescription]
+
+
+@dataclass
+class BatchConfig:
+    # one row of the matrix: a model, the sampling settings on top of the
+    # model's defaults and how many samples to draw per kernel
+    name: str
+    model: str
+    settings: dict[str, Any] = field(default_factory=dict)
+    samples: int = 1
+
+
+@dataclass
+class CallStats:
+    latency: float
+    # None when nothing was streamed back, e.g. a cached response
+    time_to_first_token: float | None
+    usage: TokenUsage
+    malformed: bool = False
+
+
+@dataclass
+class SampleResult:
+    kernel: str
+    config: str
+    model: str
+    sample: int
+    # ok, malformed (still unparsable after the parse retries) or failed
+    status: str = "failed"
+    description: dict[str, Any] | None = None
+    # the last response, kept when it could not be parsed
+    raw: str | None = None
+    error: str | None = None
+    calls: list[CallStats] = field(default_factory=list)
+
+
+def load_matrix(matrix_fp: Path) -> list[BatchConfig]:
+    # a json list of {"model": ..., "settings": {...}, "samples": n}, with an
+    # optional "name" to tell apart rows that use the same model
+    configs = []
+    for i, row in enumerate(json.loads(matrix_fp.read_text())):
+        if row["model"] not in MODELS:
+            raise ValueError(f"Unknown model {row['model']!r} in {matrix_fp}")
+        configs.append(
+            BatchConfig(
+                row.get("name") or f"{row['model']}/{i}",
+                row["model"],
+                row.get("settings") or {},
+                row.get("samples", 1),
+            )
+        )
+    return configs
+
+
+def build_matrix(
+    models: list[str], temperatures: list[float | None], samples: int
+) -> list[BatchConfig]:
+    configs = []
+    for model in models:
+        for temperature in temperatures:
+            if temperature is None:
+                configs.append(BatchConfig(model, model, {}, samples))
+            else:
+                configs.append(
+                    BatchConfig(
+                        f"{model}/t{temperature:g}",
+                        model,
+                        {"temperature": temperature},
+                        samples,
+                    )
+                )
+    return configs
+
+
+def parse_description(text: str) -> KernelDescription:
+    # json mode is only a request, some models still wrap the object in a
+    # markdown code block
+    text = text.strip()
+    m = RE_CODE_FENCE.match(text)
+    if m is not None:
+        text = m.group(1)
+    return KernelDescription.model_validate_json(text)
+
+
+def sample_model(
+    prompt: str, model_and_settings: ModelWithSettings
+) -> tuple[str, CallStats]:
+    start = time.perf_counter()
+    time_to_first_token = None
+    model_response = model_and_settings.model.prompt(
+        prompt, stream=True, **model_and_settings.settings
+    )
+    for _ in model_response:
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start
+    text = model_response.text()
+    latency = time.perf_counter() - start
+    usage = response_usage(model_response)
+    if usage.cached:
+        time_to_first_token = None
+    return text, CallStats(latency, time_to_first_token, usage)
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize_results(
+    configs: list[BatchConfig], results: list[SampleResult]
+) -> list[dict[str, Any]]:
+    # latency and throughput only over calls that went to the model
+    rows = []
+    for config in configs:
+        config_results = [r for r in results if r.config == config.name]
+        calls = [c for r in config_results for c in r.calls]
+        sent = [c for c in calls if not c.usage.cached]
+        latencies = [c.latency for c in sent]
+        ttfts = [c.time_to_first_token for c in sent if c.time_to_first_token]
+        throughputs = [
+            c.usage.completion_tokens / c.latency
+            for c in sent
+            if c.usage.completion_tokens and c.latency > 0
+        ]
+        rows.append(
+            {
+                "config": config.name,
+                "calls": len(sent),
+                "cached": len(calls) - len(sent),
+                "ok": sum(r.status == "ok" for r in config_results),
+                "malformed": sum(r.status == "malformed" for r in config_results),
+                "failed": sum(r.status == "failed" for r in config_results),
+                "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p95": percentile(latencies, 0.95),
+                "ttft_p50": percentile(ttfts, 0.5),
+                "tokens_per_second": (
+                    sum(throughputs) / len(throughputs) if throughputs else None
+                ),
+                "prompt_tokens": sum(c.usage.prompt_tokens or 0 for c in sent),
+                "completion_tokens": sum(c.usage.completion_tokens or 0 for c in sent),
+            }
+        )
+    return rows
+
+
+def format_batch_stats(rows: list[dict[str, Any]]) -> str:
+    table = [[header for _, header in BATCH_STATS_COLUMNS]]
+    for row in rows:
+        cells = []
+        for key, _ in BATCH_STATS_COLUMNS:
+            value = row[key]
+            if value is None:
+                cells.append("-")
+            elif isinstance(value, float):
+                cells.append(f"{value:.2f}")
+            else:
+                cells.append(str(value))
+        table.append(cells)
+    widths = [max(len(r[i]) for r in table) for i in range(len(BATCH_STATS_COLUMNS))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(r, widths)).rstrip()
+        for r in table
+    )
+
+
+def write_results(
+    results_fp: Path,
+    configs: list[BatchConfig],
+    results: list[SampleResult],
+    stats: list[dict[str, Any]],
+) -> None:
+    # index[kernel][config][sample] is the position of the sample in results
+    results = sorted(results, key=lambda r: (r.kernel, r.config, r.sample))
+    index: dict[str, dict[str, list[int]]] = {}
+    for i, r in enumerate(results):
+        index.setdefault(r.kernel, {}).setdefault(r.config, []).append(i)
+    data = {
+        "configs": [asdict(c) for c in configs],
+        "index": index,
+        "results": [asdict(r) for r in results],
+        "stats": stats,
+    }
+    results_fp.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=results_fp.parent, prefix=".tmp_")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_name, results_fp)
+
+
+async def run_batch(
+    design_dirs: list[Path],
+    configs: list[BatchConfig],
+    api_key: str,
+    max_in_flight: int = 4,
+    tokens_per_minute: int | None = None,
+    max_retries: int = 6,
+    max_parse_retries: int = 2,
+    compact: bool = True,
+    summarize_tables: bool = False,
+    max_prompt_tokens: int | None = None,
+    api_url: str | None = None,
+    cache_dir: Path | None = LLM_CACHE_DIR,
+) -> list[SampleResult]:
+    # Every (kernel, config, sample) is its own job and all of them share one
+    # thread pool, semaphore and token budget. Transport errors are retried
+    # by call_with_retries like in generate_descriptions. A response that
+    # does not parse into a KernelDescription is sampled again past the
+    # cache, which is the only case where the response itself is retried.
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    budget = TokenBudget(tokens_per_minute)
+    schema = KernelDescription.model_json_schema()
+
+    # one model, and so one pooled session, per model name
+    models: dict[str, ModelWithSettings] = {}
+    for config in configs:
+        if config.model not in models:
+            model_and_settings = MODELS[config.model](api_key)
+            if api_url is not None:
+                model_and_settings.model.api_url = api_url
+            model_and_settings.model.cache_dir = cache_dir
+            models[config.model] = model_and_settings
+
+    # the prompt is compacted to fit budget_tokens, which depends on the model
+    # and on the max_tokens a config reserves for the completion
+    prompts: dict[tuple[str, str, int], str] = {}
+    results: list[SampleResult] = []
+
+    async def run_sample(
+        design_dir_fp: Path, config: BatchConfig, sample: int
+    ) -> SampleResult:
+        design_name = design_dir_fp.name
+        label = f"{design_name} {config.name} #{sample}"
+        result = SampleResult(design_name, config.name, config.model, sample)
+        base = models[config.model]
+        model_and_settings = ModelWithSettings(
+            base.model,
+            {
+                **base.settings,
+                **config.settings,
+                "json_schema_output": schema,
+                "sample": sample,
+            },
+            base.context_tokens,
+        )
+        budget_tokens = max_prompt_tokens
+        if budget_tokens is None:
+            budget_tokens = default_max_prompt_tokens(model_and_settings)
+        try:
+            key = (design_name, config.model, budget_tokens)
+            if key not in prompts:
+                prompts[key] = build_prompt(
+                    design_dir_fp,
+                    compact,
+                    summarize_tables,
+                    budget_tokens,
+                    structured_prompt_template,
+                )
+            prompt = prompts[key]
+        except PromptTooLong as e:
+            result.error = f"{type(e).__name__}: {e}"
+            print(f"Skipping {label}: {e}")
+            return result
+        prompt_tokens = count_tokens(prompt)
+        estimate = prompt_tokens + completion_reserve(model_and_settings)
+
+        parse_attempt = 0
+        while True:
+            try:
+                text, call = await call_with_retries(
+                    label,
+                    functools.partial(sample_model, prompt, model_and_settings),
+                    lambda r: r[1].usage,
+                    executor,
+                    in_flight,
+                    budget,
+                    estimate,
+                    max_retries,
+                )
+            except Exception as e:
+                result.error = f"{type(e).__name__}: {e}"
+                print(f"Failed {label}: {e}")
+                return result
+            call.usage.estimated_prompt_tokens = prompt_tokens
+            result.calls.append(call)
+
+            try:
+                description = parse_description(text)
+            except ValidationError as e:
+                call.malformed = True
+                result.raw = text
+                result.error = f"Malformed response: {e.error_count()} errors"
+                if parse_attempt == max_parse_retries:
+                    result.status = "malformed"
+                    print(f"{label}: still malformed after {parse_attempt} retries")
+                    return result
+                parse_attempt += 1
+                print(f"{label}: malformed response, sampling again")
+                # the malformed response was cached too, skip past it; the new
+                # one replaces it
+                model_and_settings = ModelWithSettings(
+                    model_and_settings.model,
+                    {**model_and_settings.settings, "no_cache": True},
+                    model_and_settings.context_tokens,
+                )
+                continue
+
+            result.status = "ok"
+            result.description = description.model_dump()
+            result.raw = None
+            result.error = None
+            print(f"{label}: ok in {call.latency:.1f}s")
+            return result
+
+    async def run_and_collect(design_dir_fp: Path, config: BatchConfig, n: int):
+        results.append(await run_sample(design_dir_fp, config, n))
+
+    try:
+        await asyncio.gather(
+            *(
+                run_and_collect(design_dir_fp, config, n)
+                for design_dir_fp in design_dirs
+                for config in configs
+                for n in range(config.samples)
+            )
+        )
+    finally:
+        executor.shutdown()
+    return results
+
+
+def main(args):
+    design_dir_fp: Path = args.design_dir
+    dirs = [
+        benchmark.directory for benchmark in load_benchmarks(design_dir_fp).values()
+    ]
+    if args.kernels:
+        dirs = [d for d in dirs if d.name in args.kernels]
+
+    if args.matrix is not None:
+        configs = load_matrix(args.matrix)
+    else:
+        configs = build_matrix(args.models, args.temperatures, args.samples)
+
+    API_KEY_TAI = dotenv_values(".env").get("TOGETHER_API_KEY") or os.environ.get(
+        "TOGETHER_API_KEY"
+    )
+    assert API_KEY_TAI
+
+    n_jobs = len(dirs) * sum(config.samples for config in configs)
+    print(f"Running {n_jobs} samples over {len(dirs)} kernels, {len(configs)} configs")
+    results = asyncio.run(
+        run_batch(
+            dirs,
+            configs,
+            API_KEY_TAI,
+            max_in_flight=args.jobs,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            max_parse_retries=args.max_parse_retries,
+            compact=not args.no_compact,
+            summarize_tables=args.summarize_tables,
+            max_prompt_tokens=args.max_prompt_tokens,
+            api_url=args.api_url,
+            cache_dir=None if args.no_llm_cache else args.llm_cache_dir,
+        )
+    )
+    stats = summarize_results(configs, results)
+    write_results(args.output, configs, results, stats)
+    print(format_batch_stats(stats))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Sample structured kernel descriptions from a matrix of "
+        "models and settings"
+    )
+    parser.add_argument(
+        "design_dir", type=Path, nargs="?", default=Path("./hls-machsuite/")
+    )
+    parser.add_argument("-o", "--output", type=Path, default=BATCH_RESULTS_FP)
+    parser.add_argument("-k", "--kernels", nargs="+", default=None)
+    parser.add_argument(
+        "--matrix",
+        type=Path,
+        default=None,
+        help='JSON list of {"model", "settings", "samples"} rows, overrides '
+        "--models, --temperatures and --samples",
+    )
+    parser.add_argument(
+        "-m",
+        "--models",
+        nargs="+",
+        choices=list(MODELS),
+        default=["llama-3-70b-chat-hf"],
+    )
+    parser.add_argument(
+        "-t",
+        "--temperatures",
+        nargs="+",
+        type=float,
+        default=[None],
+        help="Sample every model at each of these temperatures",
+    )
+    parser.add_argument("-n", "--samples", type=int, default=1)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help=f"Requests in flight at once (at most {TAI_MAX_CONNECTIONS} per model)",
+    )
+    parser.add_argument("--tokens-per-minute", type=int, default=None)
+    parser.add_argument("--max-retries", type=int, default=6)
+    parser.add_argument(
+        "--max-parse-retries",
+        type=int,
+        default=2,
+        help="Sample a response that does not parse again this many times",
+    )
+    parser.add_argument("--no-compact", action="store_true", default=False)
+    parser.add_argument("--summarize-tables", action="store_true", default=False)
+    parser.add_argument("--max-prompt-tokens", type=int, default=None)
+    parser.add_argument("--api-url", default=None)
+    parser.add_argument("--llm-cache-dir", type=Path, default=LLM_CACHE_DIR)
+    parser.add_argument("--no-llm-cache", action="store_true", default=False)
+    args = parser.parse_args()
+    main(args)
@@ -1,14 +1,48 @@
+import argparse
+import asyncio
+import collections
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from pprint import pp
 from string import Template
 from textwrap import dedent
+from typing import Callable, TypeVar
 
+import llm
+import requests
 from dotenv import dotenv_values
 
+from benchmarks import load_benchmarks
 from models import (
-    LLM_LLAMA_3_70B_CHAT_HF,
+    LLM_CACHE_DIR,
+    MODELS,
+    TAI_MAX_CONNECTIONS,
     ModelWithSettings,
+    TAIRateLimited,
+    TAIStreamError,
+    TAITimeout,
+    evict_llm_cache,
 )
+from prompt_compaction import PromptTooLong, compact_c_source, count_tokens
+
+TOKEN_USAGE_COLUMNS = [
+    ("kernel", "kernel"),
+    ("estimated_prompt_tokens", "est. prompt"),
+    ("prompt_tokens", "prompt"),
+    ("completion_tokens", "completion"),
+    ("cached", "cached"),
+]
+
+# completion tokens reserved when the model settings do not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+T = TypeVar("T")
 
 prompt_template = Template(
     dedent("""
@@ -69,12 +103,46 @@ code_file_template = Template(
 )
 
 
-def gen_description(design_dir_fp: Path, model_and_settings: ModelWithSettings) -> str:
+def build_prompt(
+    design_dir_fp: Path,
+    compact: bool = True,
+    summarize_tables: bool = False,
+    max_prompt_tokens: int | None = None,
+    template: Template = prompt_template,
+) -> str:
+    # Over budget, the constant tables are summarized before giving up on the
+    # kernel, they are the bulk of the code in e.g. aes and rarely matter for
+    # the description.
     design_name = design_dir_fp.name
     kernel_fp = design_dir_fp / f"{design_name}.cpp"
     header_fp = design_dir_fp / f"{design_name}.h"
     top_fp = design_dir_fp / "top.txt"
 
+    prompt = render_prompt(
+        kernel_fp, header_fp, top_fp, compact, summarize_tables, template
+    )
+    if max_prompt_tokens is None:
+        return prompt
+    prompt_tokens = count_tokens(prompt)
+    if prompt_tokens > max_prompt_tokens and compact and not summarize_tables:
+        prompt = render_prompt(kernel_fp, header_fp, top_fp, compact, True, template)
+        prompt_tokens = count_tokens(prompt)
+    if prompt_tokens > max_prompt_tokens:
+        raise PromptTooLong(
+            f"Prompt for {design_name} is ~{prompt_tokens} tokens, "
+            f"over the budget of {max_prompt_tokens}"
+        )
+    return prompt
+
+
+def render_prompt(
+    kernel_fp: Path,
+    header_fp: Path,
+    top_fp: Path,
+    compact: bool = True,
+    summarize_tables: bool = False,
+    template: Template = prompt_template,
+) -> str:
     kernel_fp_name = kernel_fp.name
     kernel_contents = kernel_fp.read_text().strip()
     kernel_md_code_block_type = "cpp"
@@ -83,6 +151,10 @@ def gen_description(design_dir_fp: Path, model_and_settings: ModelWithSettings)
     header_contents = header_fp.read_text().strip()
     header_md_code_block_type = "cpp"
 
+    if compact:
+        kernel_contents = compact_c_source(kernel_contents, summarize_tables)
+        header_contents = compact_c_source(header_contents, summarize_tables)
+
     top_name = top_fp.read_text().strip()
 
     kernel_code_formatted = code_file_template.substitute(
@@ -98,11 +170,15 @@ def gen_description(design_dir_fp: Path, model_and_settings: ModelWithSettings)
 
     code_formatted = f"{kernel_code_formatted}\n\n{header_code_formatted}"
 
-    prompt = prompt_template.substitute(
+    prompt = template.substitute(
         top_name=top_name,
         kernel_code=code_formatted,
     )
+    return prompt
+
 
+def gen_description(design_dir_fp: Path, model_and_settings: ModelWithSettings) -> str:
+    prompt = build_prompt(design_dir_fp)
     model = model_and_settings.model
     model_settings = model_and_settings.settings
     model_response = model.prompt(prompt, **model_settings)
@@ -111,24 +187,384 @@ def gen_description(design_dir_fp: Path, model_and_settings: ModelWithSettings)
     return model_response_txt
 
 
-if __name__ == "__main__":
-    design_dir_fp = Path("./hls-machsuite/")
-    dirs = sorted(list(design_dir_fp.glob("*")))
+@dataclass
+class TokenUsage:
+    # counted locally before sending
+    estimated_prompt_tokens: int = 0
+    # as reported by the api, None when the response carried no usage
+    prompt_tokens: int | None = None
+    completion_tokens: int | None = None
+    cached: bool = False
 
-    API_KEY_TAI = dotenv_values(".env")["TOGETHER_API_KEY"]
-    assert API_KEY_TAI
+    def total(self) -> int | None:
+        if self.prompt_tokens is None and self.completion_tokens is None:
+            return None
+        return (self.prompt_tokens or 0) + (self.completion_tokens or 0)
 
-    # model_with_settings = LLM_TAI_MIXTRAL_8X22B_INSTRUCT(API_KEY_TAI)
-    model_with_settings = LLM_LLAMA_3_70B_CHAT_HF(API_KEY_TAI)
 
-    description_dir = Path("./generated_descriptions/")
-    description_dir.mkdir(exist_ok=True)
-    for design_dir_fp in dirs:
+def prompt_model(
+    prompt: str, model_and_settings: ModelWithSettings, partial_fp: Path | None = None
+) -> tuple[str, TokenUsage]:
+    # streamed chunks are appended to partial_fp as they arrive, so a long
+    # generation can be followed with tail -f
+    model_response = model_and_settings.model.prompt(
+        prompt, stream=True, **model_and_settings.settings
+    )
+    if partial_fp is None:
+        text = model_response.text()
+    else:
+        with partial_fp.open("w") as f:
+            for chunk in model_response:
+                f.write(chunk)
+                f.flush()
+        text = model_response.text()
+    return text, response_usage(model_response)
+
+
+def response_usage(model_response: llm.Response) -> TokenUsage:
+    # answered from the response cache, nothing was sent
+    if (model_response.response_json or {}).get("cached"):
+        return TokenUsage(prompt_tokens=0, completion_tokens=0, cached=True)
+    usage = model_response.usage()
+    return TokenUsage(prompt_tokens=usage.input, completion_tokens=usage.output)
+
+
+def completion_reserve(model_and_settings: ModelWithSettings) -> int:
+    max_tokens = model_and_settings.settings.get("max_tokens")
+    return max_tokens or DEFAULT_COMPLETION_TOKENS
+
+
+def default_max_prompt_tokens(model_and_settings: ModelWithSettings) -> int | None:
+    # whatever the context leaves after the completion
+    if model_and_settings.context_tokens is None:
+        return None
+    return model_and_settings.context_tokens - completion_reserve(model_and_settings)
+
+
+def format_token_usage(usage: dict[str, TokenUsage]) -> str:
+    table = [[header for _, header in TOKEN_USAGE_COLUMNS]]
+    for design_name, u in usage.items():
+        row = {"kernel": design_name, **u.__dict__}
+        table.append(
+            [
+                "-" if row[key] is None else str(row[key])
+                for key, _ in TOKEN_USAGE_COLUMNS
+            ]
+        )
+    totals = ["total"]
+    for key, _ in TOKEN_USAGE_COLUMNS[1:-1]:
+        totals.append(str(sum(getattr(u, key) or 0 for u in usage.values())))
+    totals.append(str(sum(u.cached for u in usage.values())))
+    table.append(totals)
+    widths = [max(len(r[i]) for r in table) for i in range(len(TOKEN_USAGE_COLUMNS))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(r, widths)).rstrip()
+        for r in table
+    )
+
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, (TAIRateLimited, TAITimeout, TAIStreamError)):
+        return True
+    if isinstance(
+        e,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ),
+    ):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code >= 500
+    return False
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float:
+    # full jitter, so requests that were rejected together do not all come back
+    # at the same moment
+    delay = random.uniform(
+        0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+class TokenBudget:
+    # Sliding one minute window over the tokens of requests sent. A request
+    # reserves its estimate before it is sent and the reservation is corrected
+    # to the reported usage once it is back. A single request bigger than the
+    # whole budget is let through once the window is empty.
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, tokens_per_minute: int | None):
+        self.tokens_per_minute = tokens_per_minute
+        self.window: collections.deque[list] = collections.deque()
+        self.lock = asyncio.Lock()
+
+    def used(self, now: float) -> int:
+        while self.window and now - self.window[0][0] >= self.WINDOW_SECONDS:
+            self.window.popleft()
+        return sum(tokens for _, tokens in self.window)
+
+    async def acquire(self, tokens: int) -> list:
+        reservation = [time.monotonic(), tokens]
+        if self.tokens_per_minute is None:
+            return reservation
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                used = self.used(now)
+                if not self.window or used + tokens <= self.tokens_per_minute:
+                    break
+                await asyncio.sleep(self.window[0][0] + self.WINDOW_SECONDS - now)
+            reservation[0] = now
+            self.window.append(reservation)
+        return reservation
+
+    def settle(self, reservation: list, tokens: int) -> None:
+        reservation[1] = tokens
+
+
+async def call_with_retries(
+    label: str,
+    fn: Callable[[], T],
+    usage: Callable[[T], TokenUsage],
+    executor: ThreadPoolExecutor,
+    in_flight: asyncio.Semaphore,
+    budget: TokenBudget,
+    estimate: int,
+    max_retries: int,
+) -> T:
+    # Runs the blocking fn on the executor once a slot and the estimated
+    # tokens are free. Transport errors are retried with backoff, anything
+    # else or the last failure is raised to the caller.
+    loop = asyncio.get_running_loop()
+    for attempt in range(max_retries + 1):
+        try:
+            async with in_flight:
+                reservation = await budget.acquire(estimate)
+                result = await loop.run_in_executor(executor, fn)
+        except Exception as e:
+            if isinstance(e, TAIRateLimited):
+                # rejected requests do not count against the limit
+                budget.settle(reservation, 0)
+            if not is_retryable(e) or attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt, getattr(e, "retry_after", None))
+            print(f"{label}: {type(e).__name__}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        tokens = usage(result).total()
+        budget.settle(reservation, tokens if tokens is not None else estimate)
+        return result
+
+
+async def generate_descriptions(
+    design_dirs: list[Path],
+    model_and_settings: ModelWithSettings,
+    description_dir: Path,
+    max_in_flight: int = 4,
+    tokens_per_minute: int | None = None,
+    max_retries: int = 6,
+    compact: bool = True,
+    summarize_tables: bool = False,
+    max_prompt_tokens: int | None = None,
+) -> tuple[dict[str, TokenUsage], dict[str, str]]:
+    # The blocking llm client runs on a small thread pool that shares the
+    # model's pooled session, the semaphore keeps at most max_in_flight
+    # requests open. Every description is written as soon as it is back, a
+    # kernel that still fails after its retries, or whose prompt does not fit
+    # max_prompt_tokens, is reported and skipped.
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    budget = TokenBudget(tokens_per_minute)
+    usage: dict[str, TokenUsage] = {}
+    errors: dict[str, str] = {}
+
+    async def describe(design_dir_fp: Path) -> None:
         design_name = design_dir_fp.name
-        print(f"Getting description for {design_name}")
+        try:
+            prompt = build_prompt(
+                design_dir_fp, compact, summarize_tables, max_prompt_tokens
+            )
+        except PromptTooLong as e:
+            errors[design_name] = f"{type(e).__name__}: {e}"
+            print(f"Skipping {design_name}: {e}")
+            return
+        prompt_tokens = count_tokens(prompt)
+        estimate = prompt_tokens + completion_reserve(model_and_settings)
         description_fp = description_dir / f"{design_name}.md"
-        if description_fp.exists():
-            description_fp.unlink()
-        description_txt = gen_description(design_dir_fp, model_with_settings)
-        description_fp.write_text(description_txt)
-        print(f"Description for {design_name} written to {description_fp}")
+        partial_fp = description_dir / f"{design_name}.md.partial"
+
+        def fetch() -> tuple[str, TokenUsage]:
+            print(f"Getting description for {design_name}")
+            return prompt_model(prompt, model_and_settings, partial_fp)
+
+        try:
+            text, kernel_usage = await call_with_retries(
+                design_name,
+                fetch,
+                lambda r: r[1],
+                executor,
+                in_flight,
+                budget,
+                estimate,
+                max_retries,
+            )
+        except Exception as e:
+            # whatever was streamed before the last failure is not a description
+            partial_fp.unlink(missing_ok=True)
+            errors[design_name] = f"{type(e).__name__}: {e}"
+            print(f"Failed to get description for {design_name}: {e}")
+            return
+        kernel_usage.estimated_prompt_tokens = prompt_tokens
+        usage[design_name] = kernel_usage
+        # the partial file only ever holds the chunks, which are the text
+        os.replace(partial_fp, description_fp)
+        print(
+            f"Description for {design_name} written to {description_fp} "
+            f"({len(text)} chars, {kernel_usage.prompt_tokens} prompt + "
+            f"{kernel_usage.completion_tokens} completion tokens)"
+        )
+
+    try:
+        await asyncio.gather(*(describe(d) for d in design_dirs))
+    finally:
+        executor.shutdown()
+    return usage, errors
+
+
+def main(args):
+    design_dir_fp: Path = args.design_dir
+    dirs = [
+        benchmark.directory for benchmark in load_benchmarks(design_dir_fp).values()
+    ]
+    if args.kernels:
+        dirs = [d for d in dirs if d.name in args.kernels]
+
+    API_KEY_TAI = dotenv_values(".env").get("TOGETHER_API_KEY") or os.environ.get(
+        "TOGETHER_API_KEY"
+    )
+    assert API_KEY_TAI
+
+    model_with_settings = MODELS[args.model](API_KEY_TAI)
+    if args.api_url is not None:
+        model_with_settings.model.api_url = args.api_url
+    if args.no_llm_cache:
+        model_with_settings.model.cache_dir = None
+    else:
+        model_with_settings.model.cache_dir = args.llm_cache_dir
+        if args.llm_cache_max_size is not None:
+            evicted = evict_llm_cache(args.llm_cache_dir, args.llm_cache_max_size)
+            if evicted:
+                print(f"Evicted {len(evicted)} entries from LLM cache")
+
+    description_dir: Path = args.output_dir
+    description_dir.mkdir(exist_ok=True)
+    if args.skip_existing:
+        dirs = [d for d in dirs if not (description_dir / f"{d.name}.md").exists()]
+
+    max_prompt_tokens = args.max_prompt_tokens
+    if max_prompt_tokens is None:
+        max_prompt_tokens = default_max_prompt_tokens(model_with_settings)
+
+    usage, errors = asyncio.run(
+        generate_descriptions(
+            dirs,
+            model_with_settings,
+            description_dir,
+            max_in_flight=args.jobs,
+            tokens_per_minute=args.tokens_per_minute,
+            max_retries=args.max_retries,
+            compact=not args.no_compact,
+            summarize_tables=args.summarize_tables,
+            max_prompt_tokens=max_prompt_tokens,
+        )
+    )
+    if usage:
+        print(format_token_usage(dict(sorted(usage.items()))))
+    print(f"{len(dirs) - len(errors)} of {len(dirs)} descriptions written")
+    for design_name, error in errors.items():
+        print(f"{design_name}: {error}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate kernel descriptions with an LLM, several at a time"
+    )
+    parser.add_argument(
+        "design_dir", type=Path, nargs="?", default=Path("./hls-machsuite/")
+    )
+    parser.add_argument(
+        "-o", "--output-dir", type=Path, default=Path("./generated_descriptions/")
+    )
+    parser.add_argument("-k", "--kernels", nargs="+", default=None)
+    parser.add_argument(
+        "-m", "--model", choices=list(MODELS), default="llama-3-70b-chat-hf"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help=f"Requests in flight at once (at most {TAI_MAX_CONNECTIONS})",
+    )
+    parser.add_argument(
+        "--tokens-per-minute",
+        type=int,
+        default=None,
+        help="Hold requests back to stay below this many prompt + completion "
+        "tokens per minute",
+    )
+    parser.add_argument("--max-retries", type=int, default=6)
+    parser.add_argument(
+        "--no-compact",
+        action="store_true",
+        default=False,
+        help="Send the sources verbatim, with comments, includes and blank lines",
+    )
+    parser.add_argument(
+        "--summarize-tables",
+        action="store_true",
+        default=False,
+        help="Replace large constant tables (e.g. the AES S-box) with a summary "
+        "even when the prompt fits without it",
+    )
+    parser.add_argument(
+        "--max-prompt-tokens",
+        type=int,
+        default=None,
+        help="Skip kernels whose prompt is still over this many tokens after "
+        "compaction (default: the model's context minus the completion)",
+    )
+    parser.add_argument(
+        "--api-url",
+        default=None,
+        help="Chat completions endpoint to use instead of TogetherAI's, e.g. a "
+        "local mock server",
+    )
+    parser.add_argument("--llm-cache-dir", type=Path, default=LLM_CACHE_DIR)
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        default=False,
+        help="Always query the model, neither reading nor writing the cache",
+    )
+    parser.add_argument(
+        "--llm-cache-max-size",
+        type=int,
+        default=None,
+        help="Evict least recently used cached responses until the cache is "
+        "below this many bytes",
+    )
+    parser.add_argument(
+        "--skip-existing",
+        action="store_true",
+        default=False,
+        help="Only generate descriptions that are not in the output dir yet",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,172 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_SERVER_PORT = 8778
+# tokens are counted as whitespace separated words, close enough for the
+# token budget
+MOCK_DESCRIPTION = """```markdown
+# {top}
+
+## Algorithm
+A mock description of `{top}`, answered without calling a model.
+
+## Inputs
+## Outputs
+```"""
+MOCK_STRUCTURED_DESCRIPTION = {
+    "description": "A mock description, answered without calling a model.",
+    "top_level_function": "",
+    "inputs": [],
+    "outputs": [],
+    "data_structures": [],
+    "sub_components": [],
+}
+
+
+class MockChatCompletions(ThreadingHTTPServer):
+    # Stand-in for TogetherAI's chat completions endpoint, for
+    # llm_kernel_descriptions and llm_description_batch without an API key.
+    # Streamed requests get server-sent events with a final usage event, like
+    # the real API. Every rate_limit_every-th request is rejected with a 429
+    # and a retry-after, and a prompt that mentions one of break_stream is cut
+    # off half way without [DONE].
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = MOCK_SERVER_PORT,
+        rate_limit_every: int | None = None,
+        break_stream: tuple[str, ...] = (),
+        delay: float = 0.0,
+        retry_after: float = 0.1,
+    ):
+        super().__init__(("127.0.0.1", port), MockChatCompletionsHandler)
+        self.rate_limit_every = rate_limit_every
+        self.break_stream = break_stream
+        self.delay = delay
+        self.retry_after = retry_after
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+        self.n_requests = 0
+        self.n_rate_limited = 0
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+class MockChatCompletionsHandler(BaseHTTPRequestHandler):
+    server: MockChatCompletions
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        payload = json.loads(self.rfile.read(int(self.headers["content-length"])))
+        with self.server.lock:
+            n = next(self.server.counter)
+            self.server.n_requests += 1
+            rate_limited = (
+                self.server.rate_limit_every is not None
+                and n % self.server.rate_limit_every == 0
+            )
+            self.server.n_rate_limited += rate_limited
+        if rate_limited:
+            self.send_response(429)
+            self.send_header("retry-after", str(self.server.retry_after))
+            self.send_header("content-length", "0")
+            self.end_headers()
+            return
+
+        prompt = payload["messages"][-1]["content"]
+        if payload.get("response_format"):
+            content = json.dumps(MOCK_STRUCTURED_DESCRIPTION)
+        else:
+            top = prompt.split("The top level kernel function is: `", 1)[-1]
+            content = MOCK_DESCRIPTION.format(top=top.split("`", 1)[0])
+        usage = {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(content.split()),
+        }
+        time.sleep(self.server.delay)
+
+        if not payload.get("stream"):
+            body = json.dumps(
+                {
+                    "choices": [{"message": {"role": "assistant", "content": content}}],
+                    "usage": usage,
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        broken = any(name in prompt for name in self.server.break_stream)
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.end_headers()
+        chunks = [content[i : i + 16] for i in range(0, len(content), 16)]
+        if broken:
+            chunks = chunks[: len(chunks) // 2]
+        for chunk in chunks:
+            event = {"choices": [{"delta": {"content": chunk}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+        if broken:
+            return
+        event = {"choices": [], "usage": usage}
+        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def main(args):
+    server = MockChatCompletions(
+        args.port,
+        rate_limit_every=args.rate_limit_every,
+        break_stream=tuple(args.break_stream),
+        delay=args.delay,
+    )
+    print(f"Serving mock chat completions on {server.api_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve a mock TogetherAI chat completions endpoint, pass its "
+        "URL to --api-url"
+    )
+    parser.add_argument("--port", type=int, default=MOCK_SERVER_PORT)
+    parser.add_argument(
+        "--rate-limit-every",
+        type=int,
+        default=None,
+        help="Reject every Nth request with a 429",
+    )
+    parser.add_argument(
+        "--break-stream",
+        nargs="+",
+        default=[],
+        help="Cut off the stream for prompts that mention any of these",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="Seconds to wait before answering",
+    )
+    args = parser.parse_args()
+    main(args)
@@ -1,22 +1,105 @@
+import hashlib
+import json
+import os
+import tempfile
 from dataclasses import dataclass, field
-from typing import Any
+from pathlib import Path
+from typing import Any, Iterator
 
 import llm
 import requests
 from pydantic import Field
+from requests.adapters import HTTPAdapter
+
+# one pooled session per model, sized for the number of requests that run at
+# the same time
+TAI_MAX_CONNECTIONS = 16
+TAI_REQUEST_TIMEOUT = 600
+LLM_CACHE_DIR = Path("./llm_cache")
 
 
 @dataclass
 class ModelWithSettings:
     model: llm.Model
     settings: dict[str, Any] = field(default_factory=dict)
+    # prompt + completion tokens the model accepts, None if unknown
+    context_tokens: int | None = None
 
 
 class TAITimeout(Exception): ...
 
 
+class TAIStreamError(Exception): ...
+
+
+class TAIRateLimited(Exception):
+    def __init__(self, retry_after: float | None = None):
+        super().__init__("Rate limited by TogetherAI")
+        self.retry_after = retry_after
+
+
+def llm_cache_key(payload: dict[str, Any]) -> str:
+    payload_json = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload_json.encode()).hexdigest()
+
+
+def llm_cache_entry_fp(cache_dir: Path, key: str) -> Path:
+    return cache_dir / key[:2] / f"{key}.json"
+
+
+def llm_cache_load(cache_dir: Path, key: str) -> dict[str, Any] | None:
+    entry_fp = llm_cache_entry_fp(cache_dir, key)
+    try:
+        data = json.loads(entry_fp.read_text())
+    except (OSError, json.JSONDecodeError):
+        return None
+    # touch the entry so size based eviction drops the least recently used
+    os.utime(entry_fp)
+    return data
+
+
+def llm_cache_store(cache_dir: Path, key: str, data: dict[str, Any]) -> None:
+    entry_fp = llm_cache_entry_fp(cache_dir, key)
+    entry_fp.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename, concurrent prompts never see a partial entry
+    fd, tmp_name = tempfile.mkstemp(dir=entry_fp.parent, prefix=".tmp_")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_name, entry_fp)
+
+
+def evict_llm_cache(cache_dir: Path, max_size_bytes: int) -> list[Path]:
+    if not cache_dir.exists():
+        return []
+    entries = []
+    for entry_fp in cache_dir.glob("*/*.json"):
+        stat = entry_fp.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry_fp))
+    # oldest first
+    entries.sort()
+
+    evicted = []
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, entry_fp in entries:
+        if total_size <= max_size_bytes:
+            break
+        entry_fp.unlink()
+        evicted.append(entry_fp)
+        total_size -= size
+    return evicted
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    # only the delay in seconds form, not the http date one
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
 class TogetherAI(llm.Model):
     needs_key = "togetherai"
+    can_stream = True
     key_env_var = "TOGETHER_API_KEY"
 
     class Options(llm.Options):
@@ -46,12 +129,38 @@ class TogetherAI(llm.Model):
         json_schema_output: dict[str, Any] | None = Field(
             default=None,
         )
+        # skip the response cache for this prompt, the fresh response still
+        # replaces the cached one
+        no_cache: bool | None = Field(
+            default=None,
+        )
+        # index of a repeated sample of the same prompt, not sent, only part
+        # of the cache key so each sample gets its own response
+        sample: int | None = Field(
+            ge=0,
+            default=None,
+        )
 
     API_URL_INFERENCE = "https://api.together.xyz/v1/chat/completions"
 
-    def __init__(self, model_id, model_id_tai):
+    def __init__(
+        self,
+        model_id,
+        model_id_tai,
+        api_url: str = API_URL_INFERENCE,
+        cache_dir: Path | None = LLM_CACHE_DIR,
+    ):
         self.model_id = model_id
         self.model_id_tai = model_id_tai
+        self.api_url = api_url
+        self.cache_dir = cache_dir
+        # keep alive connections are reused across prompts and threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=TAI_MAX_CONNECTIONS, pool_block=True
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def execute(self, prompt, stream, response, conversation):
         payload = {
@@ -63,12 +172,12 @@ class TogetherAI(llm.Model):
             payload["messages"].append({"role": "system", "content": prompt.system})
 
         if conversation:
-            for response in conversation.responses:
+            for previous in conversation.responses:
                 payload["messages"].append(
-                    {"role": "user", "content": response.prompt.prompt}
+                    {"role": "user", "content": previous.prompt.prompt}
                 )
                 payload["messages"].append(
-                    {"role": "assistant", "content": response.text()}
+                    {"role": "assistant", "content": previous.text()}
                 )
 
         payload["messages"].append({"role": "user", "content": prompt.prompt})
@@ -83,33 +192,116 @@ class TogetherAI(llm.Model):
         if prompt.options.max_tokens:
             payload["max_tokens"] = prompt.options.max_tokens
 
-        if prompt.options.temperature:
-            payload["temperature"] = prompt.options.temperature
+        # 0 is a valid setting for all of these, only unset ones are left out
+        for option in ["temperature", "top_p", "top_k", "repetition_penalty"]:
+            value = getattr(prompt.options, option)
+            if value is not None:
+                payload[option] = value
 
+        # the payload holds the messages, the model and every sampling option, so
+        # an identical payload can be answered from disk
+        cache_key = None
+        data = None
+        if self.cache_dir is not None:
+            cache_key = llm_cache_key(
+                payload
+                if prompt.options.sample is None
+                else {**payload, "sample": prompt.options.sample}
+            )
+            if not prompt.options.no_cache:
+                data = llm_cache_load(self.cache_dir, cache_key)
+        cached = data is not None
+        if data is None and stream:
+            # chunks go out as they arrive, the assembled message is checked
+            # and cached like a non streamed one
+            chunks = []
+            usage = None
+            for event in self.stream_chat_completion(payload):
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices") or []:
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        chunks.append(content)
+                        yield content
+            data = {
+                "choices": [
+                    {"message": {"role": "assistant", "content": "".join(chunks)}}
+                ],
+                "usage": usage,
+            }
+        elif data is None:
+            data = self.post_chat_completion(payload)
+
+        assert data["choices"]
+        assert len(data["choices"]) > 0
+        first_choice = data["choices"][0]
+        assert first_choice["message"]
+        assert first_choice["message"]["role"] == "assistant"
+        assert first_choice["message"]["content"]
+
+        if cached:
+            response.response_json = {"cached": True}
+        else:
+            usage = data.get("usage")
+            if usage:
+                response.set_usage(
+                    input=usage.get("prompt_tokens"),
+                    output=usage.get("completion_tokens"),
+                )
+            if cache_key is not None:
+                llm_cache_store(self.cache_dir, cache_key, data)
+
+        if cached or not stream:
+            yield first_choice["message"]["content"]
+
+    def post_chat_completion(self, payload: dict[str, Any]) -> dict[str, Any]:
+        return self.open_chat_completion(payload).json()
+
+    def stream_chat_completion(self, payload: dict[str, Any]) -> Iterator[dict]:
+        # server sent events, one "data: {json}" line per chunk and a final
+        # "data: [DONE]"; the read timeout applies between chunks, not to the
+        # whole generation
+        with self.open_chat_completion({**payload, "stream": True}) as r:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line.removeprefix("data:").strip()
+                if data == "[DONE]":
+                    return
+                event = json.loads(data)
+                if event.get("error"):
+                    raise TAIStreamError(str(event["error"]))
+                yield event
+        raise TAIStreamError("Stream ended without [DONE]")
+
+    def open_chat_completion(self, payload: dict[str, Any]) -> requests.Response:
         headers = {
-            "accept": "application/json",
+            "accept": "text/event-stream"
+            if payload.get("stream")
+            else "application/json",
             "content-type": "application/json",
             "Authorization": f"Bearer {self.key}",
         }
 
-        r = requests.post(self.API_URL_INFERENCE, json=payload, headers=headers)
+        r = self.session.post(
+            self.api_url,
+            json=payload,
+            headers=headers,
+            timeout=TAI_REQUEST_TIMEOUT,
+            stream=bool(payload.get("stream")),
+        )
         if r.status_code == 524:
             raise TAITimeout("Model took too long to respond on TogetherAI's side")
+        if r.status_code == 429:
+            raise TAIRateLimited(parse_retry_after(r.headers.get("retry-after")))
         try:
             r.raise_for_status()
         except requests.HTTPError as e:
-            print(r.text)
-            raise e
-        data = r.json()
-
-        assert data["choices"]
-        assert len(data["choices"]) > 0
-        first_choice = data["choices"][0]
-        assert first_choice["message"]
-        assert first_choice["message"]["role"] == "assistant"
-        assert first_choice["message"]["content"]
-
-        return first_choice["message"]["content"]
+            # the body says what was wrong with the request; it goes with the
+            # error instead of being printed between other requests' progress
+            raise requests.HTTPError(f"{e}: {r.text.strip()}", response=r) from e
+        return r
 
 
 def LLM_TAI_MIXTRAL_8X22B_INSTRUCT(
@@ -123,7 +315,7 @@ def LLM_TAI_MIXTRAL_8X22B_INSTRUCT(
         "mixtral-8x22b-instruct", "mistralai/Mixtral-8x22B-Instruct-v0.1"
     )
     model.key = api_key
-    return ModelWithSettings(model, settings)
+    return ModelWithSettings(model, settings, context_tokens=65536)
 
 
 def LLM_LLAMA_3_70B_CHAT_HF(
@@ -134,4 +326,10 @@ def LLM_LLAMA_3_70B_CHAT_HF(
 ) -> ModelWithSettings:
     model = TogetherAI("llama-3-70b-chat-hf", "meta-llama/Llama-3-70b-chat-hf")
     model.key = api_key
-    return ModelWithSettings(model, settings)
+    return ModelWithSettings(model, settings, context_tokens=8192)
+
+
+MODELS = {
+    "mixtral-8x22b-instruct": LLM_TAI_MIXTRAL_8X22B_INSTRUCT,
+    "llama-3-70b-chat-hf": LLM_LLAMA_3_70B_CHAT_HF,
+}
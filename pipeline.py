@@ -0,0 +1,365 @@
+import argparse
+import json
+from pathlib import Path
+
+from benchmarks import INDEX_FILE_NAME, build_benchmark_record, write_benchmark_index
+from journal import RunJournal, hash_job_inputs, run_with_journal
+from process import (
+    ScalingVariant,
+    gather_kernel_description,
+    hash_benchmark_inputs,
+    hash_processing_rules,
+    load_scaling_spec,
+    parse_makefile_vars,
+    process_benchmark,
+    read_benchmark_distribution,
+)
+from profiling import TRACE_DIR, tracing
+from qor import QOR_DB_FP, QoRStore, config_id, parse_report_dir
+from scheduler import JOB_HISTORY_FP, GiB, Job, JobHistory, ResourceScheduler
+from test import (
+    COMPILE_CACHE_DIR,
+    HLS_CACHE_DIR,
+    VitisHLSToolchain,
+    compile_benchmark,
+    find_vitis_hls_toolchain,
+    hls_synth_benchmark,
+    run_benchmark,
+)
+
+PIPELINE_STAGES = ["process", "compile", "run", "synth"]
+# test.py journals its own jobs under the same names but with different
+# results, so the two must not share a journal
+PIPELINE_JOURNAL_FP = Path("./pipeline_journal.jsonl")
+
+
+# stage entry points run in the scheduler's worker processes, a non zero return
+# code becomes an exception so the scheduler cancels the kernel's later stages
+
+
+def process_stage(
+    kernel_path: str,
+    sources: dict[str, str],
+    output_dir: Path,
+    kernel_descriptions: dict[str, str],
+    variant: ScalingVariant | None,
+) -> None:
+    process_benchmark(kernel_path, sources, output_dir, kernel_descriptions, variant)
+
+
+def compile_stage(
+    benchmark_dir: Path,
+    work_dir: Path,
+    toolchain: VitisHLSToolchain,
+    cache_dir: Path | None,
+    timeout: float | None = None,
+) -> None:
+    work_dir.mkdir(parents=True, exist_ok=True)
+    returncode = compile_benchmark(
+        benchmark_dir, work_dir, toolchain, cache_dir, timeout
+    )
+    if returncode != 0:
+        raise RuntimeError(f"compile exited with {returncode}")
+
+
+def run_stage(
+    benchmark_dir: Path, work_dir: Path, timeout: float | None = None
+) -> None:
+    returncode = run_benchmark(benchmark_dir, work_dir, timeout)
+    if returncode != 0:
+        raise RuntimeError(f"run exited with {returncode}")
+
+
+def synth_stage(
+    benchmark_dir: Path,
+    temp_dir: Path,
+    cache_dir: Path | None,
+    toolchain: VitisHLSToolchain,
+    timeout: float | None = None,
+    memory_limit: int | None = None,
+) -> None:
+    returncode = hls_synth_benchmark(
+        benchmark_dir,
+        temp_dir_overide=temp_dir,
+        cache_dir=cache_dir,
+        timeout=timeout,
+        memory_limit=memory_limit,
+        toolchain=toolchain,
+    )
+    if returncode != 0:
+        raise RuntimeError(f"vitis_hls exited with {returncode}")
+
+
+def build_pipeline_jobs(
+    kernels: dict[str, tuple[str, ScalingVariant | None]],
+    benchmark_sources: dict[str, dict[str, str]],
+    kernel_descriptions: dict[str, str],
+    output_dir: Path,
+    compile_dir: Path,
+    synth_dir: Path,
+    stages: list[str],
+    toolchain: VitisHLSToolchain | None,
+    compile_cache_dir: Path | None,
+    hls_cache_dir: Path | None,
+    timeouts: dict[str, float | None] | None = None,
+    synth_memory_limit: int | None = None,
+) -> list[Job]:
+    # per kernel: process -> compile -> run, and process -> synth; synthesis
+    # only needs the processed sources so a kernel that fails to build or run
+    # natively is still synthesized
+    timeouts = timeouts or {}
+    rules_hash = hash_processing_rules()
+    jobs = []
+    for name, (kernel_path, variant) in kernels.items():
+        benchmark_dir = output_dir / name
+        # the processed sources do not exist yet, but they only depend on
+        # what process_benchmark is given
+        base_name = name if variant is None else name.removesuffix(f"_{variant.name}")
+        kernel_hash = hash_benchmark_inputs(
+            benchmark_sources[kernel_path],
+            kernel_descriptions.get(base_name, ""),
+            rules_hash,
+            variant,
+        )
+        build_hash = None
+        if toolchain is not None:
+            build_hash = hash_job_inputs(
+                kernel_hash, toolchain.identity, *toolchain.cflags
+            )
+        process_deps: tuple[str, ...] = ()
+        if "process" in stages:
+            jobs.append(
+                Job(
+                    f"process:{name}",
+                    process_stage,
+                    (
+                        kernel_path,
+                        benchmark_sources[kernel_path],
+                        output_dir,
+                        kernel_descriptions,
+                        variant,
+                    ),
+                    default_memory=GiB // 4,
+                    stage="process",
+                    artifacts=(benchmark_dir / "top.txt",),
+                    input_hash=kernel_hash,
+                )
+            )
+            process_deps = (f"process:{name}",)
+        if "compile" in stages:
+            assert toolchain is not None
+            jobs.append(
+                Job(
+                    f"compile:{name}",
+                    compile_stage,
+                    (benchmark_dir, compile_dir / name, toolchain, compile_cache_dir),
+                    dict(timeout=timeouts.get("compile")),
+                    default_memory=GiB // 2,
+                    stage="compile",
+                    deps=process_deps,
+                    artifacts=(compile_dir / name / name,),
+                    input_hash=build_hash,
+                )
+            )
+        if "run" in stages:
+            assert "compile" in stages
+            jobs.append(
+                Job(
+                    f"run:{name}",
+                    run_stage,
+                    (benchmark_dir, compile_dir / name),
+                    dict(timeout=timeouts.get("run")),
+                    default_memory=GiB // 2,
+                    stage="run",
+                    deps=(f"compile:{name}",),
+                    input_hash=build_hash,
+                )
+            )
+        if "synth" in stages:
+            assert toolchain is not None
+            jobs.append(
+                Job(
+                    f"synth:{name}",
+                    synth_stage,
+                    (benchmark_dir, synth_dir, hls_cache_dir, toolchain),
+                    dict(
+                        timeout=timeouts.get("synth"),
+                        memory_limit=synth_memory_limit,
+                    ),
+                    uses_license=True,
+                    default_memory=4 * GiB,
+                    stage="synth",
+                    deps=process_deps,
+                    artifacts=(synth_dir / name / "csynth.rpt",),
+                    input_hash=hash_job_inputs(kernel_hash, toolchain.version),
+                )
+            )
+    return jobs
+
+
+def main(args):
+    output_dir: Path = args.output_directory
+    compile_dir = Path("./test_temp_compile")
+    synth_dir = Path("./test_temp_synth")
+    stages = [stage for stage in PIPELINE_STAGES if stage in args.stages]
+    # the binary in the compile directory may be missing or left over from
+    # an older build of the kernel
+    if "run" in stages and "compile" not in stages:
+        raise ValueError("The run stage needs the compile stage")
+
+    benchmark_sources = read_benchmark_distribution(
+        args.benchmark_distribution, args.test_vectors
+    )
+    kernel_descriptions = gather_kernel_description()
+    scaling: dict[str, list[ScalingVariant]] = {}
+    if args.scaling is not None:
+        scaling = load_scaling_spec(args.scaling)
+
+    kernels: dict[str, tuple[str, ScalingVariant | None]] = {}
+    for kernel_path, sources in benchmark_sources.items():
+        base_full_name = "_".join(parse_makefile_vars(sources["Makefile"], kernel_path))
+        kernels[base_full_name] = (kernel_path, None)
+        for variant in scaling.get(base_full_name, []):
+            kernels[f"{base_full_name}_{variant.name}"] = (kernel_path, variant)
+    if args.kernels:
+        unknown = set(args.kernels) - set(kernels)
+        if unknown:
+            raise ValueError(f"Unknown kernels: {sorted(unknown)}")
+        kernels = {k: v for k, v in kernels.items() if k in args.kernels}
+
+    toolchain = None
+    if "compile" in stages or "synth" in stages:
+        toolchain = find_vitis_hls_toolchain()
+    jobs = build_pipeline_jobs(
+        kernels,
+        benchmark_sources,
+        kernel_descriptions,
+        output_dir,
+        compile_dir,
+        synth_dir,
+        stages,
+        toolchain,
+        None if args.no_compile_cache else args.compile_cache_dir,
+        None if args.no_hls_cache else args.hls_cache_dir,
+        timeouts={
+            "compile": args.compile_timeout,
+            "run": args.run_timeout,
+            "synth": args.synth_timeout,
+        },
+        synth_memory_limit=args.synth_memory_limit,
+    )
+
+    scheduler = ResourceScheduler(
+        args.jobs,
+        memory_budget=args.max_memory,
+        max_licenses=args.max_licenses,
+        history=JobHistory(args.job_history),
+        stage_limits={
+            "process": args.process_jobs,
+            "compile": args.compile_jobs,
+            "run": args.run_jobs,
+            "synth": args.synth_jobs,
+        },
+    )
+    journal = RunJournal(args.journal, resume=args.resume)
+    config = config_id(None)
+    run_with_journal(scheduler, jobs, journal, config, raise_on_error=False)
+    journal.close()
+    # jobs skipped on resume never reach the scheduler
+    status = {job.name: scheduler.status.get(job.name, "resumed") for job in jobs}
+
+    if "process" in stages:
+        # kernels outside this run keep their existing index records
+        index_fp = output_dir / INDEX_FILE_NAME
+        records = {}
+        if index_fp.exists():
+            records = json.loads(index_fp.read_text())["benchmarks"]
+        for name, (kernel_path, variant) in kernels.items():
+            if status.get(f"process:{name}") not in ("done", "resumed"):
+                continue
+            record = {
+                "kernel_path": kernel_path,
+                **build_benchmark_record(output_dir / name),
+            }
+            if variant is not None:
+                record["variant_of"] = name.removesuffix(f"_{variant.name}")
+                record["scaling"] = variant.defines
+            records[name] = record
+        write_benchmark_index(output_dir, records)
+
+    if "synth" in stages and args.report:
+        with QoRStore(args.qor_db) as store:
+            for name in kernels:
+                if status.get(f"synth:{name}") not in ("done", "resumed"):
+                    continue
+                report_dir = (
+                    synth_dir
+                    / name
+                    / f"test_proj_{name}"
+                    / "solution1"
+                    / "syn"
+                    / "report"
+                )
+                store.record(
+                    name, parse_report_dir(report_dir), tool_version=toolchain.version
+                )
+
+    width = max((len(name) for name in kernels), default=0)
+    print(
+        (f"{'kernel'.ljust(width)}  " + "  ".join(s.ljust(9) for s in stages)).rstrip()
+    )
+    for name in kernels:
+        row = [status.get(f"{stage}:{name}", "-") for stage in stages]
+        print(f"{name.ljust(width)}  " + "  ".join(s.ljust(9) for s in row).rstrip())
+    for job_name, error in scheduler.errors.items():
+        print(f"{job_name}: {error.splitlines()[0]}")
+    print(f"Pipeline: {scheduler.stats.summary()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Process, compile, run and synthesize each kernel as soon as its "
+        "previous stage is done"
+    )
+    parser.add_argument(
+        "benchmark_distribution",
+        type=Path,
+        nargs="?",
+        default=Path("./MachSuite-master-6236e59.zip"),
+    )
+    parser.add_argument(
+        "output_directory", type=Path, nargs="?", default=Path("./hls-machsuite/")
+    )
+    parser.add_argument("-k", "--kernels", nargs="+", default=None)
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=PIPELINE_STAGES,
+        default=["process", "compile", "run"],
+    )
+    parser.add_argument("-t", "--test-vectors", action="store_true", default=False)
+    parser.add_argument("-s", "--scaling", type=Path, default=None)
+    parser.add_argument("-j", "--jobs", type=int, default=16)
+    parser.add_argument("--process-jobs", type=int, default=4)
+    parser.add_argument("--compile-jobs", type=int, default=8)
+    parser.add_argument("--run-jobs", type=int, default=8)
+    parser.add_argument("--synth-jobs", type=int, default=4)
+    parser.add_argument("--max-memory", type=int, default=None)
+    parser.add_argument("--compile-timeout", type=float, default=None)
+    parser.add_argument("--run-timeout", type=float, default=None)
+    parser.add_argument("--synth-timeout", type=float, default=None)
+    parser.add_argument("--synth-memory-limit", type=int, default=None)
+    parser.add_argument("--max-licenses", type=int, default=None)
+    parser.add_argument("--job-history", type=Path, default=JOB_HISTORY_FP)
+    parser.add_argument("--resume", action="store_true", default=False)
+    parser.add_argument("--journal", type=Path, default=PIPELINE_JOURNAL_FP)
+    parser.add_argument("--compile-cache-dir", type=Path, default=COMPILE_CACHE_DIR)
+    parser.add_argument("--no-compile-cache", action="store_true", default=False)
+    parser.add_argument("--hls-cache-dir", type=Path, default=HLS_CACHE_DIR)
+    parser.add_argument("--no-hls-cache", action="store_true", default=False)
+    parser.add_argument("-r", "--report", action="store_true", default=False)
+    parser.add_argument("--qor-db", type=Path, default=QOR_DB_FP)
+    parser.add_argument("--trace", type=Path, default=None, nargs="?", const=TRACE_DIR)
+    args = parser.parse_args()
+    with tracing(args.trace):
+        main(args)
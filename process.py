@@ -1,14 +1,31 @@
 import argparse
+import contextlib
+import hashlib
+import json
 import os
 import re
 import shutil
+import struct
 import sys
 import tarfile
 import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
 from pathlib import Path
+from typing import IO, Iterator
 
 from joblib import Parallel, delayed
 
+import c_header
+from benchmarks import (
+    VECTORS_DIR_NAME,
+    build_benchmark_record,
+    write_benchmark_index,
+)
+from profiling import TRACE_DIR, span, traced, tracing
+
 
 def get_vitis_hls_clang_pp_path() -> Path:
     vitis_hls_bin_path_str = shutil.which("vitis_hls")
@@ -115,122 +132,382 @@ KERNEL_PATHS = [
 ]
 
 
-def main(args):
-    n_jobs: int = args.jobs
+def archive_root_prefix(member_names: list[str]) -> str:
+    # distributions are packed as a single top level folder, e.g. MachSuite-master/
+    top_level = {name.split("/", 1)[0] for name in member_names if name}
+    if len(top_level) == 1:
+        root = top_level.pop()
+        if any(name.startswith(root + "/") for name in member_names):
+            return root + "/"
+    return ""
+
+
+TEST_VECTOR_FILES = ["local_support.c", "input.data", "check.data"]
+
+
+def read_benchmark_sources_zip(
+    zip_ref: zipfile.ZipFile, kernel_path: str, root: str, include_data: bool = False
+) -> dict[str, str]:
+    member_names = set(zip_ref.namelist())
+    benchmark_prefix = f"{root}{kernel_path}/"
+
+    def read_member(file_name: str) -> str:
+        member_name = benchmark_prefix + file_name
+        if member_name not in member_names:
+            raise FileNotFoundError(f"{file_name} not found at {member_name}")
+        return zip_ref.read(member_name).decode()
+
+    sources: dict[str, str] = {}
+    sources["Makefile"] = read_member("Makefile")
+    var_kern_match = re.search(r"KERN=(\w+)", sources["Makefile"])
+    if var_kern_match is None:
+        raise ValueError(f"Could not find KERN in Makefile at {benchmark_prefix}")
+    var_kern = var_kern_match.group(1)
+    sources[f"{var_kern}.h"] = read_member(f"{var_kern}.h")
+    sources[f"{var_kern}.c"] = read_member(f"{var_kern}.c")
+    if include_data:
+        for file_name in TEST_VECTOR_FILES:
+            sources[file_name] = read_member(file_name)
+
+    for member_name in sorted(member_names):
+        if not member_name.startswith(benchmark_prefix):
+            continue
+        file_name = member_name[len(benchmark_prefix) :]
+        if "/" not in file_name and file_name.endswith("_dir"):
+            sources[file_name] = read_member(file_name)
+
+    return sources
+
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+KERNEL_SOURCE_SUFFIXES = (".h", ".c", "_dir", ".data")
+
+
+def is_zstd_file(fp: Path) -> bool:
+    with open(fp, "rb") as f:
+        return f.read(4) == ZSTD_MAGIC
+
+
+def match_kernel_member(member_name: str) -> tuple[str, str] | None:
+    # accept both "<kernel_path>/<file>" and "<root>/<kernel_path>/<file>"
+    parent, _, file_name = member_name.rpartition("/")
+    if file_name != "Makefile" and not file_name.endswith(KERNEL_SOURCE_SUFFIXES):
+        return None
+    for kernel_path in (parent, parent.partition("/")[2]):
+        if kernel_path in KERNEL_PATHS:
+            return kernel_path, file_name
+    return None
+
+
+def select_benchmark_sources(
+    kernel_path: str, candidates: dict[str, str], include_data: bool = False
+) -> dict[str, str]:
+    if "Makefile" not in candidates:
+        raise FileNotFoundError(f"Makefile not found at {kernel_path}")
+    var_kern_match = re.search(r"KERN=(\w+)", candidates["Makefile"])
+    if var_kern_match is None:
+        raise ValueError(f"Could not find KERN in Makefile at {kernel_path}")
+    var_kern = var_kern_match.group(1)
+
+    sources: dict[str, str] = {"Makefile": candidates["Makefile"]}
+    for file_name in [f"{var_kern}.h", f"{var_kern}.c"]:
+        if file_name not in candidates:
+            raise FileNotFoundError(f"{file_name} not found at {kernel_path}")
+        sources[file_name] = candidates[file_name]
+    if include_data:
+        for file_name in TEST_VECTOR_FILES:
+            if file_name not in candidates:
+                raise FileNotFoundError(f"{file_name} not found at {kernel_path}")
+            sources[file_name] = candidates[file_name]
+    for file_name in sorted(candidates):
+        if file_name.endswith("_dir"):
+            sources[file_name] = candidates[file_name]
+    return sources
+
+
+def read_benchmark_sources_tar(
+    fileobj: IO[bytes], include_data: bool = False
+) -> dict[str, dict[str, str]]:
+    # stream mode ("r|*") reads the archive strictly front to back, so this
+    # works on compressed pipes and never holds more than the selected members
+    candidates: dict[str, dict[str, str]] = {}
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            match = match_kernel_member(member.name)
+            if match is None:
+                continue
+            kernel_path, file_name = match
+            if file_name.endswith(".data") and not include_data:
+                continue
+            member_f = tar.extractfile(member)
+            assert member_f is not None
+            candidates.setdefault(kernel_path, {})[file_name] = member_f.read().decode()
+
+    benchmark_sources: dict[str, dict[str, str]] = {}
+    for kernel_path in KERNEL_PATHS:
+        if kernel_path not in candidates:
+            raise FileNotFoundError(f"{kernel_path} not found in tar distribution")
+        benchmark_sources[kernel_path] = select_benchmark_sources(
+            kernel_path, candidates[kernel_path], include_data
+        )
+    return benchmark_sources
 
-    benchmark_distribution_fp: Path = args.benchmark_distribution
-    output_dir: Path = args.output_directory
-    if output_dir.exists():
-        shutil.rmtree(output_dir)
-    output_dir.mkdir(parents=True, exist_ok=True)
-    output_file: Path = args.output_file
 
-    # vitis_hls_include_dir = get_vitis_hls_include_dir()
-    # vitis_clang_pp_bin_path = get_vitis_hls_clang_pp_path()
+def read_benchmark_sources_tar_zst(
+    fp: Path, include_data: bool = False
+) -> dict[str, dict[str, str]]:
+    try:
+        import zstandard
+    except ImportError as e:
+        raise RuntimeError(
+            "The zstandard package is required to read .tar.zst distributions"
+        ) from e
+    with open(fp, "rb") as f:
+        with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            return read_benchmark_sources_tar(reader, include_data)
+
 
+def read_benchmark_distribution(
+    benchmark_distribution_fp: Path, include_data: bool
+) -> dict[str, dict[str, str]]:
     if not benchmark_distribution_fp.exists():
         raise FileNotFoundError(
             "Benchmark distribution not found at {}".format(benchmark_distribution_fp)
         )
 
-    # if not tarfile.is_tarfile(benchmark_distribution_fp):
-    #     raise ValueError(
-    #         "Benchmark distribution is not a tar.gz file: {}".format(
-    #             benchmark_distribution_fp
-    #         )
-    #     )
-
-    # # check for zip file
-    # if not zipfile.is_zipfile(benchmark_distribution_fp):
-    #     raise ValueError(
-    #         "Benchmark distribution is not a zip file: {}".format(
-    #             benchmark_distribution_fp
-    #         )
-    #     )
-
     is_zip = zipfile.is_zipfile(benchmark_distribution_fp)
-    is_tar = tarfile.is_tarfile(benchmark_distribution_fp)
+    is_zst = is_zstd_file(benchmark_distribution_fp)
+    is_tar = not is_zst and tarfile.is_tarfile(benchmark_distribution_fp)
 
-    if not is_zip and not is_tar:
+    if not is_zip and not is_tar and not is_zst:
         raise ValueError(
-            "Benchmark distribution is not a zip or tar file: {}".format(
+            "Benchmark distribution is not a zip, tar or tar.zst file: {}".format(
                 benchmark_distribution_fp
             )
         )
 
-    tmp_dir = output_dir / "tmp"
-    new_benchmarks_dir = output_dir / "benchmarks"
-
+    # only the few small source members each kernel needs are read straight
+    # out of the archive, the large input.data / check.data files are only
+    # touched when test vectors are requested and nothing is extracted to disk
+    benchmark_sources: dict[str, dict[str, str]] = {}
     if is_zip:
         with zipfile.ZipFile(benchmark_distribution_fp, "r") as zip_ref:
-            zip_ref.extractall(tmp_dir)
-    if is_tar:
-        raise NotImplementedError(
-            "Tar file extraction not implemented for this benchmark distribution"
+            root = archive_root_prefix(zip_ref.namelist())
+            for kernel_path in KERNEL_PATHS:
+                benchmark_sources[kernel_path] = read_benchmark_sources_zip(
+                    zip_ref, kernel_path, root, include_data
+                )
+    elif is_tar:
+        with open(benchmark_distribution_fp, "rb") as f:
+            benchmark_sources = read_benchmark_sources_tar(f, include_data)
+    elif is_zst:
+        benchmark_sources = read_benchmark_sources_tar_zst(
+            benchmark_distribution_fp, include_data
         )
+    return benchmark_sources
+
+
+def parse_makefile_vars(makefile_text: str, kernel_path: str) -> tuple[str, str]:
+    var_kern_match = re.search(r"KERN=(\w+)", makefile_text)
+    var_alg_match = re.search(r"ALG=(\w+)", makefile_text)
+    if var_kern_match is None or var_alg_match is None:
+        raise ValueError(f"Could not find KERN or ALG in Makefile at {kernel_path}")
+    return var_kern_match.group(1), var_alg_match.group(1)
+
+
+def sha256_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@dataclass
+class ScalingVariant:
+    name: str
+    defines: dict[str, int | float]
+
+
+def expand_scaling_spec(spec: dict) -> dict[str, list[ScalingVariant]]:
+    # each kernel either lists its variants explicitly
+    #   {"gemm_ncubed": [{"name": "n128", "defines": {"row_size": 128, ...}}]}
+    # or sweeps a name template over equally long lists of values
+    #   {"gemm_ncubed": {"name": "n{row_size}", "defines": {"row_size": [128, 256],
+    #                                                      "col_size": [128, 256]}}}
+    variants: dict[str, list[ScalingVariant]] = {}
+    for kernel_full_name, kernel_spec in spec.items():
+        if isinstance(kernel_spec, list):
+            variants[kernel_full_name] = [
+                ScalingVariant(v["name"], dict(v["defines"])) for v in kernel_spec
+            ]
+            continue
+        sweep: dict[str, list] = kernel_spec["defines"]
+        if len({len(values) for values in sweep.values()}) != 1:
+            raise ValueError(
+                f"Scaling sweep for {kernel_full_name} has value lists of "
+                "different lengths"
+            )
+        variants[kernel_full_name] = []
+        for values in zip(*sweep.values()):
+            defines = dict(zip(sweep, values))
+            variants[kernel_full_name].append(
+                ScalingVariant(kernel_spec["name"].format(**defines), defines)
+            )
 
-    for file in tmp_dir.glob("MachSuite-master/*"):
-        os.rename(file, tmp_dir / file.name)
-    os.rmdir(tmp_dir / "MachSuite-master")
-
-    source_benchmark_dirs = [tmp_dir / path for path in KERNEL_PATHS]
-    print(source_benchmark_dirs)
-
-    kernel_descriptions = gather_kernel_description()
+    for kernel_full_name, kernel_variants in variants.items():
+        names = [v.name for v in kernel_variants]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate scaling variant names for {kernel_full_name}")
+        for name in names:
+            if not re.fullmatch(r"\w+", name):
+                raise ValueError(
+                    f"Scaling variant name {name!r} for {kernel_full_name} is not a "
+                    "valid identifier suffix"
+                )
+    return variants
+
+
+def load_scaling_spec(spec_fp: Path) -> dict[str, list[ScalingVariant]]:
+    return expand_scaling_spec(json.loads(spec_fp.read_text()))
+
+
+def hash_benchmark_inputs(
+    sources: dict[str, str],
+    kernel_description: str,
+    rules_hash: str,
+    variant: ScalingVariant | None = None,
+) -> str:
+    h = hashlib.sha256()
+    h.update(rules_hash.encode())
+    for file_name in sorted(sources):
+        h.update(f"\0{file_name}\0".encode())
+        h.update(sources[file_name].encode())
+    h.update(b"\0kernel_description\0")
+    h.update(kernel_description.encode())
+    if variant is not None:
+        h.update(b"\0scaling\0")
+        h.update(json.dumps(asdict(variant), sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def hash_output_files(benchmark_dir: Path) -> dict[str, str]:
+    return {
+        fp.relative_to(benchmark_dir).as_posix(): hashlib.sha256(
+            fp.read_bytes()
+        ).hexdigest()
+        for fp in sorted(benchmark_dir.rglob("*"))
+        if fp.is_file()
+    }
+
+
+def load_manifest(manifest_fp: Path) -> dict:
+    if not manifest_fp.exists():
+        return {}
+    try:
+        return json.loads(manifest_fp.read_text())
+    except json.JSONDecodeError:
+        return {}
+
+
+def save_manifest(manifest_fp: Path, manifest: dict) -> None:
+    tmp_fp = manifest_fp.with_name(manifest_fp.name + ".tmp")
+    tmp_fp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp_fp, manifest_fp)
+
+
+def is_benchmark_up_to_date(
+    benchmark_dir: Path, manifest_entry: dict | None, input_hash: str
+) -> bool:
+    if manifest_entry is None or manifest_entry.get("input_hash") != input_hash:
+        return False
+    if not benchmark_dir.is_dir():
+        return False
+    return hash_output_files(benchmark_dir) == manifest_entry.get("outputs")
+
+
+def apply_define_overrides(
+    h_text: str, c_text: str, defines: dict[str, int | float], kernel_path: str
+) -> str:
+    # the derived defines (N = row_size*col_size, ...) follow on their own, so
+    # only the named object-like macros in the header are rewritten
+    c_defines = c_header.scan(c_text).defines
+    for name, value in defines.items():
+        if name in c_defines:
+            raise ValueError(
+                f"{name} is also defined in the kernel source at {kernel_path}, "
+                "it cannot be scaled from the header"
+            )
+        pattern = re.compile(
+            rf"^([ \t]*#[ \t]*define[ \t]+{re.escape(name)})[ \t][^\n]*$", re.M
+        )
+        h_text, n = pattern.subn(lambda m: f"{m.group(1)} {value}", h_text)
+        if n != 1:
+            raise ValueError(
+                f"Expected one #define {name} in the header at {kernel_path}, found {n}"
+            )
+    return h_text
+
+
+RE_ARRAY_PARTITION = re.compile(
+    r'^[ \t]*set_directive_array_partition\b(?P<opts>.*?)[ \t]+"?(?P<fn>\w+)"?'
+    r"[ \t]+(?P<var>\w+)[ \t]*$",
+    re.M,
+)
+
+
+def check_partition_factors(
+    directives: str, record: dict, kernel_full_name: str
+) -> None:
+    # a partition factor that no longer divides the scaled array would make
+    # synthesis fail or silently pad, so catch it before any sweep runs
+    shapes = {arg["name"]: arg["shape"] for arg in record["args"]}
+    for m in RE_ARRAY_PARTITION.finditer(directives):
+        opts = m.group("opts").split()
+        if "-factor" not in opts or m.group("var") not in shapes:
+            continue
+        factor = int(opts[opts.index("-factor") + 1])
+        dim = int(opts[opts.index("-dim") + 1]) if "-dim" in opts else 1
+        shape = shapes[m.group("var")]
+        if dim == 0 or dim > len(shape):
+            continue
+        extent = shape[dim - 1]
+        if extent % factor != 0:
+            raise ValueError(
+                f"Partition factor {factor} of {m.group('var')} does not divide "
+                f"its scaled extent {extent} in {kernel_full_name}"
+            )
 
-    def process_benchmark(benchmark: Path):
-        makefile_fp = benchmark / "Makefile"
-        if not makefile_fp.exists():
-            raise FileNotFoundError(f"Makefile not found at {makefile_fp}")
-        var_kern_match = re.search(r"KERN=(\w+)", makefile_fp.read_text())
-        var_alg_match = re.search(r"ALG=(\w+)", makefile_fp.read_text())
-        if var_kern_match is None or var_alg_match is None:
-            raise ValueError(f"Could not find KERN or ALG in Makefile at {makefile_fp}")
-        var_kern = var_kern_match.group(1)
-        var_alg = var_alg_match.group(1)
-
-        kernel_full_name = f"{var_kern}_{var_alg}"
-        new_benchmark_dir = new_benchmarks_dir / kernel_full_name
-        if new_benchmark_dir.exists():
-            shutil.rmtree(new_benchmark_dir)
-        new_benchmark_dir.mkdir(parents=True, exist_ok=True)
-
-        # copy the kern.h and kern.c files to the new benchmark directory
-        kern_h_fp = benchmark / f"{var_kern}.h"
-        kern_c_fp = benchmark / f"{var_kern}.c"
-
-        if not kern_h_fp.exists():
-            raise FileNotFoundError(f"kern.h not found at {kern_h_fp}")
-        if not kern_c_fp.exists():
-            raise FileNotFoundError(f"kern.c not found at {kern_c_fp}")
-
-        shutil.copy(kern_h_fp, new_benchmark_dir)
-        shutil.copy(kern_c_fp, new_benchmark_dir)
-
-        new_h_fp: Path = new_benchmark_dir / f"{var_kern}.h"
-        new_c_fp: Path = new_benchmark_dir / f"{var_kern}.c"
-
-        # rename to be cpp inssted of c
-        new_kern_cpp_fp = new_benchmark_dir / f"{var_kern}.cpp"
-        os.rename(new_benchmark_dir / f"{var_kern}.c", new_kern_cpp_fp)
-        new_c_fp = new_kern_cpp_fp
-
-        # rename both to be full name
-        os.rename(new_h_fp, new_benchmark_dir / f"{kernel_full_name}.h")
-        os.rename(new_c_fp, new_benchmark_dir / f"{kernel_full_name}.cpp")
-        new_h_fp = new_benchmark_dir / f"{kernel_full_name}.h"
-        new_c_fp = new_benchmark_dir / f"{kernel_full_name}.cpp"
 
+@traced("process_benchmark", "process", "kernel_path")
+def process_benchmark(
+    kernel_path: str,
+    sources: dict[str, str],
+    output_dir: Path,
+    kernel_descriptions: dict[str, str],
+    variant: ScalingVariant | None = None,
+):
+    var_kern, var_alg = parse_makefile_vars(sources["Makefile"], kernel_path)
+
+    base_full_name = f"{var_kern}_{var_alg}"
+    kernel_full_name = base_full_name
+    if variant is not None:
+        kernel_full_name = f"{base_full_name}_{variant.name}"
+    new_benchmark_dir = output_dir / kernel_full_name
+    if new_benchmark_dir.exists():
+        shutil.rmtree(new_benchmark_dir)
+    new_benchmark_dir.mkdir(parents=True, exist_ok=True)
+
+    if f"{var_kern}.h" not in sources:
+        raise FileNotFoundError(f"{var_kern}.h not found in {kernel_path}")
+    if f"{var_kern}.c" not in sources:
+        raise FileNotFoundError(f"{var_kern}.c not found in {kernel_path}")
+
+    # the kern.c file is renamed to be cpp and both are renamed to the full name
+    new_h_fp = new_benchmark_dir / f"{kernel_full_name}.h"
+    new_c_fp = new_benchmark_dir / f"{kernel_full_name}.cpp"
+
+    with span("clean_header", "process", kernel=kernel_full_name):
         # cleaning the header file
-        h_text = new_h_fp.read_text()
-
-        # line_idx = None
-        # for i, line in enumerate(h_text.splitlines()):
-        #     if len(line) >= 8 and line.startswith("/" * 8):
-        #         line_idx = i
-        #         break
-        # if line_idx is not None:
-        #     h_text = "\n".join(h_text.splitlines()[:line_idx])
+        h_text = sources[f"{var_kern}.h"]
 
         # remove any lines with more than 8 slashes in a row
         h_text = "\n".join(
@@ -240,7 +517,9 @@ def main(args):
         )
         h_text = h_text.replace("// Test harness interface code.", "")
 
-        h_text = re.sub(r"struct bench_args_t {(.|\s)*};", "", h_text)
+        bench_args_struct = c_header.scan(h_text).get_struct("bench_args_t")
+        if bench_args_struct is not None:
+            h_text = h_text[: bench_args_struct.start] + h_text[bench_args_struct.end :]
 
         # remove "#include "support.h"
         h_text = h_text.replace('#include "support.h"', "")
@@ -248,72 +527,388 @@ def main(args):
         # add stdint.h to top of file
         h_text = "#include <stdint.h>\n\n" + h_text
 
+        if variant is not None:
+            h_text = apply_define_overrides(
+                h_text, sources[f"{var_kern}.c"], variant.defines, kernel_path
+            )
+
         new_h_fp.write_text(h_text)
 
-        # cleaning the cpp file
-        c_text = new_c_fp.read_text()
-        c_text = c_text.replace(
-            f'#include "{var_kern}.h"', f'#include "{kernel_full_name}.h"'
-        )
-        new_c_fp.write_text(c_text)
-
-        # preprocess the header file with
-
-        # copy common.h into each kernel
-        # common_h_fp = tmp_dir / "common" / "support.h"
-        # common_c_fp = tmp_dir / "common" / "support.c"
-        # if not common_h_fp.exists() or not common_c_fp.exists():
-        #     raise FileNotFoundError(f"common.h or common.c not found at {common_h_fp}")
-        # shutil.copy(common_h_fp, new_benchmark_dir)
-        # shutil.copy(common_c_fp, new_benchmark_dir)
-
-        # new_common_cpp_fp = new_benchmark_dir / "support.cpp"
-        # os.rename(new_benchmark_dir / "support.c", new_common_cpp_fp)
-
-        # hls_tcl_fp = benchmark / "hls.tcl"
-        # if not hls_tcl_fp.exists():
-        #     raise FileNotFoundError(f"hls.tcl not found at {hls_tcl_fp}")
-        # shutil.copy(hls_tcl_fp, new_benchmark_dir)
-
-        hls_dir_search = list(benchmark.glob("*_dir"))
-        if hls_dir_search is None or len(hls_dir_search) == 0:
-            raise FileNotFoundError(f"{var_alg}_dir not found at {benchmark}")
-        hls_dir_fp = hls_dir_search[0]
-        if not hls_dir_fp.exists():
-            raise FileNotFoundError(f"{var_alg}_dir not found at {hls_dir_fp}")
-        shutil.copy(hls_dir_fp, new_benchmark_dir)
-
-        new_hls_dir_fp = new_benchmark_dir / (hls_dir_fp.name + ".tcl")
-        os.rename(new_benchmark_dir / hls_dir_fp.name, new_hls_dir_fp)
-
-        # find function definitions in heder
-        RE_FUNC_DEF = re.compile(r"^(?!#define).+\w+ (\w+)\((.|\s)*?\);", re.MULTILINE)
-        func_def_matches = list(RE_FUNC_DEF.finditer(h_text))
-        if len(func_def_matches) == 0:
+    # cleaning the cpp file
+    c_text = sources[f"{var_kern}.c"]
+    c_text = c_text.replace(
+        f'#include "{var_kern}.h"', f'#include "{kernel_full_name}.h"'
+    )
+    new_c_fp.write_text(c_text)
+
+    hls_dir_names = sorted(name for name in sources if name.endswith("_dir"))
+    if len(hls_dir_names) == 0:
+        raise FileNotFoundError(f"{var_alg}_dir not found at {kernel_path}")
+    hls_dir_name = hls_dir_names[0]
+    new_hls_dir_fp = new_benchmark_dir / (hls_dir_name + ".tcl")
+    new_hls_dir_fp.write_text(sources[hls_dir_name])
+
+    with span("find_top_function", "process", kernel=kernel_full_name):
+        # find the top function among the prototypes in the header
+        header = c_header.scan(h_text)
+        if len(header.prototypes) == 0:
             raise ValueError(f"No function definitions found in {new_h_fp}")
-        top_fn_name = func_def_matches[-1].group(1).strip()
+        top_fn_name = c_header.find_top_function(header, c_text).name
         print(top_fn_name)
 
-        # make a top.txt
-        top_txt_fp = new_benchmark_dir / "top.txt"
-        top_txt_fp.write_text(top_fn_name)
+    # make a top.txt
+    top_txt_fp = new_benchmark_dir / "top.txt"
+    top_txt_fp.write_text(top_fn_name)
+
+    # make a kernel_description.md
+    kernel_description = kernel_descriptions[base_full_name]
+    kernel_description_fp = new_benchmark_dir / "kernel_description.md"
+    kernel_description_fp.write_text(kernel_description)
+
+    if variant is not None:
+        check_partition_factors(
+            sources[hls_dir_name],
+            build_benchmark_record(new_benchmark_dir),
+            kernel_full_name,
+        )
+
+    # convert the %% sectioned text test data into memory mappable arrays, the
+    # shipped data only fits the original problem size
+    if variant is None and "local_support.c" in sources:
+        from vectors import convert_test_vectors
+
+        with span("convert_test_vectors", "process", kernel=kernel_full_name):
+            convert_test_vectors(
+                sources,
+                h_text,
+                build_benchmark_record(new_benchmark_dir),
+                new_benchmark_dir / VECTORS_DIR_NAME,
+            )
+
+
+PROCESSING_MODULES = [
+    Path(__file__),
+    Path(c_header.__file__),
+    Path(__file__).parent / "benchmarks.py",
+    Path(__file__).parent / "vectors.py",
+]
+
+GZIP_BLOCK_SIZE = 1 << 20
+DEFLATE_WINDOW_SIZE = 1 << 15
+
+
+def compress_gzip_block(block: bytes, dictionary: bytes, level: int, last: bool):
+    # raw deflate, primed with the tail of the previous block like pigz does so
+    # that splitting the input into blocks costs almost nothing in ratio
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(block) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+class ParallelGzipWriter:
+    # Writes a single member gzip stream whose deflate blocks are compressed on
+    # a thread pool (zlib releases the GIL). Every block but the last ends with
+    # a sync flush, so the concatenation is one valid deflate stream that any
+    # gzip reader can decode. The output only depends on the data, level and
+    # block size, never on the number of threads.
+
+    def __init__(
+        self,
+        fileobj: IO[bytes],
+        n_jobs: int = 1,
+        level: int = 9,
+        block_size: int = GZIP_BLOCK_SIZE,
+    ):
+        self.fileobj = fileobj
+        self.n_jobs = max(n_jobs, 1)
+        self.level = level
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(max_workers=self.n_jobs)
+        self.pending: deque[Future] = deque()
+        self.buffer = bytearray()
+        self.previous_tail = b""
+        self.crc = 0
+        self.size = 0
+
+        xfl = 2 if level == 9 else 4 if level == 1 else 0
+        # magic, deflate, no flags, mtime 0, xfl, os unknown
+        self.fileobj.write(
+            b"\x1f\x8b\x08\x00" + struct.pack("<I", 0) + bytes([xfl, 255])
+        )
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[: self.block_size])
+            del self.buffer[: self.block_size]
+            self._submit(block, last=False)
+        return len(data)
+
+    def _submit(self, block: bytes, last: bool) -> None:
+        self.pending.append(
+            self.executor.submit(
+                compress_gzip_block, block, self.previous_tail, self.level, last
+            )
+        )
+        self.previous_tail = block[-DEFLATE_WINDOW_SIZE:]
+        # bound the memory held by in flight blocks
+        while len(self.pending) > 2 * self.n_jobs:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self) -> None:
+        self._submit(bytes(self.buffer), last=True)
+        self.buffer.clear()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+        self.executor.shutdown()
+
+    def abort(self) -> None:
+        # drops the blocks still queued, the stream is left unterminated
+        self.pending.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def reproducible_tarinfo(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo:
+    tarinfo.mtime = int(os.environ.get("SOURCE_DATE_EPOCH", "0"))
+    tarinfo.uid = 0
+    tarinfo.gid = 0
+    tarinfo.uname = ""
+    tarinfo.gname = ""
+    tarinfo.mode = 0o755 if tarinfo.isdir() else 0o644
+    return tarinfo
+
+
+def write_reproducible_tar(fileobj: IO[bytes], source_dir: Path) -> None:
+    # sorted members with normalized metadata, so the same tree always gives
+    # byte identical archives
+    with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for fp in [source_dir] + sorted(source_dir.rglob("*")):
+            arcname = (Path(source_dir.name) / fp.relative_to(source_dir)).as_posix()
+            tarinfo = reproducible_tarinfo(tar.gettarinfo(fp, arcname))
+            if tarinfo.isfile():
+                with open(fp, "rb") as f:
+                    tar.addfile(tarinfo, f)
+            else:
+                tar.addfile(tarinfo)
+
+
+@contextlib.contextmanager
+def discard_on_error(fp: Path) -> Iterator[None]:
+    try:
+        yield
+    except BaseException:
+        fp.unlink(missing_ok=True)
+        raise
+
+
+def sha256_file(fp: Path) -> str:
+    return hashlib.sha256(fp.read_bytes()).hexdigest()
+
+
+def is_archive_up_to_date(archive_fp: Path, archive_hash: str | None) -> bool:
+    return (
+        archive_hash is not None
+        and archive_fp.exists()
+        and sha256_file(archive_fp) == archive_hash
+    )
+
 
-        # make a kernel_description.md
-        kernel_description = kernel_descriptions[kernel_full_name]
-        kernel_description_fp = new_benchmark_dir / "kernel_description.md"
-        kernel_description_fp.write_text(kernel_description)
+def write_output_archive(output_file: Path, source_dir: Path, n_jobs: int) -> None:
+    # written next to the output and renamed into place, so a failed or
+    # interrupted run leaves the previous archive as it was
+    tmp_fp = output_file.with_name(output_file.name + ".tmp")
+    with discard_on_error(tmp_fp), open(tmp_fp, "wb") as f:
+        if output_file.name.endswith((".tar.gz", ".tgz")):
+            with ParallelGzipWriter(f, n_jobs=n_jobs) as gz:
+                write_reproducible_tar(gz, source_dir)  # type: ignore[arg-type]
+        elif output_file.name.endswith((".tar.zst", ".tzst")):
+            try:
+                import zstandard
+            except ImportError as e:
+                raise RuntimeError(
+                    "The zstandard package is required to write .tar.zst archives"
+                ) from e
+            # multi threaded zstd output is identical for any number of threads
+            compressor = zstandard.ZstdCompressor(level=19, threads=max(n_jobs, 1))
+            with compressor.stream_writer(f, closefd=False) as zst:
+                write_reproducible_tar(zst, source_dir)  # type: ignore[arg-type]
+        elif output_file.name.endswith(".tar"):
+            write_reproducible_tar(f, source_dir)
+        else:
+            raise ValueError(f"Unsupported output archive type: {output_file}")
+    os.replace(tmp_fp, output_file)
+
+
+def hash_processing_rules() -> str:
+    h = hashlib.sha256()
+    for module_fp in PROCESSING_MODULES:
+        h.update(module_fp.read_bytes())
+    return h.hexdigest()
+
+
+def main(args):
+    n_jobs: int = args.jobs
+
+    benchmark_distribution_fp: Path = args.benchmark_distribution
+    output_dir: Path = args.output_directory
+    output_file: Path = args.output_file
+    manifest_fp: Path = args.manifest
+
+    # any change to the processing code itself invalidates every kernel
+    rules_hash = hash_processing_rules()
+    manifest = {} if args.force else load_manifest(manifest_fp)
+    manifest_output_dir = manifest.get("output_dir")
+    if manifest.get("rules_hash") != rules_hash or manifest_output_dir != str(
+        output_dir
+    ):
+        manifest = {}
+    if not manifest and output_dir.exists():
+        shutil.rmtree(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with span("read_distribution", "process", archive=benchmark_distribution_fp.name):
+        benchmark_sources = read_benchmark_distribution(
+            benchmark_distribution_fp, args.test_vectors
+        )
+
+    kernel_descriptions = gather_kernel_description()
 
-    Parallel(n_jobs=n_jobs)(
-        delayed(process_benchmark)(benchmark) for benchmark in source_benchmark_dirs
+    scaling: dict[str, list[ScalingVariant]] = {}
+    if args.scaling is not None:
+        scaling = load_scaling_spec(args.scaling)
+
+    # every kernel is a job, and so is every scaled variant of it
+    jobs: dict[str, tuple[str, ScalingVariant | None]] = {}
+    for kernel_path, sources in benchmark_sources.items():
+        var_kern, var_alg = parse_makefile_vars(sources["Makefile"], kernel_path)
+        jobs[kernel_path] = (kernel_path, None)
+        for variant in scaling.get(f"{var_kern}_{var_alg}", []):
+            jobs[f"{kernel_path}:{variant.name}"] = (kernel_path, variant)
+    unknown_kernels = set(scaling) - {
+        "_".join(parse_makefile_vars(sources["Makefile"], kernel_path))
+        for kernel_path, sources in benchmark_sources.items()
+    }
+    if unknown_kernels:
+        raise ValueError(f"Scaling spec names unknown kernels: {unknown_kernels}")
+
+    old_kernel_entries: dict[str, dict] = manifest.get("kernels", {})
+    new_kernel_entries: dict[str, dict] = {}
+    benchmarks_to_process: list[str] = []
+    for job_key, (kernel_path, variant) in jobs.items():
+        sources = benchmark_sources[kernel_path]
+        var_kern, var_alg = parse_makefile_vars(sources["Makefile"], kernel_path)
+        base_full_name = f"{var_kern}_{var_alg}"
+        kernel_full_name = base_full_name
+        if variant is not None:
+            kernel_full_name = f"{base_full_name}_{variant.name}"
+        input_hash = hash_benchmark_inputs(
+            sources,
+            kernel_descriptions.get(base_full_name, ""),
+            rules_hash,
+            variant,
+        )
+        new_kernel_entries[job_key] = {
+            "name": kernel_full_name,
+            "input_hash": input_hash,
+            "inputs": {name: sha256_text(text) for name, text in sources.items()},
+        }
+        if variant is not None:
+            new_kernel_entries[job_key]["variant_of"] = base_full_name
+            new_kernel_entries[job_key]["scaling"] = variant.defines
+        old_entry = old_kernel_entries.get(job_key)
+        if is_benchmark_up_to_date(
+            output_dir / kernel_full_name, old_entry, input_hash
+        ):
+            assert old_entry is not None
+            new_kernel_entries[job_key]["outputs"] = old_entry["outputs"]
+        else:
+            benchmarks_to_process.append(job_key)
+
+    # drop output folders of kernels that are no longer produced
+    stale_names = {entry["name"] for entry in old_kernel_entries.values()} - {
+        entry["name"] for entry in new_kernel_entries.values()
+    }
+    for name in stale_names:
+        if (output_dir / name).exists():
+            shutil.rmtree(output_dir / name)
+
+    print(
+        f"Processing {len(benchmarks_to_process)} of {len(jobs)} "
+        "benchmarks, the rest are up to date"
     )
 
-    shutil.rmtree(tmp_dir)
-    for folder in new_benchmarks_dir.glob("*"):
-        shutil.move(folder, output_dir)
-    shutil.rmtree(new_benchmarks_dir)
+    with span("process_benchmarks", "process", count=len(benchmarks_to_process)):
+        Parallel(n_jobs=n_jobs)(
+            delayed(process_benchmark)(
+                jobs[job_key][0],
+                benchmark_sources[jobs[job_key][0]],
+                output_dir,
+                kernel_descriptions,
+                jobs[job_key][1],
+            )
+            for job_key in benchmarks_to_process
+        )
 
-    with tarfile.open(output_file, "w:gz") as tar:
-        tar.add(output_dir, arcname=output_dir.name)
+    with span("hash_outputs", "process", count=len(benchmarks_to_process)):
+        for job_key in benchmarks_to_process:
+            entry = new_kernel_entries[job_key]
+            entry["outputs"] = hash_output_files(output_dir / entry["name"])
+
+    index_records = {}
+    for job_key, entry in new_kernel_entries.items():
+        record = build_benchmark_record(output_dir / entry["name"])
+        index_record = {"kernel_path": jobs[job_key][0], **record}
+        if "variant_of" in entry:
+            index_record["variant_of"] = entry["variant_of"]
+            index_record["scaling"] = entry["scaling"]
+        index_records[entry["name"]] = index_record
+    index_changed = write_benchmark_index(output_dir, index_records)
+
+    outputs_unchanged = (
+        not index_changed and len(benchmarks_to_process) == 0 and len(stale_names) == 0
+    )
+    if not (
+        outputs_unchanged
+        and is_archive_up_to_date(output_file, manifest.get("tarball_hash"))
+    ):
+        with span("write_archive", "process", archive=output_file.name):
+            write_output_archive(output_file, output_dir, n_jobs)
+    if args.output_zst is not None and not (
+        outputs_unchanged
+        and is_archive_up_to_date(args.output_zst, manifest.get("zst_hash"))
+    ):
+        with span("write_archive", "process", archive=args.output_zst.name):
+            write_output_archive(args.output_zst, output_dir, n_jobs)
+
+    save_manifest(
+        manifest_fp,
+        {
+            "rules_hash": rules_hash,
+            "output_dir": str(output_dir),
+            "kernels": new_kernel_entries,
+            "tarball_hash": sha256_file(output_file),
+            "zst_hash": sha256_file(args.output_zst)
+            if args.output_zst is not None
+            else None,
+        },
+    )
 
 
 if __name__ == "__main__":
@@ -323,7 +918,7 @@ if __name__ == "__main__":
         type=Path,
         nargs="?",
         default=Path("./MachSuite-master-6236e59.zip"),
-        help="Path to the input benchmark distribution",
+        help="Path to the input benchmark distribution (zip, tar, tar.gz or tar.zst)",
     )
     parser.add_argument(
         "output_directory",
@@ -339,6 +934,41 @@ if __name__ == "__main__":
         default=Path("./hls-machsuite.tar.gz"),
         help="Generated output tar.gz file with processed benchmarks",
     )
+    parser.add_argument(
+        "--output-zst",
+        type=Path,
+        default=None,
+        help="Also write the processed benchmarks as a tar.zst file",
+    )
+    parser.add_argument(
+        "-t",
+        "--test-vectors",
+        action="store_true",
+        default=False,
+        help="Convert input.data/check.data into binary .npy test vectors",
+    )
+    parser.add_argument(
+        "-s",
+        "--scaling",
+        type=Path,
+        default=None,
+        help="JSON spec of #define values to sweep per kernel, each entry produces "
+        "a derived benchmark such as gemm_ncubed_n128",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=Path,
+        default=Path("./hls-machsuite.manifest.json"),
+        help="Manifest of input and output hashes used for incremental rebuilds",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        default=False,
+        help="Ignore the manifest and rebuild every benchmark",
+    )
     parser.add_argument(
         "-j",
         "--jobs",
@@ -347,6 +977,15 @@ if __name__ == "__main__":
         default=1,
         help="Number of jobs to run in parallel",
     )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        nargs="?",
+        const=TRACE_DIR,
+        help="Record per stage timings and write a Chrome trace and summary",
+    )
 
     args = parser.parse_args()
-    main(args)
+    with tracing(args.trace):
+        main(args)
@@ -0,0 +1,248 @@
+import argparse
+import contextlib
+import functools
+import inspect
+import json
+import os
+import resource
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+# set by enable_tracing and inherited by the scheduler's forked jobs and the
+# joblib workers, so every process that runs a stage records into the same dir
+TRACE_DIR_ENV = "HLS_TRACE_DIR"
+TRACE_DIR = Path("./trace")
+
+SPAN_SUMMARY_COLUMNS = [
+    ("category", "category"),
+    ("name", "span"),
+    ("count", "count"),
+    ("wall", "wall s"),
+    ("mean", "mean s"),
+    ("max", "max s"),
+    ("cpu", "cpu s"),
+    ("child_cpu", "child cpu s"),
+    ("max_rss", "max rss MiB"),
+]
+
+_write_lock = threading.Lock()
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    # wall clock start, comparable between processes
+    start: float
+    wall: float
+    # user + system seconds of this process and of the children it reaped
+    cpu: float
+    child_cpu: float
+    # high water mark of this process and its reaped children at the end of
+    # the span, in bytes
+    max_rss: int
+    pid: int
+    tid: int
+    args: dict[str, Any] = field(default_factory=dict)
+
+
+def enable_tracing(trace_dir: Path = TRACE_DIR) -> Path:
+    trace_dir.mkdir(parents=True, exist_ok=True)
+    for fp in trace_dir.glob("spans-*.jsonl"):
+        fp.unlink()
+    os.environ[TRACE_DIR_ENV] = str(trace_dir.resolve())
+    return trace_dir
+
+
+def tracing_enabled() -> bool:
+    return TRACE_DIR_ENV in os.environ
+
+
+def _usage() -> tuple[float, float, int]:
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KiB on linux
+    return (
+        self_usage.ru_utime + self_usage.ru_stime,
+        child_usage.ru_utime + child_usage.ru_stime,
+        1024 * max(self_usage.ru_maxrss, child_usage.ru_maxrss),
+    )
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[dict[str, Any]]:
+    # Times the body and appends it to this process' span file. The yielded
+    # dict ends up as the span's args, so the body can attach what it learns,
+    # e.g. a cache hit or the peak RSS of the tool it ran. Child CPU time is
+    # only counted once a child has been waited for, and with several threads
+    # running tools at once it is shared between their spans.
+    trace_dir = os.environ.get(TRACE_DIR_ENV)
+    if trace_dir is None:
+        yield args
+        return
+    start = time.time()
+    wall_start = time.perf_counter()
+    cpu_start, child_cpu_start, _ = _usage()
+    try:
+        yield args
+    except BaseException as e:
+        args["error"] = type(e).__name__
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu, child_cpu, max_rss = _usage()
+        record = Span(
+            name,
+            category,
+            start,
+            wall,
+            cpu - cpu_start,
+            child_cpu - child_cpu_start,
+            max_rss,
+            os.getpid(),
+            threading.get_native_id(),
+            args,
+        )
+        line = json.dumps(asdict(record), default=str) + "\n"
+        with _write_lock:
+            with open(Path(trace_dir) / f"spans-{os.getpid()}.jsonl", "a") as f:
+                f.write(line)
+
+
+def traced(name: str, category: str, *arg_names: str) -> Callable:
+    # span over a whole function call, with the named parameters as its args
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            span_args = {a: bound.arguments.get(a) for a in arg_names}
+            with span(name, category, **span_args):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def load_spans(trace_dir: Path) -> list[Span]:
+    spans = []
+    for fp in sorted(trace_dir.glob("spans-*.jsonl")):
+        for line in fp.read_text().splitlines():
+            try:
+                spans.append(Span(**json.loads(line)))
+            except (json.JSONDecodeError, TypeError):
+                # a process killed mid write leaves a partial line
+                continue
+    return sorted(spans, key=lambda s: s.start)
+
+
+def write_chrome_trace(spans: list[Span], fp: Path) -> None:
+    # complete ("X") events, loadable in chrome://tracing or ui.perfetto.dev;
+    # timestamps are microseconds since the first span
+    t0 = min((s.start for s in spans), default=0.0)
+    events = []
+    for s in spans:
+        events.append(
+            {
+                "name": s.name,
+                "cat": s.category,
+                "ph": "X",
+                "ts": round((s.start - t0) * 1e6),
+                "dur": round(s.wall * 1e6),
+                "pid": s.pid,
+                "tid": s.tid,
+                "args": {
+                    **s.args,
+                    "cpu_s": round(s.cpu, 6),
+                    "child_cpu_s": round(s.child_cpu, 6),
+                    "max_rss": s.max_rss,
+                },
+            }
+        )
+    fp.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}))
+
+
+def summarize_spans(spans: list[Span]) -> list[dict[str, Any]]:
+    groups: dict[tuple[str, str], list[Span]] = {}
+    for s in spans:
+        groups.setdefault((s.category, s.name), []).append(s)
+    rows = []
+    for (category, name), group in groups.items():
+        wall = sum(s.wall for s in group)
+        rows.append(
+            {
+                "category": category,
+                "name": name,
+                "count": len(group),
+                "wall": wall,
+                "mean": wall / len(group),
+                "max": max(s.wall for s in group),
+                "cpu": sum(s.cpu for s in group),
+                "child_cpu": sum(s.child_cpu for s in group),
+                "max_rss": max(
+                    max(s.max_rss, s.args.get("peak_rss") or 0) for s in group
+                ),
+            }
+        )
+    return sorted(rows, key=lambda row: -row["wall"])
+
+
+def format_span_summary(rows: list[dict[str, Any]]) -> str:
+    table = [[header for _, header in SPAN_SUMMARY_COLUMNS]]
+    for row in rows:
+        cells = []
+        for key, _ in SPAN_SUMMARY_COLUMNS:
+            value = row[key]
+            if key == "max_rss":
+                cells.append(f"{value / 2**20:.0f}")
+            elif isinstance(value, float):
+                cells.append(f"{value:.3f}")
+            else:
+                cells.append(str(value))
+        table.append(cells)
+    widths = [max(len(r[i]) for r in table) for i in range(len(SPAN_SUMMARY_COLUMNS))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(r, widths)).rstrip()
+        for r in table
+    )
+
+
+def export_trace(trace_dir: Path, trace_fp: Path | None = None) -> str:
+    spans = load_spans(trace_dir)
+    write_chrome_trace(spans, trace_fp or trace_dir / "trace.json")
+    return format_span_summary(summarize_spans(spans))
+
+
+@contextlib.contextmanager
+def tracing(trace_dir: Path | None) -> Iterator[None]:
+    # records spans for the duration of the block and exports them at the end,
+    # also when the block returns early or fails
+    if trace_dir is None:
+        yield
+        return
+    enable_tracing(trace_dir)
+    try:
+        yield
+    finally:
+        print(export_trace(trace_dir))
+        os.environ.pop(TRACE_DIR_ENV, None)
+
+
+def main(args):
+    summary = export_trace(args.trace_dir, args.output)
+    print(summary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge recorded spans into a Chrome trace and print a summary"
+    )
+    parser.add_argument("trace_dir", type=Path, nargs="?", default=TRACE_DIR)
+    parser.add_argument("-o", "--output", type=Path, default=None)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,100 @@
+import re
+
+import c_header
+
+# Pieces roughly like the pre-tokenizer of the llama 3 / tiktoken style BPEs:
+# a word with its leading space, up to three digits, a run of punctuation or a
+# run of whitespace. Pieces longer than a typical merge count as several
+# tokens. Numbers and punctuation split finer than the real vocab does, so the
+# count errs on the high side, which is the safe side for a context budget.
+RE_PRETOKEN = re.compile(r" ?[A-Za-z_]+| ?\d{1,3}| ?[^\sA-Za-z_\d]+|\s+")
+CHARS_PER_MERGE = 6
+
+# initializer lists with at least this many literal values are replaced by a
+# summary when tables are summarized
+TABLE_MIN_VALUES = 32
+TABLE_PREVIEW_VALUES = 8
+RE_SYSTEM_INCLUDE = re.compile(r"^\s*#\s*include\s*<")
+
+
+class PromptTooLong(Exception): ...
+
+
+def count_tokens(text: str) -> int:
+    return sum(
+        1 + (len(piece) - 1) // CHARS_PER_MERGE for piece in RE_PRETOKEN.findall(text)
+    )
+
+
+def summarize_constant_tables(
+    tokens: list[c_header.Token], min_values: int = TABLE_MIN_VALUES
+) -> list[c_header.Token]:
+    # "= { 0x63, 0x7c, ... }" with only literals inside becomes
+    # "= { /* 256 values: 0x63, 0x7c, ... */ }"
+    code = [i for i, t in enumerate(tokens) if t.kind not in ("space", "newline")]
+    replaced: dict[int, tuple[int, c_header.Token]] = {}
+    for n, i in enumerate(code[:-1]):
+        if tokens[i].text != "=" or tokens[code[n + 1]].text != "{":
+            continue
+        open_idx = code[n + 1]
+        close_idx = c_header.matching_bracket(tokens, open_idx)
+        inner = [t for t in tokens[open_idx + 1 : close_idx] if t.kind != "space"]
+        values = [t for t in inner if t.kind in ("number", "string")]
+        if len(values) < min_values:
+            continue
+        if any(
+            t.kind not in ("number", "string", "newline") and t.text not in "{},-+"
+            for t in inner
+        ):
+            continue
+        preview = ", ".join(t.text for t in values[:TABLE_PREVIEW_VALUES])
+        summary = f" /* {len(values)} values: {preview}, ... */ "
+        replaced[open_idx + 1] = (
+            close_idx,
+            c_header.Token("comment", summary, tokens[open_idx + 1].start, 0),
+        )
+
+    summarized = []
+    i = 0
+    while i < len(tokens):
+        if i in replaced:
+            close_idx, summary_token = replaced[i]
+            summarized.append(summary_token)
+            i = close_idx
+            continue
+        summarized.append(tokens[i])
+        i += 1
+    return summarized
+
+
+def compact_c_source(text: str, summarize_tables: bool = False) -> str:
+    # Drops comments, system includes, blank lines and trailing whitespace and
+    # collapses runs of spaces inside a line. Leading indentation is kept, it is
+    # cheap and the model reads the nesting from it.
+    tokens = []
+    for token in c_header.tokenize(text):
+        if token.kind == "comment":
+            # a comment between two tokens still separates them
+            token = c_header.Token("space", " ", token.start, token.end)
+        elif token.kind == "directive":
+            if RE_SYSTEM_INCLUDE.match(token.text):
+                continue
+            directive = c_header.RE_TRAILING_COMMENT.sub("", token.text).rstrip()
+            token = c_header.Token("directive", directive, token.start, token.end)
+        tokens.append(token)
+    if summarize_tables:
+        tokens = summarize_constant_tables(tokens)
+
+    lines = []
+    line: list[str] = []
+    for token in tokens:
+        if token.kind == "newline":
+            lines.append("".join(line).rstrip())
+            line = []
+        elif token.kind == "space":
+            if not line or not line[-1].isspace():
+                line.append(token.text if not line else " ")
+        else:
+            line.append(token.text)
+    lines.append("".join(line).rstrip())
+    return "\n".join(line for line in lines if line.strip())
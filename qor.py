@@ -0,0 +1,432 @@
+import argparse
+import hashlib
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+QOR_DB_FP = Path("./qor.sqlite")
+RESOURCE_NAMES = ["BRAM_18K", "DSP", "FF", "LUT", "URAM"]
+
+RE_REPORT_TOP = re.compile(r"^== Vi\w+ HLS Report for '(?P<function>[^']+)'")
+RE_REPORT_FIELD = re.compile(r"^\* (?P<key>[A-Za-z ]+):\s*(?P<value>.*?)\s*$")
+
+
+@dataclass
+class LoopQoR:
+    name: str
+    depth: int
+    latency_min: int | None
+    latency_max: int | None
+    iteration_latency: int | None
+    ii_achieved: int | None
+    ii_target: int | None
+    trip_count: int | None
+    pipelined: bool
+
+
+@dataclass
+class CSynthReport:
+    function: str
+    part: str | None = None
+    target_clock: float | None = None
+    estimated_clock: float | None = None
+    clock_uncertainty: float | None = None
+    latency_min: int | None = None
+    latency_max: int | None = None
+    interval_min: int | None = None
+    interval_max: int | None = None
+    pipeline_type: str | None = None
+    resources: dict[str, int | None] = field(default_factory=dict)
+    available: dict[str, int | None] = field(default_factory=dict)
+    loops: list[LoopQoR] = field(default_factory=list)
+
+
+def parse_number(cell: str) -> int | float | None:
+    # "-" and "?" are used for unknown trip counts / latencies, "~0" for tiny
+    # utilization percentages
+    cell = cell.strip().removesuffix("ns").strip().lstrip("~")
+    if cell in ("", "-", "?", "undef"):
+        return None
+    try:
+        return int(cell)
+    except ValueError:
+        pass
+    try:
+        return float(cell)
+    except ValueError:
+        return None
+
+
+def parse_int(cell: str) -> int | None:
+    value = parse_number(cell)
+    return None if value is None else int(value)
+
+
+def parse_float(cell: str) -> float | None:
+    value = parse_number(cell)
+    return None if value is None else float(value)
+
+
+def split_row(line: str) -> list[str]:
+    return line.strip().removeprefix("|").removesuffix("|").split("|")
+
+
+def read_table(lines: list[str], start: int) -> list[list[str]]:
+    # rows of the first ascii table at or after start, split on "|"; the
+    # header rows come first, separator lines are dropped
+    i = start
+    while i < len(lines) and not lines[i].lstrip().startswith("+-"):
+        if lines[i].strip() == "N/A":
+            return []
+        i += 1
+    rows = []
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if stripped.startswith("+-"):
+            pass
+        elif stripped.startswith("|"):
+            rows.append(split_row(lines[i]))
+        else:
+            break
+        i += 1
+    return rows
+
+
+def find_line(
+    lines: list[str], text: str, start: int = 0, end: int | None = None
+) -> int:
+    end = len(lines) if end is None else end
+    for i in range(start, end):
+        if lines[i].strip().startswith(text):
+            return i
+    return -1
+
+
+def parse_csynth_report(text: str) -> CSynthReport:
+    lines = text.splitlines()
+
+    report = None
+    for line in lines[:20]:
+        match = RE_REPORT_TOP.match(line.strip())
+        if match is not None:
+            report = CSynthReport(match.group("function"))
+            break
+    if report is None:
+        raise ValueError("Not a csynth report, no 'HLS Report for' header")
+
+    for line in lines[:40]:
+        match = RE_REPORT_FIELD.match(line.strip())
+        if match is not None and match.group("key") == "Target device":
+            report.part = match.group("value")
+
+    timing_idx = find_line(lines, "+ Timing:")
+    if timing_idx >= 0:
+        for row in read_table(lines, timing_idx):
+            if row[0].strip() == "ap_clk":
+                report.target_clock = parse_float(row[1])
+                report.estimated_clock = parse_float(row[2])
+                report.clock_uncertainty = parse_float(row[3])
+
+    latency_idx = find_line(lines, "+ Latency:")
+    utilization_idx = find_line(lines, "== Utilization Estimates")
+    if latency_idx >= 0:
+        # two header rows, then the single summary row
+        rows = read_table(lines, latency_idx)
+        if len(rows) >= 3:
+            summary = rows[2]
+            report.latency_min = parse_int(summary[0])
+            report.latency_max = parse_int(summary[1])
+            report.interval_min = parse_int(summary[4])
+            report.interval_max = parse_int(summary[5])
+            report.pipeline_type = summary[6].strip()
+
+        loop_idx = find_line(lines, "* Loop:", latency_idx, utilization_idx)
+        if loop_idx >= 0:
+            for row in read_table(lines, loop_idx)[2:]:
+                # "- name" for top level loops, " + name" / "  + name" below
+                name_cell = row[0].rstrip()
+                name = name_cell.strip().lstrip("-+").strip()
+                depth = 0
+                if name_cell.strip().startswith("+"):
+                    depth = len(name_cell) - len(name_cell.lstrip())
+                report.loops.append(
+                    LoopQoR(
+                        name,
+                        depth,
+                        parse_int(row[1]),
+                        parse_int(row[2]),
+                        parse_int(row[3]),
+                        parse_int(row[4]),
+                        parse_int(row[5]),
+                        parse_int(row[6]),
+                        row[7].strip() == "yes",
+                    )
+                )
+
+    if utilization_idx >= 0:
+        rows = read_table(lines, utilization_idx)
+        if rows:
+            columns = [c.strip() for c in rows[0]]
+            for row in rows[1:]:
+                row_name = row[0].strip()
+                if row_name == "Total":
+                    target = report.resources
+                elif row_name == "Available":
+                    target = report.available
+                else:
+                    continue
+                for column, cell in zip(columns[1:], row[1:]):
+                    target[column] = parse_int(cell)
+
+    return report
+
+
+def parse_report_dir(report_dir: Path) -> list[CSynthReport]:
+    # csynth.rpt covers the top function, vitis_hls writes <function>_csynth.rpt
+    # for every function below it
+    top = parse_csynth_report((report_dir / "csynth.rpt").read_text())
+    reports = [top]
+    for fp in sorted(report_dir.glob("*_csynth.rpt")):
+        report = parse_csynth_report(fp.read_text())
+        if report.function != top.function:
+            reports.append(report)
+    return reports
+
+
+def config_id(directives: str | None) -> str:
+    if not directives or not directives.strip():
+        return "baseline"
+    return hashlib.sha256(directives.strip().encode()).hexdigest()[:16]
+
+
+QOR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    kernel TEXT NOT NULL,
+    config TEXT NOT NULL,
+    part TEXT NOT NULL,
+    clock REAL NOT NULL,
+    directives TEXT NOT NULL,
+    tool_version TEXT,
+    created REAL NOT NULL,
+    UNIQUE (kernel, config, part, clock)
+);
+CREATE TABLE IF NOT EXISTS functions (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    function TEXT NOT NULL,
+    is_top INTEGER NOT NULL,
+    latency_min INTEGER,
+    latency_max INTEGER,
+    interval_min INTEGER,
+    interval_max INTEGER,
+    pipeline_type TEXT,
+    estimated_clock REAL,
+    bram INTEGER,
+    dsp INTEGER,
+    ff INTEGER,
+    lut INTEGER,
+    uram INTEGER,
+    PRIMARY KEY (run_id, function)
+);
+CREATE TABLE IF NOT EXISTS loops (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    function TEXT NOT NULL,
+    loop TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    latency_min INTEGER,
+    latency_max INTEGER,
+    iteration_latency INTEGER,
+    ii_achieved INTEGER,
+    ii_target INTEGER,
+    trip_count INTEGER,
+    pipelined INTEGER NOT NULL,
+    PRIMARY KEY (run_id, function, loop)
+);
+CREATE INDEX IF NOT EXISTS runs_kernel ON runs (kernel, part, clock);
+CREATE INDEX IF NOT EXISTS functions_top ON functions (is_top, latency_max);
+"""
+
+
+class QoRStore:
+    # One row per synthesis run keyed by (kernel, config, part, clock), the
+    # parsed top function and loop numbers hang off it. Re-recording a key
+    # replaces the old numbers.
+
+    def __init__(self, db_fp: Path = QOR_DB_FP):
+        self.db_fp = db_fp
+        self.connection = sqlite3.connect(db_fp)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(QOR_SCHEMA)
+
+    def __enter__(self) -> "QoRStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def record(
+        self,
+        kernel: str,
+        reports: list[CSynthReport],
+        directives: str | None = None,
+        tool_version: str | None = None,
+    ) -> int:
+        top = reports[0]
+        if top.part is None or top.target_clock is None:
+            raise ValueError(f"{kernel}: report is missing the part or target clock")
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM runs WHERE kernel = ? AND config = ? AND part = ?"
+                " AND clock = ?",
+                (kernel, config_id(directives), top.part, top.target_clock),
+            )
+            run_id = self.connection.execute(
+                "INSERT INTO runs (kernel, config, part, clock, directives,"
+                " tool_version, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    kernel,
+                    config_id(directives),
+                    top.part,
+                    top.target_clock,
+                    directives or "",
+                    tool_version,
+                    time.time(),
+                ),
+            ).lastrowid
+            assert run_id is not None
+            self.connection.executemany(
+                "INSERT INTO functions VALUES"
+                " (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        report.function,
+                        report is top,
+                        report.latency_min,
+                        report.latency_max,
+                        report.interval_min,
+                        report.interval_max,
+                        report.pipeline_type,
+                        report.estimated_clock,
+                        *(report.resources.get(r) for r in RESOURCE_NAMES),
+                    )
+                    for report in reports
+                ],
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO loops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        report.function,
+                        loop.name,
+                        loop.depth,
+                        loop.latency_min,
+                        loop.latency_max,
+                        loop.iteration_latency,
+                        loop.ii_achieved,
+                        loop.ii_target,
+                        loop.trip_count,
+                        loop.pipelined,
+                    )
+                    for report in reports
+                    for loop in report.loops
+                ],
+            )
+        return run_id
+
+    def query(
+        self,
+        kernel: str | None = None,
+        part: str | None = None,
+        clock: float | None = None,
+        config: str | None = None,
+        run_id: int | None = None,
+    ) -> list[dict[str, Any]]:
+        # top function numbers of every matching run
+        where = ["functions.is_top = 1"]
+        params: list[Any] = []
+        for column, value in [
+            ("kernel", kernel),
+            ("clock", clock),
+            ("config", config),
+            ("id", run_id),
+        ]:
+            if value is not None:
+                where.append(f"runs.{column} = ?")
+                params.append(value)
+        if part is not None:
+            # reports print the part as xc7z020-clg484-1 while it is set as
+            # xc7z020clg484-1, match either spelling
+            where.append("REPLACE(runs.part, '-', '') = REPLACE(?, '-', '')")
+            params.append(part)
+        rows = self.connection.execute(
+            "SELECT runs.id, runs.kernel, runs.config, runs.part, runs.clock,"
+            " functions.function, functions.latency_min, functions.latency_max,"
+            " functions.interval_min, functions.interval_max,"
+            " functions.estimated_clock, functions.bram, functions.dsp,"
+            " functions.ff, functions.lut, functions.uram"
+            " FROM runs JOIN functions ON functions.run_id = runs.id"
+            f" WHERE {' AND '.join(where)} ORDER BY runs.kernel, functions.latency_max",
+            params,
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def loops(self, run_id: int) -> list[dict[str, Any]]:
+        rows = self.connection.execute(
+            "SELECT * FROM loops WHERE run_id = ? ORDER BY function, rowid",
+            (run_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+QOR_TABLE_COLUMNS = [
+    ("kernel", "kernel"),
+    ("config", "config"),
+    ("latency_max", "latency"),
+    ("interval_max", "interval"),
+    ("estimated_clock", "clock"),
+    ("bram", "BRAM"),
+    ("dsp", "DSP"),
+    ("ff", "FF"),
+    ("lut", "LUT"),
+    ("uram", "URAM"),
+]
+
+
+def format_qor_table(rows: list[dict[str, Any]]) -> str:
+    table = [[header for _, header in QOR_TABLE_COLUMNS]]
+    for row in rows:
+        table.append(
+            ["-" if row[key] is None else str(row[key]) for key, _ in QOR_TABLE_COLUMNS]
+        )
+    widths = [max(len(r[i]) for r in table) for i in range(len(QOR_TABLE_COLUMNS))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(r, widths)).rstrip()
+        for r in table
+    )
+
+
+def main(args):
+    with QoRStore(args.db) as store:
+        rows = store.query(args.kernel, args.part, args.clock, args.config)
+        print(format_qor_table(rows))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query stored HLS QoR results")
+    parser.add_argument("--db", type=Path, default=QOR_DB_FP)
+    parser.add_argument("-k", "--kernel", default=None)
+    parser.add_argument("--part", default=None)
+    parser.add_argument("--clock", type=float, default=None)
+    parser.add_argument("--config", default=None)
+    args = parser.parse_args()
+    main(args)
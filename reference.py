@@ -0,0 +1,625 @@
+import argparse
+import inspect
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+import numpy as np
+from numpy.lib.recfunctions import (
+    structured_to_unstructured,
+    unstructured_to_structured,
+)
+
+from benchmarks import Benchmark, load_benchmarks
+
+# Every model takes the kernel's input arguments with a leading batch
+# dimension, by the same names as the C top function, and returns the output
+# arguments the kernel writes. Problem sizes come from the array shapes, the
+# keyword only parameters are filled from the kernel's #defines so the models
+# follow the headers when the sizes change.
+
+
+def gemm_ncubed(
+    m1: np.ndarray, m2: np.ndarray, *, row_size: int = 64, col_size: int = 64
+) -> dict[str, np.ndarray]:
+    batch = m1.shape[0]
+    a = m1.reshape(batch, row_size, col_size)[:, :, :row_size]
+    b = m2.reshape(batch, row_size, col_size)
+    return {"prod": (a @ b).reshape(batch, -1)}
+
+
+def gemm_blocked(
+    m1: np.ndarray,
+    m2: np.ndarray,
+    prod: np.ndarray | None = None,
+    *,
+    row_size: int = 64,
+) -> dict[str, np.ndarray]:
+    # bbgemm accumulates into prod, which the harness zeroes
+    batch = m1.shape[0]
+    a = m1.reshape(batch, row_size, row_size)
+    b = m2.reshape(batch, row_size, row_size)
+    out = a @ b
+    if prod is not None:
+        out += prod.reshape(batch, row_size, row_size)
+    return {"prod": out.reshape(batch, -1)}
+
+
+def spmv_crs(
+    val: np.ndarray, cols: np.ndarray, rowDelimiters: np.ndarray, vec: np.ndarray
+) -> dict[str, np.ndarray]:
+    batch, nnz = val.shape
+    n_rows = rowDelimiters.shape[1] - 1
+    batch_idx = np.arange(batch)[:, None]
+
+    # row of every nonzero, from a running count of the row starts before it
+    starts = np.zeros((batch, nnz + 1), dtype=np.int64)
+    np.add.at(
+        starts,
+        (batch_idx, np.clip(rowDelimiters[:, :-1], 0, nnz)),
+        1,
+    )
+    row = np.cumsum(starts[:, :nnz], axis=1) - 1
+    j = np.arange(nnz)[None, :]
+    valid = (j >= rowDelimiters[:, :1]) & (j < rowDelimiters[:, -1:])
+
+    # bincount adds the weights in index order, the same order as the C loop
+    products = val * vec[batch_idx, cols]
+    bins = (batch_idx * n_rows + row)[valid]
+    out = np.bincount(bins, weights=products[valid], minlength=batch * n_rows)
+    return {"out": out.reshape(batch, n_rows)}
+
+
+def spmv_ellpack(
+    nzval: np.ndarray, cols: np.ndarray, vec: np.ndarray, out: np.ndarray | None = None
+) -> dict[str, np.ndarray]:
+    batch, n_rows = vec.shape
+    nzval = nzval.reshape(batch, n_rows, -1)
+    cols = cols.reshape(batch, n_rows, -1)
+    products = nzval * vec[np.arange(batch)[:, None, None], cols]
+    # ellpack starts from the incoming out[] and sums column by column
+    total = np.zeros((batch, n_rows)) if out is None else out.astype(np.float64)
+    for j in range(products.shape[2]):
+        total = total + products[:, :, j]
+    return {"out": total}
+
+
+def stencil_stencil2d(
+    orig: np.ndarray, filter: np.ndarray, *, col_size: int = 64
+) -> dict[str, np.ndarray]:
+    batch = orig.shape[0]
+    grid = orig.reshape(batch, -1, col_size)
+    row_size = grid.shape[1]
+    # only the top left (row_size-2)x(col_size-2) window is written
+    sol = np.zeros_like(grid)
+    inner = sol[:, : row_size - 2, : col_size - 2]
+    for k1 in range(3):
+        for k2 in range(3):
+            weight = filter[:, k1 * 3 + k2, None, None]
+            inner += weight * grid[:, k1 : k1 + row_size - 2, k2 : k2 + col_size - 2]
+    return {"sol": sol.reshape(batch, -1)}
+
+
+def stencil_stencil3d(
+    C: np.ndarray, orig: np.ndarray, *, row_size: int = 16, col_size: int = 32
+) -> dict[str, np.ndarray]:
+    batch = orig.shape[0]
+    # INDX(k, j, i) = k + row_size*(j + col_size*i), i is the height
+    grid = orig.reshape(batch, -1, col_size, row_size)
+    sol = grid.copy()
+    sum0 = grid[:, 1:-1, 1:-1, 1:-1]
+    sum1 = (
+        grid[:, 2:, 1:-1, 1:-1]
+        + grid[:, :-2, 1:-1, 1:-1]
+        + grid[:, 1:-1, 2:, 1:-1]
+        + grid[:, 1:-1, :-2, 1:-1]
+        + grid[:, 1:-1, 1:-1, 2:]
+        + grid[:, 1:-1, 1:-1, :-2]
+    )
+    c0 = C[:, 0, None, None, None]
+    c1 = C[:, 1, None, None, None]
+    sol[:, 1:-1, 1:-1, 1:-1] = sum0 * c0 + sum1 * c1
+    return {"sol": sol.reshape(batch, -1)}
+
+
+def _lennard_jones(
+    delta: np.ndarray, lj1: float, lj2: float, mask: np.ndarray
+) -> np.ndarray:
+    r2 = np.sum(delta * delta, axis=-1)
+    r2inv = 1.0 / np.where(mask, r2, 1.0)
+    r6inv = r2inv * r2inv * r2inv
+    potential = r6inv * (lj1 * r6inv - lj2)
+    force = np.where(mask, r2inv * potential, 0.0)
+    return delta * force[..., None]
+
+
+def md_knn(
+    position_x: np.ndarray,
+    position_y: np.ndarray,
+    position_z: np.ndarray,
+    NL: np.ndarray,
+    *,
+    lj1: float = 1.5,
+    lj2: float = 2.0,
+) -> dict[str, np.ndarray]:
+    batch, n_atoms = position_x.shape
+    position = np.stack([position_x, position_y, position_z], axis=-1)
+    neighbors = NL.reshape(batch, n_atoms, -1)
+    delta = (
+        position[:, :, None, :] - position[np.arange(batch)[:, None, None], neighbors]
+    )
+    mask = np.ones(neighbors.shape, dtype=bool)
+    force = _lennard_jones(delta, lj1, lj2, mask).sum(axis=2)
+    return {
+        "force_x": force[..., 0],
+        "force_y": force[..., 1],
+        "force_z": force[..., 2],
+    }
+
+
+def md_grid(
+    n_points: np.ndarray,
+    position: np.ndarray,
+    force: np.ndarray | None = None,
+    *,
+    lj1: float = 1.5,
+    lj2: float = 2.0,
+) -> dict[str, np.ndarray]:
+    structured = position.dtype.names is not None
+    pos = structured_to_unstructured(position) if structured else position
+    if force is None:
+        total = np.zeros_like(pos)
+    elif structured:
+        total = structured_to_unstructured(force).copy()
+    else:
+        total = force.astype(np.float64)
+
+    block_side = n_points.shape[1]
+    density = pos.shape[-2]
+    # blocks outside the grid hold zero points so they drop out of the sum
+    pos_pad = np.pad(pos, [(0, 0), (1, 1), (1, 1), (1, 1), (0, 0), (0, 0)])
+    n_pad = np.pad(n_points, [(0, 0), (1, 1), (1, 1), (1, 1)])
+    slot = np.arange(density)
+    p_valid = slot < n_points[..., None]
+
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                window = (
+                    slice(None),
+                    slice(1 + dx, 1 + dx + block_side),
+                    slice(1 + dy, 1 + dy + block_side),
+                    slice(1 + dz, 1 + dz + block_side),
+                )
+                q = pos_pad[window]
+                q_valid = slot < n_pad[window][..., None]
+                delta = pos[..., :, None, :] - q[..., None, :, :]
+                # a point never interacts with itself (or an exact duplicate)
+                mask = (
+                    p_valid[..., :, None]
+                    & q_valid[..., None, :]
+                    & np.any(delta != 0, axis=-1)
+                )
+                total += _lennard_jones(delta, lj1, lj2, mask).sum(axis=-2)
+
+    if structured:
+        total = unstructured_to_structured(total, dtype=position.dtype)
+    return {"force": total}
+
+
+def fft_strided(
+    real: np.ndarray, img: np.ndarray, real_twid: np.ndarray, img_twid: np.ndarray
+) -> dict[str, np.ndarray]:
+    real = real.astype(np.float64)
+    img = img.astype(np.float64)
+    n = real.shape[-1]
+    index = np.arange(n)
+    span = n >> 1
+    log = 0
+    # the butterflies of one span are independent of each other
+    while span:
+        odd = index[(index & span) != 0]
+        even = odd ^ span
+        re, ro = real[:, even], real[:, odd]
+        ie, io = img[:, even], img[:, odd]
+        real[:, even] = re + ro
+        img[:, even] = ie + io
+        ro = re - ro
+        io = ie - io
+
+        rootindex = (even << log) & (n - 1)
+        twiddled = rootindex != 0
+        rt = real_twid[:, rootindex]
+        it = img_twid[:, rootindex]
+        real[:, odd] = np.where(twiddled, rt * ro - it * io, ro)
+        img[:, odd] = np.where(twiddled, rt * io + it * ro, io)
+        span >>= 1
+        log += 1
+    return {"real": real, "img": img}
+
+
+def fft_transpose(work_x: np.ndarray, work_y: np.ndarray) -> dict[str, np.ndarray]:
+    # fft1D_512 is a plain DFT in natural order; its PI is truncated and its
+    # M_SQRT1_2 is a float literal, so it only agrees with this to ~1e-8
+    spectrum = np.fft.fft(work_x + 1j * work_y, axis=-1)
+    return {"work_x": spectrum.real.copy(), "work_y": spectrum.imag.copy()}
+
+
+def sort_merge(a: np.ndarray) -> dict[str, np.ndarray]:
+    return {"a": np.sort(a, axis=-1)}
+
+
+def sort_radix(a: np.ndarray) -> dict[str, np.ndarray]:
+    # the digits are taken from the raw bits, so negative numbers sort after
+    # the positive ones like unsigned integers
+    unsigned = a.astype(np.int32).view(np.uint32)
+    return {"a": np.sort(unsigned, axis=-1, kind="stable").view(np.int32)}
+
+
+def needwun(
+    SEQA: np.ndarray,
+    SEQB: np.ndarray,
+    match: int = 1,
+    mismatch: int = -1,
+    gap: int = -1,
+) -> dict[str, np.ndarray]:
+    batch, alen = SEQA.shape
+    blen = SEQB.shape[1]
+    align, skip_a, skip_b = ord("\\"), ord("^"), ord("<")
+
+    M = np.zeros((batch, blen + 1, alen + 1), dtype=np.int32)
+    M[:, 0, :] = np.arange(alen + 1) * gap
+    M[:, :, 0] = np.arange(blen + 1)[None, :] * gap
+    # the C traceback walks off the first row through an unset ptr entry,
+    # give the borders their natural direction instead
+    ptr = np.zeros((batch, blen + 1, alen + 1), dtype=np.int8)
+    ptr[:, 0, 1:] = skip_b
+    ptr[:, 1:, 0] = skip_a
+
+    # fill one anti diagonal at a time, every cell on it only depends on the
+    # two diagonals before
+    for d in range(2, alen + blen + 1):
+        b_idx = np.arange(max(1, d - alen), min(blen, d - 1) + 1)
+        a_idx = d - b_idx
+        score = np.where(SEQA[:, a_idx - 1] == SEQB[:, b_idx - 1], match, mismatch)
+        up_left = M[:, b_idx - 1, a_idx - 1] + score
+        up = M[:, b_idx - 1, a_idx] + gap
+        left = M[:, b_idx, a_idx - 1] + gap
+        best = np.maximum(up_left, np.maximum(up, left))
+        M[:, b_idx, a_idx] = best
+        ptr[:, b_idx, a_idx] = np.where(
+            best == left, skip_b, np.where(best == up, skip_a, align)
+        )
+
+    alignedA = np.full((batch, alen + blen), ord("_"), dtype=np.int8)
+    alignedB = np.full((batch, alen + blen), ord("_"), dtype=np.int8)
+    rows = np.arange(batch)
+    a_pos = np.full(batch, alen)
+    b_pos = np.full(batch, blen)
+    for step in range(alen + blen):
+        active = (a_pos > 0) | (b_pos > 0)
+        if not active.any():
+            break
+        direction = ptr[rows, b_pos, a_pos]
+        take_a = active & (direction != skip_a)
+        take_b = active & (direction != skip_b)
+        alignedA[active, step] = np.where(take_a, SEQA[rows, a_pos - 1], ord("-"))[
+            active
+        ]
+        alignedB[active, step] = np.where(take_b, SEQB[rows, b_pos - 1], ord("-"))[
+            active
+        ]
+        a_pos = a_pos - take_a
+        b_pos = b_pos - take_b
+    return {
+        "alignedA": alignedA,
+        "alignedB": alignedB,
+        "M": M.reshape(batch, -1),
+    }
+
+
+def viterbi(
+    obs: np.ndarray, init: np.ndarray, transition: np.ndarray, emission: np.ndarray
+) -> dict[str, np.ndarray]:
+    # all probabilities are -log(p), the most likely path has the minimum sum
+    batch, n_obs = obs.shape
+    n_states = init.shape[1]
+    transition = transition.reshape(batch, n_states, n_states)
+    emission = emission.reshape(batch, n_states, -1)
+    rows = np.arange(batch)
+
+    llike = np.empty((batch, n_obs, n_states))
+    llike[:, 0] = init + emission[rows, :, obs[:, 0]]
+    for t in range(1, n_obs):
+        step = llike[:, t - 1, :, None] + transition
+        llike[:, t] = step.min(axis=1) + emission[rows, :, obs[:, t]]
+
+    # argmin keeps the first minimum like the strict < in the C loops
+    path = np.empty((batch, n_obs), dtype=np.uint8)
+    path[:, -1] = np.argmin(llike[:, -1], axis=1)
+    for t in range(n_obs - 2, -1, -1):
+        step = llike[:, t] + transition[rows, :, path[:, t + 1]]
+        path[:, t] = np.argmin(step, axis=1)
+    return {"path": path}
+
+
+def _bfs(
+    nodes: np.ndarray,
+    edges: np.ndarray,
+    starting_node: np.ndarray,
+    n_levels: int,
+    max_level: int,
+    max_horizon: int,
+) -> dict[str, np.ndarray]:
+    begin = nodes["edge_begin"].astype(np.int64)
+    end = nodes["edge_end"].astype(np.int64)
+    dst = edges["dst"].astype(np.int64)
+    batch, n_nodes = begin.shape
+
+    # flatten every (graph, node, edge) triple once
+    counts = np.maximum(end - begin, 0).ravel()
+    first = np.cumsum(counts) - counts
+    edge_batch = np.repeat(np.arange(batch).repeat(n_nodes), counts)
+    edge_src = np.repeat(np.tile(np.arange(n_nodes), batch), counts)
+    edge_idx = np.arange(counts.sum()) - np.repeat(first, counts)
+    edge_idx += np.repeat(begin.ravel(), counts)
+    edge_dst = dst[edge_batch, edge_idx]
+
+    level = np.full((batch, n_nodes), max_level, dtype=np.int8)
+    level[np.arange(batch), starting_node.astype(np.int64).ravel()] = 0
+    level_counts = np.zeros((batch, n_levels), dtype=np.uint64)
+    level_counts[:, 0] = 1
+    for horizon in range(max_horizon):
+        frontier = level[edge_batch, edge_src] == horizon
+        b, target = edge_batch[frontier], edge_dst[frontier]
+        unmarked = level[b, target] == max_level
+        if not unmarked.any():
+            break
+        level[b[unmarked], target[unmarked]] = horizon + 1
+        if horizon + 1 < n_levels:
+            level_counts[:, horizon + 1] = np.sum(level == horizon + 1, axis=1)
+    return {"level": level, "level_counts": level_counts}
+
+
+def bfs_bulk(
+    nodes: np.ndarray,
+    edges: np.ndarray,
+    starting_node: np.ndarray,
+    *,
+    N_LEVELS: int = 10,
+    MAX_LEVEL: int = 127,
+) -> dict[str, np.ndarray]:
+    # the bulk kernel stops expanding after N_LEVELS horizons
+    return _bfs(nodes, edges, starting_node, N_LEVELS, MAX_LEVEL, N_LEVELS)
+
+
+def bfs_queue(
+    nodes: np.ndarray,
+    edges: np.ndarray,
+    starting_node: np.ndarray,
+    *,
+    N_LEVELS: int = 10,
+    MAX_LEVEL: int = 127,
+) -> dict[str, np.ndarray]:
+    # the queue kernel drains the whole component
+    return _bfs(nodes, edges, starting_node, N_LEVELS, MAX_LEVEL, MAX_LEVEL - 1)
+
+
+def kmp(pattern: np.ndarray, input: np.ndarray) -> dict[str, np.ndarray]:
+    batch, pattern_size = pattern.shape
+    rows = np.arange(batch)
+
+    # CPF, including its k = kmpNext[q] fallback which reads the not yet
+    # written (zeroed) entry
+    kmp_next = np.zeros((batch, pattern_size), dtype=np.int32)
+    k = np.zeros(batch, dtype=np.int32)
+    for q in range(1, pattern_size):
+        k = np.where((k > 0) & (pattern[rows, k] != pattern[:, q]), 0, k)
+        k = k + (pattern[rows, k] == pattern[:, q])
+        kmp_next[:, q] = k
+
+    # with an all zero table every mismatch restarts at the first character,
+    # so the kernel counts each overlapping occurrence
+    windows = np.lib.stride_tricks.sliding_window_view(input, pattern_size, axis=1)
+    n_matches = np.all(windows == pattern[:, None, :], axis=2).sum(axis=1)
+
+    # other patterns need the kernel's own state machine, which falls back to
+    # kmpNext[q] rather than kmpNext[q - 1]
+    scan = np.flatnonzero(np.any(kmp_next != 0, axis=1))
+    if len(scan):
+        p, text, table = pattern[scan], input[scan], kmp_next[scan]
+        sub = np.arange(len(scan))
+        q = np.zeros(len(scan), dtype=np.int32)
+        matches = np.zeros(len(scan), dtype=np.int64)
+        for i in range(text.shape[1]):
+            c = text[:, i]
+            while True:
+                back = (q > 0) & (p[sub, q] != c)
+                if not back.any():
+                    break
+                fallback = table[sub, q]
+                if np.any(back & (fallback == q)):
+                    raise ValueError("kmp never terminates for this pattern")
+                q = np.where(back, fallback, q)
+            q = q + (p[sub, q] == c)
+            full = q >= pattern_size
+            matches += full
+            q = np.where(full, table[sub, np.minimum(q, pattern_size) - 1], q)
+        n_matches[scan] = matches
+
+    return {
+        "kmpNext": kmp_next,
+        "n_matches": n_matches.astype(np.int32)[:, None],
+    }
+
+
+def _make_aes_sbox() -> np.ndarray:
+    # multiplicative inverse in GF(2^8) through log tables of generator 3,
+    # followed by the affine transform
+    exp = [0] * 255
+    log = [0] * 256
+    atb = 1
+    for i in range(255):
+        exp[i] = atb
+        log[atb] = i
+        atb ^= ((atb << 1) ^ (0x1B if atb & 0x80 else 0)) & 0xFF
+    sbox = np.zeros(256, dtype=np.uint8)
+    for x in range(256):
+        y = exp[(255 - log[x]) % 255] if x else 0
+        sb = y
+        for _ in range(4):
+            y = ((y << 1) | (y >> 7)) & 0xFF
+            sb ^= y
+        sbox[x] = sb ^ 0x63
+    return sbox
+
+
+AES_SBOX = _make_aes_sbox()
+AES_SHIFT_ROWS = np.array([0, 5, 10, 15, 4, 9, 14, 3, 8, 13, 2, 7, 12, 1, 6, 11])
+
+
+def _aes_xtime(x: np.ndarray) -> np.ndarray:
+    return (x << 1) ^ (((x >> 7) & 1) * np.uint8(0x1B))
+
+
+def _aes_mix_columns(buf: np.ndarray) -> np.ndarray:
+    columns = buf.reshape(-1, 4, 4)
+    a, b, c, d = (columns[:, :, i] for i in range(4))
+    e = a ^ b ^ c ^ d
+    mixed = np.stack(
+        [
+            a ^ e ^ _aes_xtime(a ^ b),
+            b ^ e ^ _aes_xtime(b ^ c),
+            c ^ e ^ _aes_xtime(c ^ d),
+            d ^ e ^ _aes_xtime(d ^ a),
+        ],
+        axis=2,
+    )
+    return mixed.reshape(-1, 16)
+
+
+def _aes_expand_key(key: np.ndarray, rcon: int) -> int:
+    key[:, 0:4] ^= AES_SBOX[key[:, [29, 30, 31, 28]]]
+    key[:, 0] ^= np.uint8(rcon)
+    for i in range(4, 16, 4):
+        key[:, i : i + 4] ^= key[:, i - 4 : i]
+    key[:, 16:20] ^= AES_SBOX[key[:, 12:16]]
+    for i in range(20, 32, 4):
+        key[:, i : i + 4] ^= key[:, i - 4 : i]
+    return ((rcon << 1) ^ (0x1B if rcon & 0x80 else 0)) & 0xFF
+
+
+def aes_aes(k: np.ndarray, buf: np.ndarray) -> dict[str, np.ndarray]:
+    # AES-256 ECB on one 16 byte block per batch entry, with the key schedule
+    # expanded on the fly like aes256_encrypt_ecb
+    key = k.astype(np.uint8)
+    state = buf.astype(np.uint8) ^ key[:, :16]
+    rcon = 1
+    for i in range(1, 14):
+        state = AES_SBOX[state][:, AES_SHIFT_ROWS]
+        state = _aes_mix_columns(state)
+        if i & 1:
+            state ^= key[:, 16:]
+        else:
+            rcon = _aes_expand_key(key, rcon)
+            state ^= key[:, :16]
+    state = AES_SBOX[state][:, AES_SHIFT_ROWS]
+    _aes_expand_key(key, rcon)
+    return {"buf": state ^ key[:, :16]}
+
+
+REFERENCE_MODELS: dict[str, Callable[..., dict[str, np.ndarray]]] = {
+    "aes_aes": aes_aes,
+    "bfs_bulk": bfs_bulk,
+    "bfs_queue": bfs_queue,
+    "fft_strided": fft_strided,
+    "fft_transpose": fft_transpose,
+    "gemm_blocked": gemm_blocked,
+    "gemm_ncubed": gemm_ncubed,
+    "kmp_kmp": kmp,
+    "md_grid": md_grid,
+    "md_knn": md_knn,
+    "nw_nw": needwun,
+    "sort_merge": sort_merge,
+    "sort_radix": sort_radix,
+    "spmv_crs": spmv_crs,
+    "spmv_ellpack": spmv_ellpack,
+    "stencil_stencil2d": stencil_stencil2d,
+    "stencil_stencil3d": stencil_stencil3d,
+    "viterbi_viterbi": viterbi,
+}
+
+
+def run_reference(
+    benchmark: Benchmark, inputs: dict[str, Any], batched: bool = True
+) -> dict[str, np.ndarray]:
+    # scaled variants share the model of the kernel they were derived from
+    model = REFERENCE_MODELS[benchmark.record.get("variant_of", benchmark.name)]
+    params = inspect.signature(model).parameters
+    kwargs: dict[str, Any] = {}
+    for name, param in params.items():
+        if param.kind == inspect.Parameter.KEYWORD_ONLY:
+            if name in benchmark.defines:
+                kwargs[name] = benchmark.defines[name]
+        elif name in inputs:
+            value = np.asarray(inputs[name])
+            kwargs[name] = value if batched else value[None, ...]
+    outputs = model(**kwargs)
+    if not batched:
+        outputs = {name: value[0] for name, value in outputs.items()}
+    return outputs
+
+
+def compare_outputs(
+    outputs: dict[str, np.ndarray],
+    expected: dict[str, Any],
+    rtol: float = 1e-6,
+    atol: float = 1e-6,
+) -> dict[str, bool]:
+    results = {}
+    for name, want in expected.items():
+        if name not in outputs:
+            continue
+        got = outputs[name]
+        want = np.asarray(want)
+        if want.dtype.names is not None:
+            got = structured_to_unstructured(got)
+            want = structured_to_unstructured(want)
+        if want.dtype.kind == "f":
+            results[name] = bool(np.allclose(got, want, rtol=rtol, atol=atol))
+        else:
+            results[name] = bool(np.array_equal(got, want))
+    return results
+
+
+def main(args):
+    benchmarks = load_benchmarks(args.benchmarks_directory)
+    for benchmark in benchmarks.values():
+        if not benchmark.record.get("test_vectors"):
+            print(f"reference - {benchmark.name} - no test vectors, skipping")
+            continue
+        inputs = benchmark.test_vectors("input")
+        expected = benchmark.test_vectors("check")
+        batch = {
+            name: np.broadcast_to(value, (args.batch_size,) + value.shape)
+            for name, value in inputs.items()
+        }
+        t0 = time.perf_counter()
+        outputs = run_reference(benchmark, batch)
+        elapsed = time.perf_counter() - t0
+        results = compare_outputs({n: v[0] for n, v in outputs.items()}, expected)
+        status = "ok" if all(results.values()) else "MISMATCH"
+        print(
+            f"reference - {benchmark.name} - {status} {results} - "
+            f"{args.batch_size} vectors in {elapsed:.3f} s"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "benchmarks_directory", type=Path, nargs="?", default=Path("./hls-machsuite/")
+    )
+    parser.add_argument("-n", "--batch-size", type=int, default=1)
+    args = parser.parse_args()
+    main(args)
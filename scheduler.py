@@ -0,0 +1,369 @@
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import resource
+import time
+import traceback
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+JOB_HISTORY_FP = Path("./job_history.json")
+GiB = 1024**3
+# estimates are padded so that a run slightly bigger than the last one fits
+MEMORY_MARGIN = 1.25
+
+
+def available_memory() -> int | None:
+    try:
+        meminfo = Path("/proc/meminfo").read_text()
+    except OSError:
+        return None
+    for line in meminfo.splitlines():
+        if line.startswith("MemAvailable:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+class JobHistory:
+    # duration (moving average) and peak RSS (max seen) of previous runs, keyed
+    # by job name like "synth:gemm_ncubed"
+
+    def __init__(self, fp: Path = JOB_HISTORY_FP):
+        self.fp = fp
+        self.entries: dict[str, dict[str, float]] = {}
+        if fp.exists():
+            self.entries = json.loads(fp.read_text())
+
+    def duration(self, name: str) -> float | None:
+        entry = self.entries.get(name)
+        return None if entry is None else entry["duration"]
+
+    def peak_rss(self, name: str) -> int | None:
+        entry = self.entries.get(name)
+        return None if entry is None else int(entry["peak_rss"])
+
+    def update(self, name: str, duration: float, peak_rss: int) -> None:
+        entry = self.entries.get(name)
+        if entry is None:
+            self.entries[name] = {"duration": duration, "peak_rss": peak_rss, "runs": 1}
+            return
+        entry["duration"] = 0.5 * entry["duration"] + 0.5 * duration
+        entry["peak_rss"] = max(entry["peak_rss"], peak_rss)
+        entry["runs"] += 1
+
+    def save(self) -> None:
+        tmp_fp = self.fp.with_suffix(".tmp")
+        tmp_fp.write_text(json.dumps(self.entries, indent=1, sort_keys=True))
+        os.replace(tmp_fp, self.fp)
+
+
+@dataclass
+class Job:
+    name: str
+    fn: Callable[..., Any]
+    args: tuple = ()
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    uses_license: bool = False
+    # used until the job has a recorded peak RSS
+    default_memory: int = GiB
+    # stages have their own concurrency limit, deps are names of jobs that
+    # have to finish successfully first
+    stage: str | None = None
+    deps: tuple[str, ...] = ()
+    # files or directories the job leaves behind, a resumed run only trusts a
+    # journaled result while they still exist
+    artifacts: tuple[Path, ...] = ()
+    # hash of the sources and tools the job reads, a resumed run redoes the
+    # job when it differs from the journaled one
+    input_hash: str | None = None
+
+
+class JobFailed(Exception): ...
+
+
+class JobUnschedulable(ValueError): ...
+
+
+@dataclass
+class SchedulerStats:
+    max_workers: int
+    memory_budget: int | None
+    max_licenses: int | None
+    queued: int = 0
+    running: int = 0
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    peak_running: int = 0
+    peak_licenses: int = 0
+    peak_memory_reserved: int = 0
+    blocked_on_memory: int = 0
+    blocked_on_licenses: int = 0
+    busy_seconds: float = 0.0
+    wait_seconds: float = 0.0
+    wall_seconds: float = 0.0
+
+    @property
+    def utilization(self) -> float:
+        if self.wall_seconds == 0:
+            return 0.0
+        return self.busy_seconds / (self.wall_seconds * self.max_workers)
+
+    def summary(self) -> str:
+        finished = self.completed + self.failed
+        mean_wait = self.wait_seconds / finished if finished else 0.0
+        memory = (
+            f"{self.peak_memory_reserved / GiB:.1f}/{self.memory_budget / GiB:.1f} GiB"
+            if self.memory_budget is not None
+            else "unbounded"
+        )
+        return (
+            f"{self.completed} done, {self.failed} failed, {self.cancelled} cancelled "
+            f"in {self.wall_seconds:.1f}s, "
+            f"utilization {self.utilization:.0%}, peak {self.peak_running} running, "
+            f"peak memory reserved {memory}, mean queue wait {mean_wait:.1f}s, "
+            f"{self.blocked_on_memory} jobs held back on memory, "
+            f"{self.blocked_on_licenses} on licenses"
+        )
+
+
+def _run_job(job: Job, conn: multiprocessing.connection.Connection) -> None:
+    start = time.perf_counter()
+    try:
+        result = (True, job.fn(*job.args, **job.kwargs))
+    except Exception as e:
+        result = (False, f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+    # ru_maxrss is in KiB on linux; vitis_hls and the compilers are children
+    # of the job process so they show up under RUSAGE_CHILDREN
+    peak_rss = 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    conn.send((*result, time.perf_counter() - start, peak_rss))
+    conn.close()
+
+
+@dataclass
+class _Running:
+    job: Job
+    index: int
+    process: multiprocessing.process.BaseProcess
+    conn: multiprocessing.connection.Connection
+    memory: int
+    start: float
+
+
+class ResourceScheduler:
+    # Runs every job in its own forked process so peak RSS can be measured per
+    # job. A job is only started once its deps are done, its stage is below its
+    # limit, its memory estimate fits next to the estimates of the running jobs
+    # and a license is free. The queue is ordered by the longest recorded chain
+    # of work hanging off each job, jobs never seen before count as the longest
+    # known job so they get measured early. When the head of the queue does not
+    # fit, smaller jobs behind it are started instead. A failed job cancels
+    # everything downstream of it and nothing else.
+
+    def __init__(
+        self,
+        max_workers: int,
+        memory_budget: int | None = None,
+        max_licenses: int | None = None,
+        history: JobHistory | None = None,
+        stage_limits: dict[str, int] | None = None,
+    ):
+        if memory_budget is None:
+            memory_budget = available_memory()
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+        self.max_licenses = max_licenses
+        self.history = history if history is not None else JobHistory()
+        self.stage_limits = stage_limits or {}
+        self.status: dict[str, str] = {}
+        self.errors: dict[str, str] = {}
+        self.context = multiprocessing.get_context("fork")
+        self.stats = SchedulerStats(max_workers, memory_budget, max_licenses)
+
+    def memory_estimate(self, job: Job) -> int:
+        peak_rss = self.history.peak_rss(job.name)
+        if peak_rss is None:
+            return job.default_memory
+        return int(peak_rss * MEMORY_MARGIN)
+
+    def check_schedulable(self, job: Job) -> None:
+        # a limit below one would hold the job back forever; a job over the
+        # memory budget is not a problem, it runs alone
+        if self.max_workers < 1:
+            raise JobUnschedulable(
+                f"{job.name} can never start, max_workers is {self.max_workers}"
+            )
+        if job.uses_license and self.max_licenses is not None:
+            if self.max_licenses < 1:
+                raise JobUnschedulable(
+                    f"{job.name} needs a license, max_licenses is {self.max_licenses}"
+                )
+        stage_limit = self.stage_limits.get(job.stage) if job.stage else None
+        if stage_limit is not None and stage_limit < 1:
+            raise JobUnschedulable(
+                f"{job.name} can never start, the limit of stage "
+                f"{job.stage!r} is {stage_limit}"
+            )
+
+    def order(self, jobs: list[Job]) -> list[int]:
+        durations = [self.history.duration(job.name) for job in jobs]
+        longest = max((d for d in durations if d is not None), default=0.0)
+        children: dict[str, list[int]] = {}
+        for i, job in enumerate(jobs):
+            for dep in job.deps:
+                children.setdefault(dep, []).append(i)
+
+        rank: dict[int, float] = {}
+
+        def chain(i: int) -> float:
+            if i not in rank:
+                own = durations[i] if durations[i] is not None else longest
+                rank[i] = own + max(
+                    (chain(c) for c in children.get(jobs[i].name, [])), default=0.0
+                )
+            return rank[i]
+
+        return sorted(range(len(jobs)), key=lambda i: -chain(i))
+
+    def run(
+        self,
+        jobs: list[Job],
+        raise_on_error: bool = True,
+        on_start: Callable[[Job], None] | None = None,
+        on_finish: Callable[[Job, bool, Any], None] | None = None,
+    ) -> list[Any]:
+        stats = self.stats = SchedulerStats(
+            self.max_workers, self.memory_budget, self.max_licenses
+        )
+        names = {job.name for job in jobs}
+        if len(names) != len(jobs):
+            raise ValueError("Job names must be unique")
+        for job in jobs:
+            if set(job.deps) - names:
+                raise ValueError(f"{job.name} depends on unknown jobs")
+            self.check_schedulable(job)
+        self.status = {job.name: "pending" for job in jobs}
+        self.errors = {}
+        pending = self.order(jobs)
+        results: list[Any] = [None] * len(jobs)
+        # jobs that had to wait at least once because of each limit
+        held_on_memory: set[int] = set()
+        held_on_licenses: set[int] = set()
+        running: list[_Running] = []
+        start = time.perf_counter()
+        stats.queued = len(pending)
+
+        while pending or running:
+            # admit as many queued jobs as the limits allow
+            reserved = sum(r.memory for r in running)
+            licenses = sum(r.job.uses_license for r in running)
+            stage_running: dict[str | None, int] = {}
+            for r in running:
+                stage_running[r.job.stage] = stage_running.get(r.job.stage, 0) + 1
+            for index in list(pending):
+                if len(running) >= self.max_workers:
+                    break
+                job = jobs[index]
+                dep_status = [self.status[dep] for dep in job.deps]
+                if any(status in ("failed", "cancelled") for status in dep_status):
+                    self.status[job.name] = "cancelled"
+                    stats.cancelled += 1
+                    pending.remove(index)
+                    print(f"[scheduler] {job.name}: cancelled, upstream failed")
+                    continue
+                if any(status != "done" for status in dep_status):
+                    continue
+                stage_limit = self.stage_limits.get(job.stage) if job.stage else None
+                if (
+                    stage_limit is not None
+                    and stage_running.get(job.stage, 0) >= stage_limit
+                ):
+                    continue
+                memory = self.memory_estimate(job)
+                if job.uses_license and self.max_licenses is not None:
+                    if licenses >= self.max_licenses:
+                        held_on_licenses.add(index)
+                        continue
+                # a job that is too big for the budget on its own still runs,
+                # alone
+                if (
+                    self.memory_budget is not None
+                    and running
+                    and reserved + memory > self.memory_budget
+                ):
+                    held_on_memory.add(index)
+                    continue
+                recv_conn, send_conn = self.context.Pipe(duplex=False)
+                process = self.context.Process(target=_run_job, args=(job, send_conn))
+                if on_start is not None:
+                    on_start(job)
+                process.start()
+                send_conn.close()
+                now = time.perf_counter()
+                running.append(_Running(job, index, process, recv_conn, memory, now))
+                stats.wait_seconds += now - start
+                pending.remove(index)
+                self.status[job.name] = "running"
+                reserved += memory
+                licenses += job.uses_license
+                stage_running[job.stage] = stage_running.get(job.stage, 0) + 1
+            stats.queued = len(pending)
+            stats.running = len(running)
+            stats.blocked_on_memory = len(held_on_memory)
+            stats.blocked_on_licenses = len(held_on_licenses)
+            stats.peak_running = max(stats.peak_running, len(running))
+            stats.peak_licenses = max(stats.peak_licenses, licenses)
+            stats.peak_memory_reserved = max(stats.peak_memory_reserved, reserved)
+
+            if not running:
+                if pending and not any(
+                    self.status[dep] in ("failed", "cancelled")
+                    for index in pending
+                    for dep in jobs[index].deps
+                ):
+                    raise ValueError("Dependency cycle between queued jobs")
+                continue
+            ready = multiprocessing.connection.wait([r.conn for r in running])
+            for r in [r for r in running if r.conn in ready]:
+                running.remove(r)
+                duration = time.perf_counter() - r.start
+                try:
+                    ok, value, duration, peak_rss = r.conn.recv()
+                except EOFError:
+                    # killed before it could report back, e.g. by the OOM killer
+                    ok, value, peak_rss = False, "process died", None
+                r.conn.close()
+                r.process.join()
+                if r.process.exitcode not in (0, None) and ok:
+                    ok, value = False, f"exit code {r.process.exitcode}"
+                stats.busy_seconds += duration
+                if ok:
+                    results[r.index] = value
+                    self.status[r.job.name] = "done"
+                    stats.completed += 1
+                    self.history.update(r.job.name, duration, peak_rss)
+                else:
+                    self.status[r.job.name] = "failed"
+                    self.errors[r.job.name] = value
+                    stats.failed += 1
+                if on_finish is not None:
+                    on_finish(r.job, ok, value)
+                print(
+                    f"[scheduler] {r.job.name}: {'done' if ok else 'failed'} in "
+                    f"{duration:.1f}s, {len(pending)} queued, {len(running)} running"
+                )
+            stats.wall_seconds = time.perf_counter() - start
+
+        stats.running = 0
+        stats.wall_seconds = time.perf_counter() - start
+        self.history.save()
+        if self.errors and raise_on_error:
+            raise JobFailed(
+                "\n".join(f"{name}: {error}" for name, error in self.errors.items())
+            )
+        return results
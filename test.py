@@ -1,22 +1,148 @@
 import argparse
+import functools
+import hashlib
+import json
+import os
 import shutil
 import subprocess
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
 
-import joblib
+from benchmarks import load_benchmarks
+from hls_worker import VitisHLSWorkerPool
+from journal import (
+    JOURNAL_FP,
+    RunJournal,
+    hash_job_inputs,
+    resume_jobs,
+    run_with_journal,
+)
+from profiling import TRACE_DIR, span, tracing
+from qor import QOR_DB_FP, QoRStore, config_id, format_qor_table, parse_report_dir
+from scheduler import JOB_HISTORY_FP, GiB, Job, JobHistory, ResourceScheduler
+from tool_runner import VITIS_HLS_PHASES, ToolResult, run_tool
+
+HLS_CACHE_DIR = Path("./hls_cache")
+HLS_PART = "xc7z020clg484-1"
+HLS_CLOCK_PERIOD = 10
+HLS_CACHE_REPORT_GLOBS = ["*.rpt", "*.xml"]
+
+
+def hls_synth_cache_key(
+    build_tcl_txt: str, benchmark_directory: Path, tool_version: str
+) -> str:
+    h = hashlib.sha256()
+    h.update(tool_version.encode())
+    h.update(b"\0build.tcl\0")
+    h.update(build_tcl_txt.encode())
+    benchmark_name = benchmark_directory.stem
+    source_files = [
+        benchmark_directory / f"{benchmark_name}.cpp",
+        benchmark_directory / f"{benchmark_name}.h",
+    ] + sorted(benchmark_directory.glob("*_dir.tcl"))
+    for fp in source_files:
+        h.update(f"\0{fp.name}\0".encode())
+        h.update(fp.read_bytes())
+    return h.hexdigest()
+
+
+def hls_synth_cache_entry_dir(cache_dir: Path, key: str) -> Path:
+    return cache_dir / key[:2] / key
+
+
+def hls_synth_cache_load(cache_dir: Path, key: str, report_dir: Path) -> bool:
+    entry_dir = hls_synth_cache_entry_dir(cache_dir, key)
+    if not (entry_dir / "csynth.rpt").exists():
+        return False
+    report_dir.mkdir(parents=True, exist_ok=True)
+    for file in entry_dir.glob("*"):
+        if file.name == "meta.json":
+            continue
+        shutil.copy(file, report_dir)
+    # touch the entry so age based eviction behaves like LRU
+    os.utime(entry_dir)
+    return True
+
+
+def hls_synth_cache_store(
+    cache_dir: Path, key: str, report_dir: Path, benchmark_name: str
+) -> None:
+    entry_dir = hls_synth_cache_entry_dir(cache_dir, key)
+    # write into a sibling temp dir and rename so that concurrent workers never
+    # observe a partially written entry
+    entry_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging_dir = Path(tempfile.mkdtemp(dir=entry_dir.parent, prefix=".tmp_"))
+    for pattern in HLS_CACHE_REPORT_GLOBS:
+        for file in report_dir.glob(pattern):
+            shutil.copy(file, staging_dir)
+    meta = {"benchmark": benchmark_name, "key": key, "created": time.time()}
+    (staging_dir / "meta.json").write_text(json.dumps(meta, indent=2))
+    try:
+        os.rename(staging_dir, entry_dir)
+    except OSError:
+        # another worker stored the same key first
+        shutil.rmtree(staging_dir)
+
+
+def evict_hls_synth_cache(
+    cache_dir: Path,
+    max_size_bytes: int | None = None,
+    max_age_seconds: float | None = None,
+) -> list[Path]:
+    if not cache_dir.exists():
+        return []
+
+    entries = []
+    for entry_dir in cache_dir.glob("*/*"):
+        if not entry_dir.is_dir() or entry_dir.name.startswith(".tmp_"):
+            continue
+        size = sum(f.stat().st_size for f in entry_dir.glob("*"))
+        entries.append((entry_dir.stat().st_mtime, size, entry_dir))
+    # oldest first
+    entries.sort()
+
+    evicted = []
+    now = time.time()
+    if max_age_seconds is not None:
+        for mtime, size, entry_dir in list(entries):
+            if now - mtime > max_age_seconds:
+                shutil.rmtree(entry_dir)
+                evicted.append(entry_dir)
+                entries.remove((mtime, size, entry_dir))
+    if max_size_bytes is not None:
+        total_size = sum(size for _, size, _ in entries)
+        for mtime, size, entry_dir in entries:
+            if total_size <= max_size_bytes:
+                break
+            shutil.rmtree(entry_dir)
+            evicted.append(entry_dir)
+            total_size -= size
+    return evicted
 
 
 def hls_synth_benchmark(
-    benchmark_directory: Path, temp_dir_overide: Path | None = None
+    benchmark_directory: Path,
+    temp_dir_overide: Path | None = None,
+    cache_dir: Path | None = None,
+    worker_pool: VitisHLSWorkerPool | None = None,
+    directives: str | None = None,
+    run_name: str | None = None,
+    timeout: float | None = None,
+    memory_limit: int | None = None,
+    toolchain: "VitisHLSToolchain | None" = None,
 ) -> int:
     benchmark_name = benchmark_directory.stem
 
+    # several directive configurations of one kernel may run side by side, each
+    # gets its own run directory
     if temp_dir_overide is None:
         temp_dir = tempfile.TemporaryDirectory()
         temp_dir_path = Path(temp_dir.name)
     else:
-        temp_dir_path = temp_dir_overide / benchmark_name
+        temp_dir_path = temp_dir_overide / (run_name or benchmark_name)
         temp_dir_path.mkdir(exist_ok=True, parents=True)
 
     benchmark_name = benchmark_directory.stem
@@ -25,50 +151,328 @@ def hls_synth_benchmark(
     top_fn_fp = benchmark_directory / "top.txt"
     top_fn = top_fn_fp.read_text().strip()
 
-    all_files = list(benchmark_directory.glob("*"))
-    for file in all_files:
-        shutil.copy(file, temp_dir_path)
+    with span("copy_sources", "synth", kernel=benchmark_name):
+        all_files = list(benchmark_directory.glob("*"))
+        for file in all_files:
+            shutil.copy(file, temp_dir_path)
 
     print(f"Running HLS Synthesis : {benchmark_name} : {temp_dir_path}")
 
-    tcl_script = temp_dir_path / "build.tcl"
-    tcl_script_txt = ""
-    tcl_script_txt += f"open_project -reset test_proj_{benchmark_name}\n"
-    tcl_script_txt += f"add_files {(benchmark_name + '.cpp')}\n"
-    tcl_script_txt += f"add_files {(benchmark_name + '.h')}\n"
-    # tcl_script_txt += f"add_files {(benchmark_name + '_tb.cpp')} -tb\n"
-    tcl_script_txt += "open_solution solution1\n"
-    tcl_script_txt += f"set_top {top_fn}\n"
-    tcl_script_txt += "set_part {xc7z020clg484-1}\n"
-    tcl_script_txt += "create_clock -period 10 -name default\n"
-    tcl_script_txt += "csynth_design\n"
-    tcl_script_txt += "exit\n"
-    tcl_script.write_text(tcl_script_txt)
+    with span("generate_tcl", "synth", kernel=benchmark_name):
+        tcl_script = temp_dir_path / "build.tcl"
+        tcl_script_txt = ""
+        tcl_script_txt += f"open_project -reset test_proj_{benchmark_name}\n"
+        tcl_script_txt += f"add_files {(benchmark_name + '.cpp')}\n"
+        tcl_script_txt += f"add_files {(benchmark_name + '.h')}\n"
+        # tcl_script_txt += f"add_files {(benchmark_name + '_tb.cpp')} -tb\n"
+        tcl_script_txt += "open_solution solution1\n"
+        tcl_script_txt += f"set_top {top_fn}\n"
+        tcl_script_txt += f"set_part {{{HLS_PART}}}\n"
+        tcl_script_txt += f"create_clock -period {HLS_CLOCK_PERIOD} -name default\n"
+        if directives is not None:
+            tcl_script_txt += directives.strip() + "\n"
+        tcl_script_txt += "csynth_design\n"
+        tcl_script_txt += "exit\n"
+        tcl_script.write_text(tcl_script_txt)
+
+    report_dir = (
+        temp_dir_path / f"test_proj_{benchmark_name}" / "solution1" / "syn" / "report"
+    )
 
-    p = subprocess.run(
-        ["vitis_hls", "-f", tcl_script.resolve()],
-        cwd=temp_dir_path,
-        text=True,
+    cache_key = None
+    if cache_dir is not None:
+        if toolchain is None:
+            toolchain = find_vitis_hls_toolchain()
+        with span("cache_lookup", "synth", kernel=benchmark_name) as span_args:
+            cache_key = hls_synth_cache_key(
+                tcl_script_txt, benchmark_directory, toolchain.version
+            )
+            cache_hit = hls_synth_cache_load(cache_dir, cache_key, report_dir)
+            span_args["hit"] = cache_hit
+        if cache_hit:
+            print(f"{benchmark_name}: cache hit {cache_key[:12]}")
+            shutil.copy(report_dir / "csynth.rpt", temp_dir_path / "csynth.rpt")
+            if (report_dir / "csynth.xml").exists():
+                shutil.copy(report_dir / "csynth.xml", temp_dir_path / "csynth.xml")
+            return 0
+
+    if worker_pool is not None:
+        with span("vitis_hls_worker", "synth", kernel=benchmark_name):
+            result = worker_pool.run_batch(tcl_script_txt.splitlines(), temp_dir_path)
+        returncode = result.returncode
+        if result.error:
+            print(f"{benchmark_name}: {result.error}")
+    else:
+        with span("vitis_hls", "synth", kernel=benchmark_name) as span_args:
+            result = run_tool(
+                ["vitis_hls", "-f", tcl_script.resolve()],
+                cwd=temp_dir_path,
+                log_fp=temp_dir_path / "vitis_hls.log",
+                timeout=timeout,
+                memory_limit=memory_limit,
+                phases=VITIS_HLS_PHASES,
+                label=benchmark_name,
+            )
+            span_args.update(tool_span_args(result))
+        returncode = tool_returncode(result)
+        if returncode != 0:
+            print_tool_failure(benchmark_name, result)
+    print(f"{benchmark_name}: {returncode}")
+
+    if returncode == 0:
+        with span("copy_reports", "synth", kernel=benchmark_name):
+            csynth_rpt_fp = report_dir / "csynth.rpt"
+            shutil.copy(csynth_rpt_fp, temp_dir_path / "csynth.rpt")
+            if (report_dir / "csynth.xml").exists():
+                shutil.copy(report_dir / "csynth.xml", temp_dir_path / "csynth.xml")
+        if cache_dir is not None and cache_key is not None:
+            with span("cache_store", "synth", kernel=benchmark_name):
+                hls_synth_cache_store(cache_dir, cache_key, report_dir, benchmark_name)
+
+    return returncode
+
+
+def tool_returncode(result: ToolResult) -> int:
+    # a killed process has a negative return code, which callers would treat
+    # like any other failure; make sure it never looks like success
+    if result.timed_out or result.memory_exceeded:
+        return result.returncode or 1
+    return result.returncode
+
+
+def tool_span_args(result: ToolResult) -> dict:
+    return {
+        "returncode": result.returncode,
+        "peak_rss": result.peak_rss,
+        "phase": result.phase,
+        "phase_times": result.phase_times,
+        "timed_out": result.timed_out,
+    }
+
+
+def print_tool_failure(name: str, result: ToolResult) -> None:
+    print(f"{name}: {result.describe()}")
+    for line in result.tail:
+        print(f"{name} | {line}")
+
+
+@dataclass(frozen=True)
+class VitisHLSToolchain:
+    install_dir: Path
+    clang_pp: Path
+    include_dir: Path
+    # vitis_hls -version banner, an in place upgrade or patch keeps the paths
+    version: str
+
+    @property
+    def cflags(self) -> list[str]:
+        return [f"-I{self.include_dir}"]
+
+    @property
+    def identity(self) -> str:
+        # path, size and mtime of the compiler stand in for its version
+        stat = self.clang_pp.stat() if self.clang_pp.exists() else None
+        if stat is None:
+            return str(self.clang_pp)
+        return f"{self.clang_pp}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+@functools.cache
+def find_vitis_hls_toolchain() -> VitisHLSToolchain:
+    return VitisHLSToolchain(
+        install_dir=get_vitis_hls_install_dir().resolve(),
+        clang_pp=get_vitis_hls_clang_pp_path(),
+        include_dir=get_vitis_hls_include_dir(),
+        version=get_vitis_hls_version(),
+    )
+
+
+COMPILE_CACHE_DIR = Path("./compile_cache")
+
+
+def compile_cache_key(
+    toolchain: VitisHLSToolchain, benchmark_name: str, work_dir: Path
+) -> str | None:
+    # like ccache's preprocessor mode: the key covers everything the compiler
+    # actually sees, so edits to comments in unrelated headers still hit
+    p_preprocess = subprocess.run(
+        [toolchain.clang_pp, *toolchain.cflags, "-E", f"{benchmark_name}.cpp"],
+        cwd=work_dir,
         capture_output=True,
     )
-    print(f"{benchmark_name}: {p.returncode}")
+    if p_preprocess.returncode != 0:
+        return None
+    h = hashlib.sha256()
+    h.update(toolchain.identity.encode())
+    h.update(b"\0")
+    h.update(" ".join(toolchain.cflags).encode())
+    h.update(b"\0")
+    # line markers carry the absolute temp dir path, drop them
+    for line in p_preprocess.stdout.splitlines():
+        if not line.startswith(b"# "):
+            h.update(line)
+            h.update(b"\n")
+    return h.hexdigest()
+
+
+def compile_direct_key(
+    toolchain: VitisHLSToolchain, benchmark_name: str, work_dir: Path
+) -> str:
+    # like ccache's direct mode: the sources as they are on disk, without
+    # running the preprocessor; the toolchain's own headers are covered by the
+    # compiler identity
+    h = hashlib.sha256()
+    h.update(toolchain.identity.encode())
+    h.update(b"\0")
+    h.update(" ".join(toolchain.cflags).encode())
+    for fp in [work_dir / f"{benchmark_name}.cpp", *sorted(work_dir.glob("*.h"))]:
+        h.update(f"\0{fp.name}\0".encode())
+        h.update(fp.read_bytes())
+    return h.hexdigest()
+
+
+def compile_direct_lookup(cache_dir: Path, direct_key: str) -> str | None:
+    # a direct mode entry only names the preprocessed key of the binary
+    fp = cache_dir / "direct" / direct_key[:2] / direct_key
+    if not fp.exists():
+        return None
+    return fp.read_text().strip()
+
+
+def compile_direct_store(cache_dir: Path, direct_key: str, key: str) -> None:
+    fp = cache_dir / "direct" / direct_key[:2] / direct_key
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_fp = tempfile.mkstemp(dir=fp.parent, prefix=".tmp_")
+    with os.fdopen(fd, "w") as f:
+        f.write(key + "\n")
+    os.replace(tmp_fp, fp)
+
+
+def compile_cache_load(
+    cache_dir: Path, key: str, benchmark_name: str, work_dir: Path
+) -> bool:
+    cached_bin = cache_dir / key[:2] / key / benchmark_name
+    if not cached_bin.exists():
+        return False
+    shutil.copy2(cached_bin, work_dir / benchmark_name)
+    os.utime(cached_bin.parent)
+    return True
+
+
+def compile_cache_store(
+    cache_dir: Path, key: str, benchmark_name: str, work_dir: Path
+) -> None:
+    entry_dir = cache_dir / key[:2] / key
+    entry_dir.parent.mkdir(parents=True, exist_ok=True)
+    staging_dir = Path(tempfile.mkdtemp(dir=entry_dir.parent, prefix=".tmp_"))
+    shutil.copy2(work_dir / benchmark_name, staging_dir / benchmark_name)
+    try:
+        os.rename(staging_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(staging_dir)
+
+
+def compile_benchmark(
+    benchmark_directory: Path,
+    temp_dir_path: Path,
+    toolchain: VitisHLSToolchain | None = None,
+    cache_dir: Path | None = None,
+    timeout: float | None = None,
+) -> int:
+    benchmark_name = benchmark_directory.stem
 
-    if p.returncode == 0:
-        csynth_rpt_fp = (
-            temp_dir_path
-            / f"test_proj_{benchmark_name}"
-            / "solution1"
-            / "syn"
-            / "report"
-            / "csynth.rpt"
-        )
-        shutil.copy(csynth_rpt_fp, temp_dir_path / "csynth.rpt")
+    if toolchain is None:
+        toolchain = find_vitis_hls_toolchain()
+
+    with span("copy_sources", "compile", kernel=benchmark_name):
+        all_files = list(benchmark_directory.glob("*"))
+        for file in all_files:
+            shutil.copy(file, temp_dir_path)
+
+    print(f"Running HLS Synthesis : {benchmark_name} : {temp_dir_path}")
 
-    return p.returncode
+    with span("generate_makefile", "compile", kernel=benchmark_name):
+        makefile = temp_dir_path / "Makefile"
+        makefile_txt = ""
+        makefile_txt += f"CC = {toolchain.clang_pp}\n"
+        makefile_txt += f"CFLAGS = {' '.join(toolchain.cflags)}\n"
+        makefile_txt += f"all: {benchmark_name}\n"
+        makefile_txt += f"{benchmark_name}: {benchmark_name}.cpp {benchmark_name}.h\n"
+        makefile_txt += (
+            f"\t$(CC) $(CFLAGS) -o {benchmark_name} {benchmark_name}.cpp  \n"
+        )
+        makefile.write_text(makefile_txt)
+
+    cache_key = None
+    direct_key = None
+    direct_hit = False
+    if cache_dir is not None:
+        with span("cache_key", "compile", kernel=benchmark_name) as span_args:
+            direct_key = compile_direct_key(toolchain, benchmark_name, temp_dir_path)
+            cache_key = compile_direct_lookup(cache_dir, direct_key)
+            direct_hit = cache_key is not None
+            span_args["direct_hit"] = direct_hit
+            # only a direct mode miss pays for the preprocessor
+            if cache_key is None:
+                cache_key = compile_cache_key(toolchain, benchmark_name, temp_dir_path)
+
+    if cache_key is not None and compile_cache_load(
+        cache_dir, cache_key, benchmark_name, temp_dir_path
+    ):
+        print(f"compile - {benchmark_name} - cache hit {cache_key[:12]}")
+        compile_returncode = 0
+        if not direct_hit:
+            compile_direct_store(cache_dir, direct_key, cache_key)
+    else:
+        with span("make", "compile", kernel=benchmark_name) as span_args:
+            result = run_tool(
+                ["make"],
+                cwd=temp_dir_path,
+                log_fp=temp_dir_path / "compile.log",
+                timeout=timeout,
+            )
+            span_args.update(tool_span_args(result))
+        compile_returncode = tool_returncode(result)
+        print(f"compile - {benchmark_name} - {compile_returncode}")
+        if compile_returncode != 0:
+            print(f"Failed to compile {benchmark_name}")
+            print_tool_failure(benchmark_name, result)
+            return compile_returncode
+        if cache_key is not None:
+            with span("cache_store", "compile", kernel=benchmark_name):
+                compile_cache_store(cache_dir, cache_key, benchmark_name, temp_dir_path)
+                if not direct_hit:
+                    compile_direct_store(cache_dir, direct_key, cache_key)
+    return compile_returncode
+
+
+def run_benchmark(
+    benchmark_directory: Path, temp_dir_path: Path, timeout: float | None = None
+) -> int:
+    benchmark_name = benchmark_directory.stem
+    with span("run", "run", kernel=benchmark_name) as span_args:
+        result = run_tool(
+            [(temp_dir_path / benchmark_name).resolve()],
+            cwd=temp_dir_path,
+            log_fp=temp_dir_path / "run.log",
+            timeout=timeout,
+        )
+        span_args.update(tool_span_args(result))
+    returncode = tool_returncode(result)
+    print(f"run - {benchmark_name} - {returncode}")
+    if returncode != 0:
+        print(f"Failed to run {benchmark_name}")
+        print_tool_failure(benchmark_name, result)
+    return returncode
 
 
 def compile_and_run_benchmark(
-    benchmark_directory: Path, temp_dir_overide: Path | None = None
+    benchmark_directory: Path,
+    temp_dir_overide: Path | None = None,
+    toolchain: VitisHLSToolchain | None = None,
+    cache_dir: Path | None = None,
+    compile_timeout: float | None = None,
+    run_timeout: float | None = None,
 ) -> tuple[int, int | None]:
     benchmark_name = benchmark_directory.stem
 
@@ -79,50 +483,20 @@ def compile_and_run_benchmark(
         temp_dir_path = temp_dir_overide / benchmark_name
         temp_dir_path.mkdir(exist_ok=True, parents=True)
 
-    benchmark_name = benchmark_directory.stem
-    benchmark_name_c = benchmark_name.replace("-", "_")
-
-    top_fn_fp = benchmark_directory / "top.txt"
-    top_fn = top_fn_fp.read_text().strip()
-
-    all_files = list(benchmark_directory.glob("*"))
-    for file in all_files:
-        shutil.copy(file, temp_dir_path)
-
-    print(f"Running HLS Synthesis : {benchmark_name} : {temp_dir_path}")
-
-    makefile = temp_dir_path / "Makefile"
-    makefile_txt = ""
-    makefile_txt += f"CC = {get_vitis_hls_clang_pp_path()}\n"
-    makefile_txt += f"CFLAGS = -I{get_vitis_hls_include_dir()}\n"
-    makefile_txt += f"all: {benchmark_name}\n"
-    makefile_txt += f"{benchmark_name}: {benchmark_name}.cpp {benchmark_name}.h\n"
-    makefile_txt += f"\t$(CC) $(CFLAGS) -o {benchmark_name} {benchmark_name}.cpp  \n"
-    makefile.write_text(makefile_txt)
-
-    p_compile = subprocess.run(
-        ["make"],
-        cwd=temp_dir_path,
-        text=True,
-        capture_output=True,
+    compile_returncode = compile_benchmark(
+        benchmark_directory, temp_dir_path, toolchain, cache_dir, compile_timeout
+    )
+    if compile_returncode != 0:
+        return compile_returncode, None
+    return compile_returncode, run_benchmark(
+        benchmark_directory, temp_dir_path, run_timeout
     )
-    print(f"compile - {benchmark_name} - {p_compile.returncode}")
 
-    if p_compile.returncode == 0:
-        p_run = subprocess.run(
-            [temp_dir_path / benchmark_name],
-            cwd=temp_dir_path,
-            text=True,
-            capture_output=True,
-        )
-        print(f"run - {benchmark_name} - {p_run.returncode}")
-        if p_run.returncode != 0:
-            print(f"Failed to run {benchmark_name}")
-        return (p_compile.returncode, p_run.returncode)
-    else:
-        print(f"Failed to compile {benchmark_name}")
-        print(p_compile.stderr)
-        return p_compile.returncode, None
+
+def compile_and_run_succeeded(return_codes) -> bool:
+    # journaled results come back as JSON lists, and anything else was not
+    # written by compile_and_run_benchmark
+    return isinstance(return_codes, (list, tuple)) and tuple(return_codes) == (0, 0)
 
 
 def get_vitis_hls_include_dir() -> Path:
@@ -150,6 +524,18 @@ def get_vitis_hls_clang_pp_path() -> Path:
     return vitis_hls_clang_pp_path
 
 
+def get_vitis_hls_version() -> str:
+    p = subprocess.run(
+        ["vitis_hls", "-version"],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+    )
+    if p.returncode != 0:
+        raise RuntimeError(f"vitis_hls -version exited with {p.returncode}")
+    return p.stdout.strip()
+
+
 def get_vitis_hls_install_dir() -> Path:
     vitis_hls_bin_path_str = shutil.which("vitis_hls")
     if vitis_hls_bin_path_str is None:
@@ -163,33 +549,70 @@ def main(args):
     n_jobs = args.jobs
 
     error_dir = Path("./errors")
-    if error_dir.exists():
-        shutil.rmtree(error_dir)
-
     output_dir = Path("./output")
-    if output_dir.exists():
-        shutil.rmtree(output_dir)
-
     temp_dir_compile = Path("./test_temp_compile")
-    if temp_dir_compile.exists():
-        shutil.rmtree(temp_dir_compile)
-
     temp_dir_synth = Path("./test_temp_synth")
-    if temp_dir_synth.exists():
-        shutil.rmtree(temp_dir_synth)
+    # a resumed run keeps the artifacts the journal points at
+    if not args.resume:
+        for stale_dir in [error_dir, output_dir, temp_dir_compile, temp_dir_synth]:
+            if stale_dir.exists():
+                shutil.rmtree(stale_dir)
+    journal = RunJournal(args.journal, resume=args.resume)
+    config = config_id(None)
+
+    hls_cache_dir: Path | None = None if args.no_hls_cache else args.hls_cache_dir
+    if hls_cache_dir is not None:
+        evicted = evict_hls_synth_cache(
+            hls_cache_dir,
+            max_size_bytes=args.hls_cache_max_size,
+            max_age_seconds=args.hls_cache_max_age,
+        )
+        if evicted:
+            print(f"Evicted {len(evicted)} entries from HLS cache {hls_cache_dir}")
 
     benchmarks_directory = args.benchmarks_directory
-    benchmarks = sorted(list(benchmarks_directory.glob("*")))
+    benchmarks = load_benchmarks(benchmarks_directory)
 
-    benchmarks_to_test = [benchmark for benchmark in benchmarks]
+    benchmarks_to_test = [benchmark.directory for benchmark in benchmarks.values()]
 
     ### Compile and Run ###
-    return_data_compile_run = joblib.Parallel(n_jobs=n_jobs, backend="multiprocessing")(
-        joblib.delayed(compile_and_run_benchmark)(
-            benchmark, temp_dir_overide=temp_dir_compile
-        )
-        for benchmark in benchmarks_to_test
+    # the toolchain is looked up once here and shipped to every worker
+    toolchain = find_vitis_hls_toolchain()
+    compile_cache_dir = None if args.no_compile_cache else args.compile_cache_dir
+    scheduler = ResourceScheduler(
+        n_jobs,
+        memory_budget=args.max_memory,
+        max_licenses=args.max_licenses,
+        history=JobHistory(args.job_history),
+    )
+    return_data_compile_run = run_with_journal(
+        scheduler,
+        [
+            Job(
+                f"compile:{benchmark.name}",
+                compile_and_run_benchmark,
+                (benchmark,),
+                dict(
+                    temp_dir_overide=temp_dir_compile,
+                    toolchain=toolchain,
+                    cache_dir=compile_cache_dir,
+                    compile_timeout=args.compile_timeout,
+                    run_timeout=args.run_timeout,
+                ),
+                default_memory=GiB // 2,
+                stage="compile",
+                artifacts=(temp_dir_compile / benchmark.name / benchmark.name,),
+                input_hash=hash_job_inputs(
+                    benchmark, toolchain.identity, *toolchain.cflags
+                ),
+            )
+            for benchmark in benchmarks_to_test
+        ],
+        journal,
+        config,
+        succeeded=compile_and_run_succeeded,
     )
+    print(f"Compile and run: {scheduler.stats.summary()}")
     for (return_code_compile, return_code_run), benchmark in zip(
         return_data_compile_run, benchmarks_to_test
     ):
@@ -199,14 +622,99 @@ def main(args):
             print(f"Failed to run benchmark {benchmark.name}")
 
     ### HLS Synthesis ###
-    # return_data_hls = joblib.Parallel(n_jobs=n_jobs, backend="multiprocessing")(
-    #     joblib.delayed(hls_synth_benchmark)(benchmark, temp_dir_overide=temp_dir_synth)
-    #     for benchmark in benchmarks_to_test
-    # )
-    # return_codes_hls_synthesis = return_data_hls
-    # for return_code, benchmark in zip(return_codes_hls_synthesis, benchmarks_to_test):
-    #     if return_code != 0:
-    #         print(f"Failed to synthesize benchmark {benchmark.name}")
+    if not args.synth:
+        return
+
+    synth_jobs = [
+        Job(
+            f"synth:{benchmark.name}",
+            hls_synth_benchmark,
+            (benchmark,),
+            dict(
+                temp_dir_overide=temp_dir_synth,
+                cache_dir=hls_cache_dir,
+                timeout=args.synth_timeout,
+                memory_limit=args.synth_memory_limit,
+                toolchain=toolchain,
+            ),
+            uses_license=True,
+            default_memory=4 * GiB,
+            stage="synth",
+            artifacts=(temp_dir_synth / benchmark.name / "csynth.rpt",),
+            input_hash=hash_job_inputs(benchmark, toolchain.version),
+        )
+        for benchmark in benchmarks_to_test
+    ]
+    if args.hls_workers > 0:
+        # long lived vitis_hls sessions are shared between threads, the heavy
+        # lifting happens in the vitis_hls processes themselves; results are
+        # journaled from this thread as they come in
+        remaining, skipped = resume_jobs(
+            synth_jobs, journal, config, succeeded=lambda return_code: return_code == 0
+        )
+        results_by_name = dict(skipped)
+        with VitisHLSWorkerPool(
+            args.hls_workers, batch_timeout=args.synth_timeout
+        ) as worker_pool:
+            with ThreadPoolExecutor(max_workers=args.hls_workers) as executor:
+                futures = {}
+                for job in remaining:
+                    journal.record_start(job, config)
+                    futures[
+                        executor.submit(
+                            job.fn, *job.args, **job.kwargs, worker_pool=worker_pool
+                        )
+                    ] = job
+                for future in as_completed(futures):
+                    job = futures[future]
+                    return_code = future.result()
+                    journal.record_finish(job, config, return_code == 0, return_code)
+                    results_by_name[job.name] = return_code
+        return_data_hls = [results_by_name[job.name] for job in synth_jobs]
+    else:
+        # every vitis_hls process holds a license and several GB of memory
+        return_data_hls = run_with_journal(
+            scheduler,
+            synth_jobs,
+            journal,
+            config,
+            succeeded=lambda return_code: return_code == 0,
+        )
+        print(f"HLS synthesis: {scheduler.stats.summary()}")
+    return_codes_hls_synthesis = return_data_hls
+    for return_code, benchmark in zip(return_codes_hls_synthesis, benchmarks_to_test):
+        if return_code != 0:
+            print(f"Failed to synthesize benchmark {benchmark.name}")
+
+    ### QoR Report ###
+    if not args.report:
+        return
+
+    # parsing happens here in the parent so there is a single sqlite writer
+    with span("qor_report", "report"), QoRStore(args.qor_db) as store:
+        rows = []
+        for return_code, benchmark in zip(
+            return_codes_hls_synthesis, benchmarks_to_test
+        ):
+            if return_code != 0:
+                continue
+            report_dir = (
+                temp_dir_synth
+                / benchmark.name
+                / f"test_proj_{benchmark.name}"
+                / "solution1"
+                / "syn"
+                / "report"
+            )
+            run_id = store.record(
+                benchmark.name,
+                parse_report_dir(report_dir),
+                tool_version=toolchain.version,
+            )
+            rows += store.query(run_id=run_id)
+    report_txt = format_qor_table(rows)
+    print(report_txt)
+    args.report_file.write_text(report_txt + "\n")
 
 
 if __name__ == "__main__":
@@ -215,7 +723,98 @@ if __name__ == "__main__":
         "benchmarks_directory", type=Path, nargs="?", default=Path("./hls-machsuite/")
     )
     parser.add_argument("-j", "--jobs", type=int, default=16)
-    parser.add_argument("-r", "--report", action="store_true", default=False)
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        help="Memory budget in bytes for concurrent jobs (default: MemAvailable)",
+    )
+    parser.add_argument(
+        "--max-licenses",
+        type=int,
+        default=None,
+        help="At most this many concurrent vitis_hls processes",
+    )
+    parser.add_argument("--job-history", type=Path, default=JOB_HISTORY_FP)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="Keep previous results and only redo jobs the journal does not have "
+        "a successful entry for",
+    )
+    parser.add_argument("--journal", type=Path, default=JOURNAL_FP)
+    parser.add_argument(
+        "-r",
+        "--report",
+        action="store_true",
+        default=False,
+        help="Parse the synthesis reports into the QoR store and write a summary",
+    )
     parser.add_argument("-rf", "--report-file", type=Path, default=Path("./report.txt"))
+    parser.add_argument("--qor-db", type=Path, default=QOR_DB_FP)
+    parser.add_argument(
+        "-s",
+        "--synth",
+        action="store_true",
+        default=False,
+        help="Also run HLS synthesis on each benchmark",
+    )
+    parser.add_argument(
+        "--hls-workers",
+        type=int,
+        default=0,
+        help="Run synthesis on this many persistent vitis_hls -i sessions; these "
+        "bypass the scheduler, so --max-licenses and --max-memory do not limit them",
+    )
+    parser.add_argument(
+        "--compile-timeout",
+        type=float,
+        default=None,
+        help="Kill a benchmark's build after this many seconds",
+    )
+    parser.add_argument(
+        "--run-timeout",
+        type=float,
+        default=None,
+        help="Kill a benchmark's native run after this many seconds",
+    )
+    parser.add_argument(
+        "--synth-timeout",
+        type=float,
+        default=None,
+        help="Kill vitis_hls after this many seconds",
+    )
+    parser.add_argument(
+        "--synth-memory-limit",
+        type=int,
+        default=None,
+        help="Kill vitis_hls once its process group uses more than this many bytes",
+    )
+    parser.add_argument(
+        "--trace",
+        type=Path,
+        default=None,
+        nargs="?",
+        const=TRACE_DIR,
+        help="Record per stage timings and write a Chrome trace and summary",
+    )
+    parser.add_argument("--compile-cache-dir", type=Path, default=COMPILE_CACHE_DIR)
+    parser.add_argument("--no-compile-cache", action="store_true", default=False)
+    parser.add_argument("--hls-cache-dir", type=Path, default=HLS_CACHE_DIR)
+    parser.add_argument("--no-hls-cache", action="store_true", default=False)
+    parser.add_argument(
+        "--hls-cache-max-size",
+        type=int,
+        default=None,
+        help="Evict oldest HLS cache entries until the cache is below this many bytes",
+    )
+    parser.add_argument(
+        "--hls-cache-max-age",
+        type=float,
+        default=None,
+        help="Evict HLS cache entries not used in this many seconds",
+    )
     args = parser.parse_args()
-    main(args)
+    with tracing(args.trace):
+        main(args)
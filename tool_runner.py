@@ -0,0 +1,190 @@
+import asyncio
+import collections
+import os
+import re
+import signal
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+# vitis_hls log messages that mark the start / end of csynth_design phases, in
+# the order they appear
+VITIS_HLS_PHASES = [
+    ("analyze", re.compile(r"\[HLS 200-10\] Analyzing design file")),
+    ("link", re.compile(r"Finished Linking")),
+    ("transform", re.compile(r"Starting code transformations")),
+    ("synthesize", re.compile(r"Starting hardware synthesis")),
+    ("schedule", re.compile(r"Finished scheduling")),
+    ("bind", re.compile(r"Finished binding")),
+    ("rtl", re.compile(r"Finished creating RTL model|Generating all RTL models")),
+    ("done", re.compile(r"Finished Command csynth_design|Total CPU user time")),
+]
+
+KILL_GRACE_SECONDS = 5.0
+MEMORY_POLL_SECONDS = 0.5
+LOG_TAIL_LINES = 40
+# a single vitis_hls line can be very long (e.g. dumped pragmas), longer ones
+# are passed on in pieces of this size
+STREAM_LINE_LIMIT = 1 << 20
+STREAM_CHUNK_SIZE = 1 << 16
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclass
+class ToolResult:
+    returncode: int
+    duration: float
+    log_fp: Path | None = None
+    phase: str | None = None
+    # seconds from start until each phase was first seen
+    phase_times: dict[str, float] = field(default_factory=dict)
+    peak_rss: int = 0
+    timed_out: bool = False
+    memory_exceeded: bool = False
+    tail: list[str] = field(default_factory=list)
+
+    def describe(self) -> str:
+        if self.timed_out:
+            reason = f"timed out after {self.duration:.0f}s"
+        elif self.memory_exceeded:
+            reason = f"killed at {self.peak_rss / 2**20:.0f} MiB"
+        else:
+            reason = f"exited with {self.returncode}"
+        phase = f" during {self.phase}" if self.phase is not None else ""
+        log = f", log {self.log_fp}" if self.log_fp is not None else ""
+        return f"{reason}{phase}{log}"
+
+
+def process_group_rss(pgid: int) -> int:
+    # sum over every process in the group, vitis_hls forks several helpers
+    total = 0
+    for stat_fp in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            stat = stat_fp.read_text()
+        except OSError:
+            continue
+        # the fields after the parenthesised command name: state, ppid, pgrp,
+        # ... with rss (in pages) at index 21
+        fields = stat[stat.rindex(")") + 2 :].split()
+        if int(fields[2]) == pgid:
+            total += int(fields[21]) * PAGE_SIZE
+    return total
+
+
+def kill_process_group(pgid: int, sig: int) -> None:
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        pass
+
+
+async def run_tool_async(
+    cmd: list[str | Path],
+    cwd: Path,
+    log_fp: Path | None = None,
+    timeout: float | None = None,
+    memory_limit: int | None = None,
+    phases: list[tuple[str, re.Pattern]] | None = None,
+    label: str | None = None,
+    on_phase: Callable[[str, int, int], None] | None = None,
+) -> ToolResult:
+    # The tool gets its own session, so it and everything it spawns share one
+    # process group that can be measured and killed as a whole. Both streams go
+    # line by line to the log file as they arrive.
+    phases = phases or []
+    start = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        *[str(c) for c in cmd],
+        cwd=cwd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    pgid = process.pid
+    result = ToolResult(returncode=0, duration=0.0, log_fp=log_fp)
+    tail: collections.deque[str] = collections.deque(maxlen=LOG_TAIL_LINES)
+    log_f = log_fp.open("w") if log_fp is not None else None
+
+    async def pump(stream: asyncio.StreamReader) -> None:
+        # split into lines here, StreamReader's own line reading gives up on a
+        # line longer than its limit
+        buffer = b""
+        while chunk := await stream.read(STREAM_CHUNK_SIZE):
+            *raw_lines, buffer = (buffer + chunk).split(b"\n")
+            for raw_line in raw_lines:
+                handle_line(raw_line + b"\n")
+            while len(buffer) > STREAM_LINE_LIMIT:
+                handle_line(buffer[:STREAM_LINE_LIMIT])
+                buffer = buffer[STREAM_LINE_LIMIT:]
+        if buffer:
+            handle_line(buffer)
+
+    def handle_line(raw_line: bytes) -> None:
+        line = raw_line.decode(errors="replace")
+        if log_f is not None:
+            log_f.write(line)
+            log_f.flush()
+        tail.append(line.rstrip("\n"))
+        for i, (phase, pattern) in enumerate(phases):
+            if pattern.search(line):
+                result.phase = phase
+                result.phase_times.setdefault(phase, time.perf_counter() - start)
+                if on_phase is not None:
+                    on_phase(phase, i + 1, len(phases))
+                elif label is not None:
+                    print(f"{label}: {phase} ({i + 1}/{len(phases)})")
+
+    async def watch_memory() -> None:
+        while True:
+            rss = process_group_rss(pgid)
+            result.peak_rss = max(result.peak_rss, rss)
+            if memory_limit is not None and rss > memory_limit:
+                result.memory_exceeded = True
+                return
+            await asyncio.sleep(MEMORY_POLL_SECONDS)
+
+    async def finish() -> None:
+        assert process.stdout is not None and process.stderr is not None
+        await asyncio.gather(pump(process.stdout), pump(process.stderr))
+        await process.wait()
+
+    async def stop() -> None:
+        kill_process_group(pgid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.shield(finish_task), KILL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            kill_process_group(pgid, signal.SIGKILL)
+            await finish_task
+
+    finish_task = asyncio.ensure_future(finish())
+    memory_task = asyncio.ensure_future(watch_memory())
+    try:
+        done, _ = await asyncio.wait(
+            [finish_task, memory_task],
+            timeout=timeout,
+            return_when=asyncio.FIRST_COMPLETED,
+        )
+        if finish_task not in done:
+            result.timed_out = not result.memory_exceeded
+            await stop()
+    finally:
+        memory_task.cancel()
+        # cancelled (Ctrl-C in run_tool) or failed while the tool still runs;
+        # its own session never sees the terminal's SIGINT, so take the whole
+        # process group down here
+        if not finish_task.done():
+            await stop()
+        if log_f is not None:
+            log_f.close()
+
+    assert process.returncode is not None
+    result.returncode = process.returncode
+    result.duration = time.perf_counter() - start
+    result.tail = list(tail)
+    return result
+
+
+def run_tool(*args, **kwargs) -> ToolResult:
+    return asyncio.run(run_tool_async(*args, **kwargs))
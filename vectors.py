@@ -0,0 +1,249 @@
+import json
+import math
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+import c_header
+from benchmarks import VECTORS_DIR_NAME, VECTORS_SCHEMA_FILE_NAME
+from csim import c_type_to_dtype
+
+DATA_FILES = {"input": "input.data", "check": "check.data"}
+SUPPORT_FUNCTIONS = {"input": "input_to_data", "check": "output_to_data"}
+
+
+@dataclass
+class DataSection:
+    section: int
+    field: str
+    parse_type: str
+    count: str
+
+
+@dataclass
+class FieldInit:
+    field: str
+    value: str
+
+
+def parse_support_sections(support_text: str) -> dict[str, list[DataSection]]:
+    # MachSuite's local_support.c reads each "%%" section of input.data and
+    # check.data with a parse_<type>_array(s, <target>, <count>) call right
+    # after find_section_start(p, <section>); pull those triples out of the
+    # input_to_data and output_to_data bodies
+    support = c_header.scan(support_text)
+    sections: dict[str, list[DataSection]] = {}
+    for kind, function_name in SUPPORT_FUNCTIONS.items():
+        function = support.get_function(function_name)
+        sections[kind] = []
+        if function is None or function.body_start is None:
+            continue
+        body = [
+            t
+            for t in c_header.tokenize(
+                support_text[function.body_start : function.body_end]
+            )
+            if t.kind not in ("comment", "newline", "space")
+        ]
+        section = None
+        i = 0
+        while i < len(body):
+            token = body[i]
+            if token.text == "find_section_start":
+                close_idx = c_header.matching_bracket(body, i + 1)
+                call_args = c_header.split_top_level(body[i + 2 : close_idx], ",")
+                section = int(call_args[1][0].text)
+                i = close_idx
+            elif token.text == "STAC" or token.text.startswith("parse_"):
+                if token.text == "STAC":
+                    # STAC(parse_,TYPE,_array)(s, ...)
+                    stac_close = c_header.matching_bracket(body, i + 1)
+                    parse_type = body[i + 4].text
+                    open_idx = stac_close + 1
+                elif token.text == "parse_string":
+                    parse_type = "char"
+                    open_idx = i + 1
+                else:
+                    parse_type = token.text.removeprefix("parse_").removesuffix(
+                        "_array"
+                    )
+                    open_idx = i + 1
+                close_idx = c_header.matching_bracket(body, open_idx)
+                call_args = c_header.split_top_level(
+                    body[open_idx + 1 : close_idx], ","
+                )
+                target, count = call_args[1], call_args[2]
+                # the field is the member after the last "->", or a local
+                # staging array named like the field (bfs "nodes")
+                arrow_idx = [j for j, t in enumerate(target) if t.text == "->"]
+                if arrow_idx:
+                    field = target[arrow_idx[-1] + 1].text
+                else:
+                    field = [t.text for t in target if t.kind == "ident"][-1]
+                assert section is not None
+                sections[kind].append(
+                    DataSection(
+                        section,
+                        field,
+                        parse_type,
+                        " ".join(t.text for t in count),
+                    )
+                )
+                i = close_idx
+            i += 1
+    return sections
+
+
+def parse_support_inits(support_text: str) -> list[FieldInit]:
+    # input_to_data can also fill an argument with a constant before parsing,
+    # like bfs setting every level[i] = MAX_LEVEL after the memset; the kernel
+    # relies on those values, so they are part of the input vectors too
+    support = c_header.scan(support_text)
+    function = support.get_function(SUPPORT_FUNCTIONS["input"])
+    if function is None or function.body_start is None:
+        return []
+    body = [
+        t
+        for t in c_header.tokenize(
+            support_text[function.body_start : function.body_end]
+        )
+        if t.kind not in ("comment", "newline", "space")
+    ]
+    inits = []
+    for i, token in enumerate(body[:-3]):
+        # <target>->field[index] = value;
+        if token.text != "->" or body[i + 2].text != "[":
+            continue
+        close_idx = c_header.matching_bracket(body, i + 2)
+        if close_idx + 1 >= len(body) or body[close_idx + 1].text != "=":
+            continue
+        end_idx = close_idx + 2
+        while end_idx < len(body) and body[end_idx].text != ";":
+            end_idx += 1
+        value = body[close_idx + 2 : end_idx]
+        # constants only, not copies out of staging arrays (bfs "nodes")
+        if any(t.text in ("[", "->", ".") for t in value):
+            continue
+        inits.append(FieldInit(body[i + 1].text, " ".join(t.text for t in value)))
+    return inits
+
+
+def split_data_sections(data_text: str) -> list[str]:
+    # section n starts right after the n-th "%%\n"
+    return data_text.split("%%\n")[1:]
+
+
+def parse_section(
+    text: str, dtype: np.dtype, count: int, is_string: bool
+) -> np.ndarray:
+    if is_string:
+        return np.frombuffer(text.encode()[:count], dtype=dtype).copy()
+    values = text.split()[:count]
+    if dtype.kind == "f":
+        return np.array(values, dtype=np.float64).astype(dtype)
+    return np.array([int(v, 0) for v in values], dtype=np.int64).astype(dtype)
+
+
+def convert_test_vectors(
+    sources: dict[str, str], header_text: str, record: dict[str, Any], out_dir: Path
+) -> dict[str, list[dict[str, Any]]]:
+    header = c_header.scan(header_text)
+    structs = record["structs"]
+    args_by_name = {arg["name"].lower(): arg for arg in record["args"]}
+    support_sections = parse_support_sections(sources["local_support.c"])
+
+    schema: dict[str, list[dict[str, Any]]] = {}
+    for kind, data_file_name in DATA_FILES.items():
+        schema[kind] = []
+        if data_file_name not in sources:
+            continue
+        data_sections = split_data_sections(sources[data_file_name])
+        kind_dir = out_dir / kind
+        kind_dir.mkdir(parents=True, exist_ok=True)
+        for section in support_sections[kind]:
+            parse_dtype = c_type_to_dtype(
+                c_header.resolve_type(section.parse_type, header), structs
+            )
+            count = c_header.evaluate_expression(section.count, header)
+            assert isinstance(count, int)
+            array = parse_section(
+                data_sections[section.section - 1],
+                parse_dtype,
+                count,
+                section.parse_type == "char",
+            )
+
+            # give the array the dtype and shape of the matching top function
+            # argument when the bytes line up (flat doubles -> dvector_t[..])
+            arg = args_by_name.get(section.field.lower())
+            if arg is not None:
+                arg_dtype = c_type_to_dtype(arg["c_type"], structs)
+                arg_shape = tuple(arg["shape"])
+                if array.nbytes == arg_dtype.itemsize * math.prod(arg_shape):
+                    array = array.view(arg_dtype).reshape(arg_shape)
+
+            name = arg["name"] if arg is not None else section.field
+            np.save(kind_dir / f"{name}.npy", array, allow_pickle=False)
+            schema[kind].append(
+                {
+                    **asdict(section),
+                    "name": name,
+                    "file": f"{kind}/{name}.npy",
+                    "dtype": array.dtype.descr
+                    if array.dtype.names
+                    else array.dtype.str,
+                    "shape": list(array.shape),
+                    "is_arg": arg is not None,
+                }
+            )
+
+        if kind == "input":
+            # constant fills of arguments that no section overwrites
+            written = {entry["name"] for entry in schema[kind]}
+            for init in parse_support_inits(sources["local_support.c"]):
+                arg = args_by_name.get(init.field.lower())
+                if arg is None or arg["name"] in written:
+                    continue
+                arg_dtype = c_type_to_dtype(arg["c_type"], structs)
+                if arg_dtype.names:
+                    continue
+                value = c_header.evaluate_expression(init.value, header)
+                array = np.full(tuple(arg["shape"]), value, dtype=arg_dtype)
+                np.save(kind_dir / f"{arg['name']}.npy", array, allow_pickle=False)
+                written.add(arg["name"])
+                schema[kind].append(
+                    {
+                        "section": None,
+                        "field": init.field,
+                        "parse_type": None,
+                        "count": None,
+                        "init": init.value,
+                        "name": arg["name"],
+                        "file": f"{kind}/{arg['name']}.npy",
+                        "dtype": array.dtype.str,
+                        "shape": list(array.shape),
+                        "is_arg": True,
+                    }
+                )
+
+    (out_dir / VECTORS_SCHEMA_FILE_NAME).write_text(json.dumps(schema, indent=1))
+    return schema
+
+
+def load_test_vectors(
+    benchmark_dir: Path, kind: str = "input"
+) -> dict[str, np.ndarray]:
+    # arrays are memory mapped read only; the pages are shared between every
+    # process that maps the same file
+    vectors_dir = benchmark_dir / VECTORS_DIR_NAME
+    schema = json.loads((vectors_dir / VECTORS_SCHEMA_FILE_NAME).read_text())
+    return {
+        entry["name"]: np.load(vectors_dir / entry["file"], mmap_mode="r")
+        for entry in schema[kind]
+    }
+
+
+def has_test_vectors(benchmark_dir: Path) -> bool:
+    return (benchmark_dir / VECTORS_DIR_NAME / VECTORS_SCHEMA_FILE_NAME).exists()